@@ -1,5 +1,20 @@
 from engine.matrix import *
 
+# In lazy transform mode, abstracts remember where they are relative to their parent instead,
+# and only work out their objective transforms when something actually asks for them. Moving
+# an abstract then just marks everything under it as out of date instead of moving it all
+# straight away, so you only pay for the bits of the tree you actually read each frame.
+
+# It's off by default. Use set_lazy_transforms() to change it, ideally before you build your
+# scene, since only abstracts under ROOT get converted when you switch.
+
+lazyTransforms = False
+
+# Abstracts using quaternion orientation (see use_quaternion_orientation()) set their quaternion's
+# magnitude back to 1 after this many rotations, to stop rounding errors building up.
+
+RENORMALISEINTERVAL = 16
+
 class Abstract:
     def __init__(self, 
                  location:Matrix=None, 
@@ -37,6 +52,29 @@ class Abstract:
 
         self.parent = None # You used to be able to define these at initialisation but I literally never used it
         self.children = []
+
+        # This keeps track of every substract by its class, so get_substracts_of_type() can just
+        # look them up instead of crawling through the whole tree every time. Each class maps to
+        # a dictionary used as an ordered set (the values are all None).
+
+        # It gets kept up to date by the heirachy functions, so if you're changing parent or 
+        # children yourself instead of using them, it'll go out of sync.
+        self.substracts = {}
+
+        # These are only used in lazy transform mode (see the top of this file)
+        self.relativeLocation = None
+        self.relativeDistortion = None
+        self.transformDirty = False # True when the objective transform needs working out again
+
+        self.distortionInverse = None # This is filled in by get_distortion_inverse() and thrown away when the distortion changes
+
+        # These are only used if use_quaternion_orientation() is turned on. Then the distortion is 
+        # stored as a rotation quaternion and a scale, and only turned back into a matrix when it's read.
+        self.orientation = None
+        self.orientationScale = 1
+        self.orientationStale = False # True when the distortion matrix is newer than the quaternion
+        self.distortionStale = False  # True when the quaternion is newer than the distortion matrix
+        self.rotationsSinceNormalising = 0
         
         self.objectiveLocation = location if location else ORIGIN
         self.objectiveDistortion = distortion if distortion else I3     # I hate If Expressions too if that's any consolation
@@ -82,6 +120,124 @@ class Abstract:
         
     
     
+    # The objective transforms are properties so that lazy mode can work them out when they're read.
+    # Outside of lazy mode they just get stored like normal.
+
+    # Every abstract has its own copy of its transform, which the transform functions change in
+    # place instead of making new matrices every time. That means the matrix you get from 
+    # objectiveLocation will change when the abstract moves, so copy() it if you want to keep it.
+
+    @property
+    def objectiveLocation(self):
+        if self.transformDirty:
+            self.resolve_transform()
+
+        return self.storedLocation
+    
+    @objectiveLocation.setter
+    def objectiveLocation(self, location:Matrix):
+        self.storedLocation = to_compact(location).copy() # Normal matrices get swapped for the quicker Vec3 and Mat3
+
+        if lazyTransforms:
+            if self.parent:
+                self.relativeLocation = self.parent.get_distortion_inverse().apply(location.subtract(self.parent.objectiveLocation))
+            else:
+                self.relativeLocation = self.storedLocation.copy()
+
+            for child in self.children:
+                child.mark_transform_dirty()
+
+        self.transform_changed()
+
+    @property
+    def objectiveDistortion(self):
+        if self.transformDirty:
+            self.resolve_transform()
+
+        if self.distortionStale:
+            self.orientation.get_mat3(self.storedDistortion).iscale(self.orientationScale)
+            self.distortionStale = False
+
+        return self.storedDistortion
+    
+    @objectiveDistortion.setter
+    def objectiveDistortion(self, distortion:Matrix):
+        self.storedDistortion = to_compact(distortion).copy()
+        self.distortion_changed()
+
+        if lazyTransforms:
+            if self.parent:
+                self.relativeDistortion = self.parent.get_distortion_inverse().apply(distortion)
+            else:
+                self.relativeDistortion = self.storedDistortion.copy()
+
+            for child in self.children:
+                child.mark_transform_dirty()
+
+        self.transform_changed()
+
+    def resolve_transform(self): # Works out the objective transform from the relative one in lazy mode
+        if self.parent:
+            parentDistortion = self.parent.objectiveDistortion # This resolves the parent first if it needs it
+
+            parentDistortion.apply(self.relativeDistortion, self.storedDistortion)
+            parentDistortion.apply(self.relativeLocation, self.storedLocation).iadd(self.parent.objectiveLocation)
+        else:
+            self.relativeDistortion.copy(self.storedDistortion)
+            self.relativeLocation.copy(self.storedLocation)
+
+        self.distortion_changed()
+        self.transformDirty = False
+
+    def mark_transform_dirty(self):
+        # If we're already dirty, everything under us must be too, so we can stop here. 
+        # This is what stops moving something every frame from costing the whole subtree.
+        if self.transformDirty:
+            return
+        
+        self.transformDirty = True
+        self.transform_changed()
+
+        if self.orientation is not None: # Our parent's moved us, so our quaternion's out of date too
+            self.orientationStale = True
+
+        for child in self.children:
+            child.mark_transform_dirty()
+
+    def keep_objective_transform(self, location:Matrix, distortion:Matrix):
+        # In lazy mode, giving an abstract a new parent would make it jump along with its 
+        # relative transform, so this puts it back where it was.
+        self.objectiveDistortion = distortion
+        self.objectiveLocation = location
+
+        self.mark_transform_dirty() # The new parent might not be worked out yet
+
+    def distortion_changed(self):
+        # This gets called whenever the distortion matrix itself gets changed
+        self.distortionInverse = None
+        self.distortionStale = False
+
+        if self.orientation is not None:
+            self.orientationStale = True
+
+    def get_distortion_inverse(self):
+        # Loads of things need to undo an abstract's distortion every frame, so we keep hold of 
+        # the inverse until the distortion changes. Don't change the matrix you get from this!
+        distortion = self.objectiveDistortion # In lazy mode this might throw the old inverse away
+
+        if self.distortionInverse is None:
+            self.distortionInverse = distortion.get_quick_3x3_inverse()
+
+        return self.distortionInverse
+
+    def transform_changed(self):
+        # This gets called whenever the objective transform changes or goes out of date.
+        # It doesn't do anything here, but subclasses can use it to throw away anything 
+        # they've worked out from their transform.
+        pass
+        
+
+
     def get_type(self):
         return self.__class__
     
@@ -93,15 +249,51 @@ class Abstract:
 
         return found
     
-    def get_substracts_of_type(self, type): # Substracts are all abstracts underneath an abstract,
-        found = []                          # meaning its children, its children's children, etc.
-        for child in self.children:
-            if child.__class__ == type:     # The same applies to parents and superstracts;
-                found.append(child)         # parents are directly above, superstracts are everything
-                                            # above
-            found += child.get_substracts_of_type(type)
-            
+    def get_substracts_of_type(self, type, includeSubclasses:bool=False): # Substracts are all abstracts underneath an abstract,
+        if not includeSubclasses:                                           # meaning its children, its children's children, etc.
+            return list(self.substracts.get(type, ()))                      
+                                                                            # The same applies to parents and superstracts;
+        found = []                                                          # parents are directly above, superstracts are everything
+        for substractType, substracts in self.substracts.items():           # above
+            if issubclass(substractType, type): # So asking for Light gets you SunLights too
+                found += substracts
+
+        return found
+    
+    def get_all_substracts(self):
+        found = []
+        for substracts in self.substracts.values():
+            found += substracts
+
         return found
+    
+    def index_substracts(self, abstract, stop=None):
+        # Adds an abstract and everything under it to the index of this abstract and all of its 
+        # superstracts, up to (but not including) stop
+        newSubstracts = [abstract] + abstract.get_all_substracts()
+
+        superstract = self
+        while superstract and superstract is not stop:
+            for substract in newSubstracts:
+                superstract.substracts.setdefault(substract.__class__, {})[substract] = None
+
+            superstract = superstract.parent
+
+    def unindex_substracts(self, abstract, stop=None, includeSubstracts:bool=True):
+        # The opposite of index_substracts(). If includeSubstracts is False, only the abstract itself 
+        # is taken out, for when its children are staying where they are.
+        oldSubstracts = [abstract] + abstract.get_all_substracts() if includeSubstracts else [abstract]
+
+        superstract = self
+        while superstract and superstract is not stop:
+            for substract in oldSubstracts:
+                members = superstract.substracts[substract.__class__]
+                del members[substract]
+
+                if not members:
+                    del superstract.substracts[substract.__class__]
+
+            superstract = superstract.parent
         
         
     # Heirachy functions
@@ -110,12 +302,20 @@ class Abstract:
         return self.parent
     
     def set_parent(self, newParent):
+        if lazyTransforms:
+            location, distortion = self.objectiveLocation, self.objectiveDistortion
+
         if self.parent:
             self.parent.children.remove(self)
+            self.parent.unindex_substracts(self)
         self.parent = newParent
             
         if not self in newParent.children:
             newParent.children.append(self)
+            newParent.index_substracts(self)
+
+        if lazyTransforms:
+            self.keep_objective_transform(location, distortion)
         
         
         
@@ -123,46 +323,72 @@ class Abstract:
         return self.children
     
     def add_child_relative(self, newChild):
+        location, distortion = newChild.objectiveLocation, newChild.objectiveDistortion # These become the relative transform
+
         if newChild.parent:
             newChild.parent.children.remove(newChild)
+            newChild.parent.unindex_substracts(newChild)
         newChild.parent = self
 
-        newChild.set_location_relative(newChild.objectiveLocation)
-        newChild.set_distortion_relative(newChild.objectiveDistortion)
+        newChild.set_location_relative(location)
+        newChild.set_distortion_relative(distortion)
         
         if not newChild in self.children:
             self.children.append(newChild)
+            self.index_substracts(newChild)
         
     def remove_child(self, child):
         if self.parent:
+            location, distortion = child.objectiveLocation, child.objectiveDistortion
             child.parent = self.parent
         else:
             return
             
         self.children.remove(child)
+        self.unindex_substracts(child, self.parent) # It's still under our parent, so only we need to forget it
 
         self.parent.children.append(child)
+
+        if lazyTransforms:
+            child.keep_objective_transform(location, distortion)
         
         
 
     def kill_self(self): # This is figurative and does not need to be shown to Pastoral
         if self.parent:
-            for child in self.children:
+            for child in self.children: # Our children get passed up to our parent
+                location, distortion = child.objectiveLocation, child.objectiveDistortion
+
                 child.parent = self.parent
+                self.parent.children.append(child)
+
+                if lazyTransforms:
+                    child.keep_objective_transform(location, distortion)
 
-            self.parent.remove_child(self)  
+            self.parent.children.remove(self)
+            self.parent.unindex_substracts(self, includeSubstracts=False)
+
+            self.parent = None
+            self.children = []
+            self.substracts = {}
             
             del self
         else:
             print("Why are you trying to delete the origin? Not cool man")
 
     def kill_self_and_substracts(self): # Neither does this
-        if self.children:
-            for child in self.children:
-                child.delete_self_and_substracts()
-        
+        # The substracts go with us, so we only need to cut ourselves off from our parent
         if self.parent:
+            location, distortion = self.objectiveLocation, self.objectiveDistortion
+
             self.parent.children.remove(self)
+            self.parent.unindex_substracts(self)
+
+            self.parent = None
+
+            if lazyTransforms:
+                self.keep_objective_transform(location, distortion)
+
             del self
 
     
@@ -184,11 +410,22 @@ class Abstract:
 
         self.objectiveLocation = location
 
+        if lazyTransforms: # The children just get marked as out of date instead
+            return
+
         for child in self.get_children():
             child.translate_objective(vector)
     
     def translate_objective(self, vector:Matrix):
-        self.objectiveLocation = self.objectiveLocation.add(vector)
+        if lazyTransforms:
+            self.objectiveLocation = self.objectiveLocation.add(vector)
+            return
+        
+        if vector is self.storedLocation: # Our children still need to move by the old amount
+            vector = vector.copy()
+        
+        self.storedLocation.iadd(vector)
+        self.transform_changed()
 
         for child in self.get_children():
             child.translate_objective(vector)
@@ -196,8 +433,11 @@ class Abstract:
     # Relative
 
     def get_location_relative(self):
+        if lazyTransforms:
+            return self.relativeLocation
+        
         if self.parent:
-            return self.parent.objectiveDistortion.get_3x3_inverse().apply(self.objectiveLocation.subtract(self.parent.objectiveLocation))
+            return self.parent.get_distortion_inverse().apply(self.objectiveLocation.subtract(self.parent.objectiveLocation))
             # This subtracts the parent's location to move the origin to the parent, and then reverses the
             # parent's distortion to get the relative coordinate
         else:
@@ -205,7 +445,11 @@ class Abstract:
             # If it has no parent, it must be the root, so we just have to find it's objective location
 
     def set_location_relative(self, location:Matrix):
-        if self.parent:
+        if lazyTransforms:
+            self.relativeLocation = to_compact(location).copy()
+            self.mark_transform_dirty()
+        
+        elif self.parent:
             self.set_location_objective(self.parent.objectiveDistortion.apply(location).add(self.parent.objectiveLocation))
             # This starts by distorting the location to make it relative to the parent's axes, and then
             # moves it from the objective origin to the parent
@@ -232,7 +476,7 @@ class Abstract:
     def set_distortion_objective(self, distortion:Matrix, pivot:Matrix=None):
         distortionPivot = pivot if pivot else self.objectiveLocation
 
-        transformation = distortion.apply(self.objectiveDistortion.get_3x3_inverse())
+        transformation = distortion.apply(self.get_distortion_inverse())
 
         # That's the distortion matrix you have to apply to skew the current distortion
         # to the target one. This works because:
@@ -249,8 +493,15 @@ class Abstract:
         #                                                                                                        |
         # Therefore ----------------------------------------------------------------------------------------------
 
-        self.objectiveDistortion = distortion
-        self.objectiveLocation = transformation.apply(self.objectiveLocation.subtract(distortionPivot)).add(distortionPivot)
+        if lazyTransforms:
+            self.objectiveDistortion = distortion
+            self.objectiveLocation = transformation.apply(self.objectiveLocation.subtract(distortionPivot)).add(distortionPivot)
+        else:
+            to_compact(distortion).copy(self.storedDistortion)
+            self.distortion_changed()
+            distortionPivot = self.move_round_pivot(transformation, pivot)
+
+            self.transform_changed()
 
         # That last line changed the abstract's location to move it round the pivot point.
         # Most of the time you won't need a pivot, but it's used when this recurrs over
@@ -279,6 +530,9 @@ class Abstract:
         # origin to the pivot. Then, we just move the origin back by adding the
         # pivot's location back to everything.
 
+        if lazyTransforms:
+            return
+
         for child in self.children:
             child.distort_objective(transformation, distortionPivot) # This makes all the substracts
                                                            # move to keep their relative
@@ -287,30 +541,69 @@ class Abstract:
     def distort_objective(self, transformation:Matrix, pivot:Matrix=None):
         distortionPivot = pivot if pivot else self.objectiveLocation
 
-        self.objectiveDistortion = transformation.apply(self.objectiveDistortion)
-        self.objectiveLocation = transformation.apply(self.objectiveLocation.subtract(distortionPivot)).add(distortionPivot)
+        if lazyTransforms:
+            self.objectiveDistortion = transformation.apply(self.objectiveDistortion)
+            self.objectiveLocation = transformation.apply(self.objectiveLocation.subtract(distortionPivot)).add(distortionPivot)
+        else:
+            distortion = self.objectiveDistortion # This makes sure it's up to date if we're using a quaternion
+
+            if transformation is distortion: # Our children still need the old one
+                transformation = transformation.copy()
+
+            transformation.apply(distortion, distortion)
+            self.distortion_changed()
+            distortionPivot = self.move_round_pivot(transformation, pivot)
+
+            self.transform_changed()
+
+        if lazyTransforms:
+            return
 
         for child in self.children:
             child.distort_objective(transformation, distortionPivot)
 
+    def move_round_pivot(self, transformation:Matrix, pivot:Matrix=None):
+        # This does the moving round the pivot bit of the distortion functions in place, and 
+        # gives back the pivot our substracts should use.
+
+        # If there's no pivot, we're spinning round our own location, so we don't actually 
+        # move. Our children need to spin round where we are too, but they get a copy, because 
+        # our location might get changed in place while they're still using it.
+        if pivot is None or pivot is self.storedLocation:
+            return self.storedLocation.copy()
+        
+        transformation.apply(self.storedLocation.isub(pivot), self.storedLocation).iadd(pivot)
+
+        return pivot
+
     # Relative
 
     def get_distortion_relative(self):
+        if lazyTransforms:
+            return self.relativeDistortion
+        
         if self.parent:
-            return self.parent.objectiveDistortion.get_3x3_inverse().apply(self.objectiveDistortion)
+            return self.parent.get_distortion_inverse().apply(self.objectiveDistortion)
             # Here we just undo the parent's distortion
         else:
             return self.objectiveDistortion
         
     def set_distortion_relative(self, distortion):
-        if self.parent:
+        if lazyTransforms:
+            self.relativeDistortion = to_compact(distortion).copy()
+            self.mark_transform_dirty()
+
+        elif self.parent:
             self.set_distortion_objective(self.parent.objectiveDistortion.apply(distortion))
         else:
             self.set_distortion_objective(distortion)
 
     def distort_relative(self, transformation):
         if self.parent:
-            self.distort_objective(self.parent.objectiveDistortion.apply(transformation).apply(self.parent.objectiveDistortion.get_3x3_inverse()))
+            parentDistortion = self.parent.objectiveDistortion
+            relativeTransformation = parentDistortion.apply(transformation)
+
+            self.distort_objective(relativeTransformation.apply(self.parent.get_distortion_inverse(), relativeTransformation))
             # We need to appply the inverse at the end of this function but *not* set_distortion_relative
             # becasue reasons. I'll be entirely honest idk why I just applied the inverse on a whim while
             # bug fixing and it worked but it messed up set_distortion_relative when I put it on there
@@ -323,8 +616,96 @@ class Abstract:
 
 
     # Rotation functions
+
+    def use_quaternion_orientation(self, enabled:bool=True):
+        # This makes rotate_euler_radians() store our rotation as a quaternion instead of
+        # multiplying matrices together. It's quicker and doesn't drift, so it's good for 
+        # things that spin every frame. Only works if our distortion is just a rotation
+        # and a scale that's the same in every direction.
+        if not enabled:
+            self.objectiveDistortion # Make sure the matrix is up to date before we stop using the quaternion
+
+            self.orientation = None
+            self.orientationStale = False
+            return
+        
+        self.orientation = Quaternion(1, 0, 0, 0) # This gets replaced straight away
+        self.orientationStale = True
+
+        if self.get_orientation() is None:
+            print(f"{self.tags} can't use quaternion orientation because its distortion isn't just a rotation and scale")
+            self.orientation = None
+            self.orientationStale = False
+
+    def get_orientation(self):
+        # Gives you our rotation as a quaternion, or None if our distortion has been squashed or 
+        # flipped so it isn't just a rotation and scale. If we're not using quaternion orientation
+        # this gets worked out from the matrix every time.
+        if self.orientation is not None and not self.orientationStale:
+            return self.orientation
+        
+        distortion = self.objectiveDistortion
+        scaleSquared = distortion.get_uniform_scale_squared()
+
+        if scaleSquared is None or distortion.get_3x3_determinant() < 0: # A negative determinant means it's been flipped
+            return None
+        
+        scale = math.sqrt(scaleSquared)
+        orientation = quaternion_from_mat3(distortion.multiply_scalar(1 / scale))
+
+        if self.orientation is not None:
+            self.orientation = orientation
+            self.orientationScale = scale
+            self.orientationStale = False
+
+        return orientation
+    
+    def rotate_quaternion_relative(self, rotation:Quaternion):
+        # The quaternion version of distort_relative(), for when we're using quaternion orientation.
+        # This gives back False without doing anything if we or our parent can't be described 
+        # by a quaternion, so you can fall back to the matrix way.
+        if self.orientation is None or self.get_orientation() is None:
+            return False
+
+        if self.parent:
+            parentOrientation = self.parent.get_orientation()
+
+            if parentOrientation is None:
+                return False
+            
+            # Turn the rotation from our parent's axes into objective ones
+            rotation = parentOrientation.multiply(rotation).multiply(parentOrientation.get_conjugate())
+
+        self.orientation = rotation.multiply(self.orientation)
+        self.rotationsSinceNormalising += 1
+
+        if self.rotationsSinceNormalising >= RENORMALISEINTERVAL:
+            self.orientation.normalise()
+            self.rotationsSinceNormalising = 0
+
+        if lazyTransforms:
+            # Lazy mode needs the matrix to work out our relative distortion, so it can't wait
+            self.objectiveDistortion = self.orientation.get_mat3().iscale(self.orientationScale)
+            self.orientationStale = False # The matrix came from the quaternion, so they still agree
+            return True
+
+        self.distortionStale = True # The matrix gets made when someone reads it
+        self.distortionInverse = None
+        self.transform_changed()
+
+        if self.children:
+            transformation = rotation.get_mat3()
+            pivot = self.storedLocation.copy()
+
+            for child in self.children:
+                child.distort_objective(transformation, pivot)
+
+        return True
         
     def rotate_euler_radians(self, x:float, y:float, z:float): # This follows the order yxz
+        if self.orientation is not None and self.rotate_quaternion_relative(quaternion_from_euler_radians(x, y, z)):
+            return
+
         sinx = math.sin(x)
         cosx = math.cos(x)
         siny = math.sin(y)
@@ -332,21 +713,44 @@ class Abstract:
         sinz = math.sin(z)
         cosz = math.cos(z)
         
-        rotationMatrix = Matrix([[cosz, -sinz, 0], # This is wrong, fix later
-                                 [sinz, cosz, 0],
-                                 [0, 0, 1]]).apply(
-                         
-                         Matrix([[1, 0, 0],
-                                 [0, cosx, -sinx],
-                                 [0, sinx, cosx]])).apply(
+        rotationMatrix = Mat3(cosz, -sinz, 0, # This is wrong, fix later
+                              sinz, cosz, 0,
+                              0, 0, 1)
+        
+        rotationMatrix.apply(Mat3(1, 0, 0,
+                                  0, cosx, -sinx,
+                                  0, sinx, cosx), rotationMatrix).apply(
                                      
-                         Matrix([[cosy, 0, siny],
-                                 [0, 1, 0],
-                                 [-siny, 0, cosy]]))
+                             Mat3(cosy, 0, siny,
+                                  0, 1, 0,
+                                  -siny, 0, cosy), rotationMatrix)
         
         self.distort_relative(rotationMatrix) # Change back to relative when it's fixed
         
 
 # This is the head of our heirachy
 
-ROOT = Abstract()
\ No newline at end of file
+ROOT = Abstract()
+
+
+
+def set_lazy_transforms(enabled:bool):
+    global lazyTransforms
+
+    if enabled == lazyTransforms:
+        return
+    
+    abstracts = [ROOT] + ROOT.get_all_substracts()
+
+    if enabled:
+        # Everything's objective transform is up to date, so we just need to work out the relative ones
+        for abstract in abstracts:
+            abstract.relativeLocation = abstract.get_location_relative()
+            abstract.relativeDistortion = abstract.get_distortion_relative()
+    else:
+        # Work everything out one last time so the stored transforms are all correct again
+        for abstract in abstracts:
+            abstract.objectiveLocation
+            abstract.objectiveDistortion
+
+    lazyTransforms = enabled
\ No newline at end of file
@@ -0,0 +1,411 @@
+import math
+import numpy
+
+from engine.matrix import *
+
+# This is a bounding volume hierarchy (BVH); a tree of boxes, where every box fits round
+# everything in the boxes under it. If you want to know what a ray or a sphere hits, you can
+# skip any box it misses along with everything inside it, so you only ever have to look at a
+# few branches of the tree instead of every single thing in it.
+
+# Everything in here works on plain [x, y, z] lists rather than Matrices, since there's a lot
+# of maths going on and it's quite a bit quicker that way.
+
+
+
+def dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def cross(a, b):
+    return [a[1] * b[2] - a[2] * b[1],
+            a[2] * b[0] - a[0] * b[2],
+            a[0] * b[1] - a[1] * b[0]]
+
+def subtract(a, b):
+    return [a[0] - b[0], a[1] - b[1], a[2] - b[2]]
+
+def apply_mat3(matrix:Mat3, vector:list): # Does matrix.apply() on a list
+    x, y, z = vector
+
+    return [matrix.m00 * x + matrix.m01 * y + matrix.m02 * z,
+            matrix.m10 * x + matrix.m11 * y + matrix.m12 * z,
+            matrix.m20 * x + matrix.m21 * y + matrix.m22 * z]
+
+def boxes_overlap(low, high, otherLow, otherHigh):
+    return (low[0] <= otherHigh[0] and otherLow[0] <= high[0] and
+            low[1] <= otherHigh[1] and otherLow[1] <= high[1] and
+            low[2] <= otherHigh[2] and otherLow[2] <= high[2])
+
+
+
+def ray_hits_box(low, high, origin, direction, inverseDirection, maxDistance):
+    # This is the slab test. Each pair of opposite faces makes a slab, and the ray is inside the
+    # box for the bit where it's inside all three slabs at once. Gives back how far along the ray
+    # it goes into the box, or None if it misses.
+    nearest = 0
+    furthest = maxDistance
+
+    for axis in range(3):
+        if direction[axis] == 0: # We're going parallel to this slab, so we're either always in it or never
+            if origin[axis] < low[axis] or origin[axis] > high[axis]:
+                return None
+
+            continue
+
+        near = (low[axis] - origin[axis]) * inverseDirection[axis]
+        far = (high[axis] - origin[axis]) * inverseDirection[axis]
+
+        if near > far:
+            near, far = far, near
+
+        if near > nearest:
+            nearest = near
+        if far < furthest:
+            furthest = far
+
+        if nearest > furthest:
+            return None
+
+    return nearest
+
+def ray_hits_sphere(origin, direction, center, radius, maxDistance):
+    # direction has to be normalised for this one. Gives back the distance to the hit or None
+    offset = subtract(origin, center)
+
+    b = dot(offset, direction)
+    c = dot(offset, offset) - radius ** 2
+
+    if c > 0 and b > 0: # We're outside it and pointing away
+        return None
+
+    discriminant = b ** 2 - c
+
+    if discriminant < 0:
+        return None
+
+    distance = max(-b - math.sqrt(discriminant), 0) # If we start inside it, it counts as hitting straight away
+
+    return distance if distance <= maxDistance else None
+
+def ray_hits_triangle(origin, direction, a, b, c, maxDistance):
+    # This is the Möller-Trumbore method. It works out the hit as a distance along the ray and
+    # two barycentric coordinates at the same time, so it never has to work out the triangle's plane.
+    # Triangles count from both sides.
+    edge1 = subtract(b, a)
+    edge2 = subtract(c, a)
+
+    p = cross(direction, edge2)
+    determinant = dot(edge1, p)
+
+    if abs(determinant) < 1e-12: # The ray's parallel to the triangle
+        return None
+
+    inverseDeterminant = 1 / determinant
+
+    offset = subtract(origin, a)
+    u = dot(offset, p) * inverseDeterminant
+
+    if u < 0 or u > 1:
+        return None
+
+    q = cross(offset, edge1)
+    v = dot(direction, q) * inverseDeterminant
+
+    if v < 0 or u + v > 1:
+        return None
+
+    distance = dot(edge2, q) * inverseDeterminant
+
+    return distance if 0 <= distance <= maxDistance else None
+
+def closest_point_on_triangle(point, a, b, c):
+    # Works out which bit of the triangle (a corner, an edge or the face) is closest to the point,
+    # and then the closest point on that. This is the version from Real-Time Collision Detection.
+    ab = subtract(b, a)
+    ac = subtract(c, a)
+    ap = subtract(point, a)
+
+    d1 = dot(ab, ap)
+    d2 = dot(ac, ap)
+
+    if d1 <= 0 and d2 <= 0:
+        return list(a)
+
+    bp = subtract(point, b)
+    d3 = dot(ab, bp)
+    d4 = dot(ac, bp)
+
+    if d3 >= 0 and d4 <= d3:
+        return list(b)
+
+    vc = d1 * d4 - d3 * d2
+
+    if vc <= 0 and d1 >= 0 and d3 <= 0: # On the edge from a to b
+        v = d1 / (d1 - d3)
+        return [a[0] + ab[0] * v, a[1] + ab[1] * v, a[2] + ab[2] * v]
+
+    cp = subtract(point, c)
+    d5 = dot(ab, cp)
+    d6 = dot(ac, cp)
+
+    if d6 >= 0 and d5 <= d6:
+        return list(c)
+
+    vb = d5 * d2 - d1 * d6
+
+    if vb <= 0 and d2 >= 0 and d6 <= 0: # On the edge from a to c
+        w = d2 / (d2 - d6)
+        return [a[0] + ac[0] * w, a[1] + ac[1] * w, a[2] + ac[2] * w]
+
+    va = d3 * d6 - d5 * d4
+
+    if va <= 0 and d4 - d3 >= 0 and d5 - d6 >= 0: # On the edge from b to c
+        w = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        return [b[0] + (c[0] - b[0]) * w, b[1] + (c[1] - b[1]) * w, b[2] + (c[2] - b[2]) * w]
+
+    # Otherwise it's somewhere on the face
+    denominator = 1 / (va + vb + vc)
+    v = vb * denominator
+    w = vc * denominator
+
+    return [a[0] + ab[0] * v + ac[0] * w,
+            a[1] + ab[1] * v + ac[1] * w,
+            a[2] + ab[2] * v + ac[2] * w]
+
+
+
+class BVH():
+    # lows and highs are the corners of the box round each item, and the items are just their
+    # index in those lists. Whatever's using the tree keeps track of what the items actually are.
+    def __init__(self, lows:list, highs:list, leafSize:int=None):
+        self.leafSize = leafSize if leafSize else 4
+
+        self.lows = lows
+        self.highs = highs
+
+        self.order = list(range(len(lows))) # The items, shuffled so every node's items are next to each other
+
+        # Nodes are stored in lists rather than as objects. Children always come after their parents.
+        self.nodeLows = []
+        self.nodeHighs = []
+        self.nodeChildren = [] # (left, right), or None for leaves
+        self.nodeRanges = [] # (start, end) of the node's items in order
+        self.nodeParents = []
+
+        self.itemLeaves = [0] * len(lows) # Which leaf each item is in, for refitting
+
+        if lows:
+            self.build_node(0, len(lows), None)
+
+    def get_union(self, items):
+        lows = self.lows
+        highs = self.highs
+
+        return ([min(lows[item][axis] for item in items) for axis in range(3)],
+                [max(highs[item][axis] for item in items) for axis in range(3)])
+
+    def build_node(self, start:int, end:int, parent:int):
+        node = len(self.nodeLows)
+        items = self.order[start:end]
+
+        low, high = self.get_union(items)
+
+        self.nodeLows.append(low)
+        self.nodeHighs.append(high)
+        self.nodeChildren.append(None)
+        self.nodeRanges.append((start, end))
+        self.nodeParents.append(parent)
+
+        if end - start <= self.leafSize:
+            for item in items:
+                self.itemLeaves[item] = node
+
+            return node
+
+        # Split the items in half along whichever axis their centers are most spread out on
+        centers = [[self.lows[item][axis] + self.highs[item][axis] for axis in range(3)] for item in items]
+        spreads = [max(center[axis] for center in centers) - min(center[axis] for center in centers) for axis in range(3)]
+        axis = spreads.index(max(spreads))
+
+        self.order[start:end] = [item for center, item in sorted(zip(centers, items), key=lambda pair: pair[0][axis])]
+
+        middle = (start + end) // 2
+
+        left = self.build_node(start, middle, node)
+        right = self.build_node(middle, end, node)
+
+        self.nodeChildren[node] = (left, right)
+
+        return node
+
+    def refit(self, items:list):
+        # Call this after changing the boxes of some items. Instead of building the whole tree
+        # again, this just grows or shrinks the boxes above them, and stops going up as soon as
+        # a box doesn't change.
+        for item in items:
+            node = self.itemLeaves[item]
+
+            while node is not None:
+                children = self.nodeChildren[node]
+
+                if children:
+                    left, right = children
+                    low = [min(self.nodeLows[left][axis], self.nodeLows[right][axis]) for axis in range(3)]
+                    high = [max(self.nodeHighs[left][axis], self.nodeHighs[right][axis]) for axis in range(3)]
+                else:
+                    start, end = self.nodeRanges[node]
+                    low, high = self.get_union(self.order[start:end])
+
+                if low == self.nodeLows[node] and high == self.nodeHighs[node]:
+                    break
+
+                self.nodeLows[node] = low
+                self.nodeHighs[node] = high
+
+                node = self.nodeParents[node]
+
+    def query_box(self, low, high):
+        # Gives back every item whose box overlaps this one
+        found = []
+
+        if not self.nodeLows:
+            return found
+
+        stack = [0]
+
+        while stack:
+            node = stack.pop()
+
+            if not boxes_overlap(low, high, self.nodeLows[node], self.nodeHighs[node]):
+                continue
+
+            children = self.nodeChildren[node]
+
+            if children:
+                stack += children
+            else:
+                start, end = self.nodeRanges[node]
+
+                for item in self.order[start:end]:
+                    if boxes_overlap(low, high, self.lows[item], self.highs[item]):
+                        found.append(item)
+
+        return found
+
+    def query_ray(self, origin, direction, maxDistance:float, hit_item, findAll:bool=False):
+        # hit_item(item, maxDistance) should do the proper check against an item whose box the ray
+        # goes through, and give back a tuple starting with the distance to the hit (or None).
+
+        # This gives back the closest hit's tuple, or a list of all of them if findAll is True.
+        inverseDirection = [1 / component if component else 0 for component in direction]
+
+        nearest = None
+        hits = []
+
+        if not self.nodeLows:
+            return hits if findAll else None
+
+        stack = [0]
+
+        while stack:
+            node = stack.pop()
+
+            # Once we've hit something, anything further away than it can be skipped
+            if ray_hits_box(self.nodeLows[node], self.nodeHighs[node], origin, direction, inverseDirection, maxDistance) is None:
+                continue
+
+            children = self.nodeChildren[node]
+
+            if children:
+                stack += children
+                continue
+
+            start, end = self.nodeRanges[node]
+
+            for item in self.order[start:end]:
+                if ray_hits_box(self.lows[item], self.highs[item], origin, direction, inverseDirection, maxDistance) is None:
+                    continue
+
+                hit = hit_item(item, maxDistance)
+
+                if hit is None:
+                    continue
+
+                if findAll:
+                    hits.append(hit)
+                elif hit[0] <= maxDistance:
+                    nearest = hit
+                    maxDistance = hit[0]
+
+        if findAll:
+            return sorted(hits, key=lambda hit: hit[0])
+
+        return nearest
+
+
+
+class TriangleTree(BVH):
+    # A BVH over a load of triangles that don't move relative to each other, like the triangles
+    # of a mesh in the mesh's own space. Build it once, and then move rays and spheres into the
+    # same space to check them against it.
+    def __init__(self, corners:numpy.ndarray, leafSize:int=None):
+        # corners should be an array of triangles, one per row, each with three [x, y, z] corners
+        corners = numpy.asarray(corners, numpy.float64).reshape(-1, 3, 3)
+
+        self.corners = corners.tolist()
+
+        super().__init__(corners.min(axis=1).tolist(), corners.max(axis=1).tolist(), leafSize)
+
+    def get_triangle_count(self):
+        return len(self.corners)
+
+    def raycast(self, origin, direction, maxDistance:float=math.inf):
+        # Gives back (distance, triangle index) for the closest triangle the ray hits, or None.
+        # direction doesn't have to be normalised; distances are measured in lengths of it.
+        corners = self.corners
+
+        def hit_triangle(triangle, maxDistance):
+            distance = ray_hits_triangle(origin, direction, *corners[triangle], maxDistance)
+            return None if distance is None else (distance, triangle)
+
+        return self.query_ray(origin, direction, maxDistance, hit_triangle)
+
+    def get_triangles_near_box(self, low, high):
+        return self.query_box(low, high)
+    
+    def get_closest_point(self, point, radius:float, location:Vec3, distortion:Mat3, inverse:Mat3):
+        # Finds the closest point on any triangle to point, as long as it's within radius, when 
+        # the tree's been moved by location and distortion (inverse is distortion's inverse).
+        # Gives back (that point, how far away it is, the triangle's corners), or None.
+
+        # The sphere could be squashed into any shape in our space, so we find the box it fits
+        # in there and only look at the triangles near that. Then the proper check is done
+        # in objective space.
+        localPoint = apply_mat3(inverse, [point[0] - location.x, point[1] - location.y, point[2] - location.z])
+
+        reaches = [radius * math.sqrt(inverse.m00 ** 2 + inverse.m01 ** 2 + inverse.m02 ** 2),
+                   radius * math.sqrt(inverse.m10 ** 2 + inverse.m11 ** 2 + inverse.m12 ** 2),
+                   radius * math.sqrt(inverse.m20 ** 2 + inverse.m21 ** 2 + inverse.m22 ** 2)]
+
+        low = [localPoint[axis] - reaches[axis] for axis in range(3)]
+        high = [localPoint[axis] + reaches[axis] for axis in range(3)]
+
+        closest = None
+        closestDistance = radius
+
+        for triangle in self.get_triangles_near_box(low, high):
+            corners = []
+
+            for corner in self.corners[triangle]:
+                x, y, z = apply_mat3(distortion, corner)
+                corners.append([x + location.x, y + location.y, z + location.z])
+
+            candidate = closest_point_on_triangle(point, *corners)
+            offset = subtract(point, candidate)
+            distance = math.sqrt(dot(offset, offset))
+
+            if distance < closestDistance:
+                closest = (candidate, distance, corners)
+                closestDistance = distance
+
+        return closest
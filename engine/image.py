@@ -1,7 +1,9 @@
 import math
+import numpy
 import pygame
 
 from engine.clamp import *
+from engine.raster import *
 
 
 
@@ -112,26 +114,50 @@ def interpolate_coordinate(coordinate1:tuple, coordinate2:tuple, t:float):
 
 
 class Image(): # This is like an awful fake version of pygame.Surface
-    def __init__(self, resolution:tuple, pixelSize:tuple, colorspace:bool):
+    def __init__(self, resolution:tuple, pixelSize:tuple, colorspace:bool, arrayBacked:bool=None):
         self.resolution = resolution
         self.pixelSize = pixelSize
         self.colorspace = colorspace
+
+        self.arrayBacked = arrayBacked if arrayBacked is not None else False # If this is on, contents is a numpy array
+                                                                               # instead of a list of lists. It's indexed 
+                                                                               # the same way (contents[y][x]) but you can
+                                                                               # also work on whole slices of it at once.
+        
+        self.allocate_contents()
+
+        self.presentSurface = None # This gets made the first time we present() the image
+
+        self.rasterizer = "scanline" # Which way draw_triangle() fills triangles:
+                                     # "scanline" splits them into flat-based halves and goes line by line,
+                                     # "halfspace" does them all in one go with edge functions (array-backed only),
+                                     # "tiled" queues them up for tileRenderer to do on several cores
+        
+        self.tileRenderer = None # A TileRenderer from tiles.py, if we're using one
+
+    def allocate_contents(self):
+        if self.arrayBacked:
+            if self.colorspace:
+                self.contents = numpy.zeros((self.resolution[1], self.resolution[0], 3), numpy.uint8)
+            else:
+                self.contents = numpy.zeros((self.resolution[1], self.resolution[0]), numpy.float32)
+            return
         
-        if colorspace:
+        if self.colorspace:
             defaultPixel = (0, 0, 0)
         else:
             defaultPixel = 0.0
 
         self.contents = []
-        for row in range(resolution[1]):
+        for row in range(self.resolution[1]):
             self.contents.append([])
-            for pixel in range(resolution[0]):
+            for pixel in range(self.resolution[0]):
                 self.contents[row].append(defaultPixel)
 
     def set_resolution(self, resolution:tuple):
         self.resolution = resolution
 
-        self.contents = [[self.colorspace] * self.resolution[0]] * self.resolution[1]
+        self.allocate_contents()
     
     def get_resolution(self):
         return self.resolution
@@ -139,7 +165,23 @@ class Image(): # This is like an awful fake version of pygame.Surface
     def set_pixel_size(self, pixelSize:tuple):
         self.pixelSize = pixelSize
 
+    def get_pixel(self, x:int, y:int):
+        if self.arrayBacked and self.colorspace:
+            return tuple(self.contents[y, x])
+        
+        return self.contents[y][x]
+    
+    def set_pixel(self, x:int, y:int, value):
+        if self.arrayBacked and self.colorspace:
+            self.contents[y, x] = value[:3] # Textures give us pygame.Colors which have an alpha channel
+        else:
+            self.contents[y][x] = value
+
     def fill(self, value):
+        if self.arrayBacked:
+            self.contents[...] = value # One call instead of 12,288 :)
+            return
+        
         for i in range(self.resolution[1]):
             for j in range(self.resolution[0]):
                 self.contents[i][j] = value
@@ -161,6 +203,11 @@ class Image(): # This is like an awful fake version of pygame.Surface
 
         lightCast = kwargs.get("lightCast", None)
 
+        if self.arrayBacked and depthBuffer.arrayBacked:
+            self.draw_horizontal_span(x1, x2, y, depthBuffer, depth1, depth2, colour1, colour2, 
+                                      texture=texture, uv1=uv1, uv2=uv2, lightCast=lightCast)
+            return
+
         if 0 <= y < self.resolution[1]:
             lineLength = abs(x2 - x1)
             for i in range(x1, x2, 1 if x1 < x2 else -1):
@@ -183,7 +230,64 @@ class Image(): # This is like an awful fake version of pygame.Surface
                         else:
                             self.contents[y][i] = colour1
                             depthBuffer.contents[y][i] = depth
-                            
+
+    def draw_horizontal_span(self, 
+                             x1:int, 
+                             x2:int, 
+                             y:int,
+                             depthBuffer, 
+                             depth1:float,
+                             depth2:float, 
+                             colour1:tuple=None, 
+                             colour2:tuple=None,
+                             **kwargs):
+        # This does exactly what the loop in draw_horizontal_line() does, except it
+        # works out the whole line at once on the arrays.
+        texture = kwargs.get("texture", None) 
+
+        uv1 = kwargs.get("uv1", None)
+        uv2 = kwargs.get("uv2", None)
+
+        lightCast = kwargs.get("lightCast", None)
+
+        if not 0 <= y < self.resolution[1] or x1 == x2:
+            return
+        
+        # Clip the line to the screen before we make any arrays
+        if x1 < x2:
+            xs = numpy.arange(max(x1, 0), min(x2, self.resolution[0]))
+        else:
+            xs = numpy.arange(min(x1, self.resolution[0] - 1), max(x2, -1), -1)
+
+        if not len(xs):
+            return
+        
+        amounts = numpy.abs((xs - x1) / abs(x2 - x1))
+
+        depths = depth1 + (depth2 - depth1) * amounts
+
+        visible = depths <= depthBuffer.contents[y, xs]
+        xs = xs[visible]
+        amounts = amounts[visible]
+
+        if colour2:
+            colours = numpy.floor(numpy.array(colour1, numpy.float64) + 
+                                  numpy.outer(amounts, numpy.subtract(colour2, colour1)))
+            self.contents[y, xs] = numpy.clip(colours, 0, 255)
+        elif texture:
+            us = numpy.floor(uv1[0] + (uv2[0] - uv1[0]) * amounts).astype(numpy.intp)
+            vs = numpy.floor(uv1[1] + (uv2[1] - uv1[1]) * amounts).astype(numpy.intp)
+
+            colours = texture.get_colours_at(us, vs)
+
+            if lightCast:
+                self.contents[y, xs] = overlay_colour_array(colours, lightCast)
+            else:
+                self.contents[y, xs] = colours
+        else:
+            self.contents[y, xs] = colour1[:3]
+
+        depthBuffer.contents[y, xs] = depths[visible]
                             
 
     def draw_flat_based_triangle(self, 
@@ -256,6 +360,12 @@ class Image(): # This is like an awful fake version of pygame.Surface
 
         lightCast = kwargs.get("lightCast", None)
 
+        if self.rasterizer in ("halfspace", "tiled") and self.arrayBacked and depthBuffer.arrayBacked:
+            self.draw_triangle_halfspace(vertex1, vertex2, vertex3, depthBuffer, depth1, depth2, depth3,
+                                         colour1, colour2, colour3,
+                                         texture=texture, uv1=uv1, uv2=uv2, uv3=uv3, lightCast=lightCast)
+            return
+
         # Find the middle vertex
         heights = [vertex1[1], vertex2[1], vertex3[1]]
 
@@ -339,14 +449,85 @@ class Image(): # This is like an awful fake version of pygame.Surface
                                           depthBuffer, depths[1], sliceDepth, depths[0],
                                           colour1)
 
+    def draw_triangle_halfspace(self, 
+                                vertex1:tuple,
+                                vertex2:tuple,
+                                vertex3:tuple,
+                                depthBuffer,
+                                depth1:float,
+                                depth2:float,
+                                depth3:float,
+                                colour1:tuple=None,
+                                colour2:tuple=None,
+                                colour3:tuple=None,
+                                **kwargs):
+        # Takes the same arguments as draw_triangle(), but all the actual work is 
+        # done by rasterize_triangle() in raster.py
+        texture = kwargs.get("texture", None) 
+
+        if colour2:
+            colours = (colour1, colour2, colour3)
+        elif texture:
+            colours = None
+        else:
+            colours = (colour1, colour1, colour1)
+
+        uvs = (kwargs.get("uv1", None), kwargs.get("uv2", None), kwargs.get("uv3", None))
+
+        if self.rasterizer == "tiled" and self.tileRenderer:
+            # This doesn't draw anything yet, it gets done all at once when the tile renderer's flushed
+            self.tileRenderer.queue_triangle((vertex1, vertex2, vertex3), 
+                                             (depth1, depth2, depth3),
+                                             colours, uvs,
+                                             texture.pixels if texture else None,
+                                             kwargs.get("lightCast", None))
+            return
+
+        rasterize_triangle(self.contents, depthBuffer.contents,
+                           (vertex1, vertex2, vertex3), 
+                           (depth1, depth2, depth3),
+                           colours, uvs,
+                           texture.pixels if texture else None,
+                           kwargs.get("lightCast", None))
+
+    def present(self, target:pygame.Surface, position:tuple, pixels:numpy.ndarray=None):
+        # This is the fast way of getting an array-backed image onto the screen. Instead
+        # of drawing a rectangle for every pixel, we copy the whole array onto a tiny
+        # surface the size of our resolution, and then let pygame blow it up to the
+        # right size. transform.scale() is nearest neighbour, so it still looks crunchy.
+        pixels = pixels if pixels is not None else self.contents
+
+        if not self.presentSurface or self.presentSurface.get_size() != self.resolution:
+            self.presentSurface = pygame.Surface(self.resolution)
+
+        pygame.surfarray.blit_array(self.presentSurface, pixels.swapaxes(0, 1)) # surfarray wants [x, y] not [y, x]
+
+        scaledSize = (self.resolution[0] * self.pixelSize[0], self.resolution[1] * self.pixelSize[1])
+        scaledPosition = (position[0] * self.pixelSize[0], position[1] * self.pixelSize[1])
+
+        if scaledPosition == (0, 0) and target.get_size() == scaledSize:
+            pygame.transform.scale(self.presentSurface, scaledSize, target) # This scales straight onto the target
+        else:
+            target.blit(pygame.transform.scale(self.presentSurface, scaledSize), scaledPosition)
+
     def render_image(self, target:pygame.Surface, position:tuple):
+        if self.arrayBacked:
+            self.present(target, position)
+            return
+        
         for row in range(position[1], position[1] + self.resolution[1]):
             for pixel in range(position[0], position[0] + self.resolution[0]):
                 pygame.draw.rect(target, 
-                                 self.contents[row][pixel], 
+                                 self.get_pixel(pixel, row), 
                                  pygame.Rect((pixel * self.pixelSize[0], row * self.pixelSize[1]), self.pixelSize))
 
     def render_depthbuffer(self, target, position):
+        if self.arrayBacked:
+            brightness = numpy.clip(self.contents * 25, 0, 255).astype(numpy.uint8)
+
+            self.present(target, position, numpy.repeat(brightness[:, :, numpy.newaxis], 3, 2))
+            return
+        
         for row in range(position[1], position[1] + self.resolution[1]):
             for pixel in range(position[0], position[0] + self.resolution[0]):
                 pygame.draw.rect(target, 
@@ -359,11 +540,11 @@ class Image(): # This is like an awful fake version of pygame.Surface
 
 # This will be the colour display triangles get rendered to
 
-DISPLAY = Image((128, 96), (5, 5), True)
+DISPLAY = Image((128, 96), (5, 5), True, True)
 
 displaySizeX = DISPLAY.resolution[0] / 2
 displaySizeY = DISPLAY.resolution[1] / 2
 
 # This stores the depth information of the scene, so we can
 # check if a pixel should be behind another pixel already rendered.
-DEPTHBUFFER = Image((128, 96), (5, 5), False)
+DEPTHBUFFER = Image((128, 96), (5, 5), False, True)
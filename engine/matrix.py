@@ -44,9 +44,9 @@ class Matrix:
 
         return Matrix(result)
          
-    def multiply_scalar(self, coefficient: float): # If you need to divide a matrix, you can just multiply 
-                                                     # it by the reciprocal of your coefficient.        
-                                                     # Like this: Matrix.multiply_scalar(1 / numberYoureDividingBy)
+    def multiply_scalar(self, coefficient: float, destination=None): # If you need to divide a matrix, you can just multiply 
+                                                                       # it by the reciprocal of your coefficient.        
+                                                                       # Like this: Matrix.multiply_scalar(1 / numberYoureDividingBy)
         multiplied = []
         
         for i in range(self.order[0]):
@@ -55,7 +55,7 @@ class Matrix:
             for j in range(self.order[1]):
                 multiplied[i].append(self.contents[i][j] * coefficient)
                 
-        return Matrix(multiplied)
+        return write_matrix(multiplied, destination)
     
     def get_magnitude(self): # This only works on collumb vectors
         numberOfCollumbs = len(self.contents)
@@ -68,7 +68,7 @@ class Matrix:
 
         return workingMagnitude
     
-    def set_magnitude(self, newMagnitude:float=1): # This makes the magnitude of a collumb vector 1 by default, or a different value if specified
+    def set_magnitude(self, newMagnitude:float=1, destination=None): # This makes the magnitude of a collumb vector 1 by default, or a different value if specified
         currentMagnitude = self.get_magnitude()
 
         newContents = []
@@ -83,12 +83,12 @@ class Matrix:
             for content in self.contents:
                 newContents.append([0])
         
-        return Matrix(newContents)
+        return write_matrix(newContents, destination)
          
     def get_order(self):
         return self.order
          
-    def get_transpose(self): # This swaps the rows and collumbs. It's like reflecting the matrix diagonally.
+    def get_transpose(self, destination=None): # This swaps the rows and collumbs. It's like reflecting the matrix diagonally.
         transpose = []
         
         for i in range(self.order[1]):
@@ -98,7 +98,7 @@ class Matrix:
                 row.append(self.contents[j][i])
             transpose.append(row)
         
-        return Matrix(transpose)
+        return write_matrix(transpose, destination)
      
     def get_2x2_determinant(self): # I know this is really ugly but you can only find 
                                    # determinants for square matrices, and I'm only gonna be
@@ -256,7 +256,7 @@ class Matrix:
                        [selfContents[2][0] * crossContents[0][0] - selfContents[0][0] * crossContents[2][0]],
                        [selfContents[0][0] * crossContents[1][0] - selfContents[1][0] * crossContents[0][0]],])
         
-    def add(self, matrixToAdd):
+    def add(self, matrixToAdd, destination=None):
         if self.order != matrixToAdd.get_order():
             print(f"{self.get_contents()} and {matrixToAdd.get_contents()} have different orders dumbass you can't add them")
             return None
@@ -271,11 +271,11 @@ class Matrix:
             for collumb in range(self.order[1]):
                 result[row].append(self.contents[row][collumb] + contentsToAdd[row][collumb])
         
-        return Matrix(result)
+        return write_matrix(result, destination)
     
-    def subtract(self, matrixToSubtract): # This looks completely useless and honestly I thought the same,
-                                             # but it's cumbersome manually negating a matrix every time you
-                                             # want to subtract it, so this should be a little bit faster
+    def subtract(self, matrixToSubtract, destination=None): # This looks completely useless and honestly I thought the same,
+                                                              # but it's cumbersome manually negating a matrix every time you
+                                                              # want to subtract it, so this should be a little bit faster
         if self.order != matrixToSubtract.get_order():
             print("These have different orders dumbass you can't subtract them")
             return None
@@ -290,7 +290,7 @@ class Matrix:
             for collumb in range(self.order[1]):
                 result[row].append(self.contents[row][collumb] - contentsToSubtract[row][collumb])
         
-        return Matrix(result)
+        return write_matrix(result, destination)
     
     def multiply(self, coefficientMatrix): # I'M ADDING THIS BIT SUPER LATE I'VE WRITTEN 2000 LINES BY NOW
         if self.order != coefficientMatrix.get_order():
@@ -309,7 +309,7 @@ class Matrix:
         
         return Matrix(result)
 
-    def apply(self, right):
+    def apply(self, right, destination=None):
 
         rightContents = right.get_contents()
 
@@ -331,7 +331,518 @@ class Matrix:
 
                 workingContents[row].append(scalarProduct)
 
-        return Matrix(workingContents)
+        return write_matrix(workingContents, destination)
+    
+    # These change the matrix itself instead of making a new one, so they don't leave any
+    # rubbish behind for the garbage collector. Only use them on matrices you own though! If 
+    # you iadd() to ORIGIN, everything that started at the origin moves with it.
+
+    def iadd(self, matrixToAdd):
+        return self.add(matrixToAdd, self)
+    
+    def isub(self, matrixToSubtract):
+        return self.subtract(matrixToSubtract, self)
+    
+    def iscale(self, coefficient:float):
+        return self.multiply_scalar(coefficient, self)
+    
+    def copy(self, destination=None):
+        return write_matrix([row[:] for row in self.contents], destination)
+
+
+# Most of the functions above can take a destination, which is a matrix to write the answer
+# into instead of making a new one. It gets returned as well so you can still chain things.
+
+def write_matrix(contents:list[list[float]], destination=None):
+    if destination is None:
+        return Matrix(contents)
+    
+    destination.set_contents(contents)
+
+    return destination
+
+def write_vec3(x:float, y:float, z:float, destination=None):
+    if destination is None:
+        return Vec3(x, y, z)
+    
+    if destination.__class__ is Vec3:
+        destination.x = x
+        destination.y = y
+        destination.z = z
+    else:
+        destination.set_contents([[x], [y], [z]])
+
+    return destination
+
+def write_mat3(m00:float, m01:float, m02:float, 
+               m10:float, m11:float, m12:float, 
+               m20:float, m21:float, m22:float, 
+               destination=None):
+    if destination is None:
+        return Mat3(m00, m01, m02, m10, m11, m12, m20, m21, m22)
+    
+    if destination.__class__ is Mat3:
+        destination.m00 = m00
+        destination.m01 = m01
+        destination.m02 = m02
+        destination.m10 = m10
+        destination.m11 = m11
+        destination.m12 = m12
+        destination.m20 = m20
+        destination.m21 = m21
+        destination.m22 = m22
+    else:
+        destination.set_contents([[m00, m01, m02], [m10, m11, m12], [m20, m21, m22]])
+
+    return destination
+
+
+
+# Nearly every matrix in the engine is either a 3D collumb vector or a 3x3 distortion, so
+# these two are cut down versions of Matrix just for those. They store their numbers in
+# __slots__ instead of lists of lists, so they're smaller and quicker to make, and all the
+# maths is written out in full instead of going round loops.
+
+# They've got the same functions as Matrix and give exactly the same answers (the sums are 
+# done in the same order), so you can mix them with normal matrices however you like. 
+# Anything they don't do themselves gets handed over to a normal Matrix.
+
+class Vec3:
+    __slots__ = ("x", "y", "z")
+
+    order = (3, 1)
+
+    def __init__(self, x:float, y:float, z:float):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __getattr__(self, name): # Only gets called for functions we don't have
+        # Python's own lookups (like copy and pickle's) and numbers that haven't been set yet
+        # can't be handed over, because making the Matrix would come straight back here forever
+        if name.startswith("__") or name in Vec3.__slots__:
+            raise AttributeError(name)
+
+        return getattr(Matrix(self.get_contents()), name)
+
+    def __reduce__(self): # So copy and pickle make them from their numbers
+        return (Vec3, (self.x, self.y, self.z))
+
+    @property
+    def contents(self):
+        return self.get_contents()
+
+    def get_contents(self):
+        return [[self.x], [self.y], [self.z]]
+    
+    def set_contents(self, contents:list[list[float]]):
+        self.x = contents[0][0]
+        self.y = contents[1][0]
+        self.z = contents[2][0]
+
+    def get_order(self):
+        return (3, 1)
+    
+    def copy(self, destination=None):
+        return write_vec3(self.x, self.y, self.z, destination)
+    
+    def multiply_scalar(self, coefficient:float, destination=None):
+        return write_vec3(self.x * coefficient, self.y * coefficient, self.z * coefficient, destination)
+    
+    def get_magnitude(self):
+        return math.sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+    
+    def set_magnitude(self, newMagnitude:float=1, destination=None):
+        currentMagnitude = self.get_magnitude()
+
+        if currentMagnitude != 0:
+            ratio = newMagnitude / currentMagnitude
+
+            return write_vec3(self.x * ratio, self.y * ratio, self.z * ratio, destination)
+        
+        return write_vec3(0, 0, 0, destination)
+    
+    def get_transpose(self, destination=None):
+        return write_matrix([[self.x, self.y, self.z]], destination)
+    
+    def get_dot_product(self, dot):
+        dot = to_compact(dot)
+
+        return self.x * dot.x + self.y * dot.y + self.z * dot.z
+    
+    def get_cross_product(self, cross, destination=None):
+        cross = to_compact(cross)
+
+        return write_vec3(self.y * cross.z - self.z * cross.y,
+                          self.z * cross.x - self.x * cross.z,
+                          self.x * cross.y - self.y * cross.x, 
+                          destination)
+    
+    def add(self, matrixToAdd, destination=None):
+        matrixToAdd = to_compact(matrixToAdd)
+
+        if matrixToAdd.__class__ is not Vec3:
+            return Matrix(self.get_contents()).add(matrixToAdd, destination) # Let Matrix complain about it
+        
+        return write_vec3(self.x + matrixToAdd.x, self.y + matrixToAdd.y, self.z + matrixToAdd.z, destination)
+    
+    def subtract(self, matrixToSubtract, destination=None):
+        matrixToSubtract = to_compact(matrixToSubtract)
+
+        if matrixToSubtract.__class__ is not Vec3:
+            return Matrix(self.get_contents()).subtract(matrixToSubtract, destination)
+        
+        return write_vec3(self.x - matrixToSubtract.x, self.y - matrixToSubtract.y, self.z - matrixToSubtract.z, destination)
+    
+    def multiply(self, coefficientMatrix):
+        coefficientMatrix = to_compact(coefficientMatrix)
+
+        if coefficientMatrix.__class__ is not Vec3:
+            return Matrix(self.get_contents()).multiply(coefficientMatrix)
+        
+        return Vec3(self.x * coefficientMatrix.x, self.y * coefficientMatrix.y, self.z * coefficientMatrix.z)
+    
+    def apply(self, right, destination=None): # A 3x1 can only be applied to a 1xn, so this always goes the slow way
+        return Matrix(self.get_contents()).apply(right, destination)
+    
+    def iadd(self, matrixToAdd):
+        return self.add(matrixToAdd, self)
+    
+    def isub(self, matrixToSubtract):
+        return self.subtract(matrixToSubtract, self)
+    
+    def iscale(self, coefficient:float):
+        return self.multiply_scalar(coefficient, self)
+
+
+
+class Mat3:
+    __slots__ = ("m00", "m01", "m02",  # The numbers are named by their row and then their collumb
+                 "m10", "m11", "m12",
+                 "m20", "m21", "m22")
+    
+    order = (3, 3)
+    
+    def __init__(self, 
+                 m00:float, m01:float, m02:float, 
+                 m10:float, m11:float, m12:float, 
+                 m20:float, m21:float, m22:float):
+        self.m00 = m00
+        self.m01 = m01
+        self.m02 = m02
+        self.m10 = m10
+        self.m11 = m11
+        self.m12 = m12
+        self.m20 = m20
+        self.m21 = m21
+        self.m22 = m22
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name in Mat3.__slots__: # Same as Vec3's
+            raise AttributeError(name)
+
+        return getattr(Matrix(self.get_contents()), name)
+
+    def __reduce__(self):
+        return (Mat3, (self.m00, self.m01, self.m02,
+                       self.m10, self.m11, self.m12,
+                       self.m20, self.m21, self.m22))
+
+    @property
+    def contents(self):
+        return self.get_contents()
+
+    def get_contents(self):
+        return [[self.m00, self.m01, self.m02],
+                [self.m10, self.m11, self.m12],
+                [self.m20, self.m21, self.m22]]
+    
+    def set_contents(self, contents:list[list[float]]):
+        (self.m00, self.m01, self.m02), (self.m10, self.m11, self.m12), (self.m20, self.m21, self.m22) = contents
+
+    def get_order(self):
+        return (3, 3)
+    
+    def copy(self, destination=None):
+        return write_mat3(self.m00, self.m01, self.m02,
+                          self.m10, self.m11, self.m12,
+                          self.m20, self.m21, self.m22,
+                          destination)
+    
+    def get_row(self, row:int):
+        return Matrix([self.get_contents()[row]])
+    
+    def get_collumb(self, collumb:int):
+        contents = self.get_contents()
+
+        return Vec3(contents[0][collumb], contents[1][collumb], contents[2][collumb])
+    
+    def multiply_scalar(self, coefficient:float, destination=None):
+        return write_mat3(self.m00 * coefficient, self.m01 * coefficient, self.m02 * coefficient,
+                          self.m10 * coefficient, self.m11 * coefficient, self.m12 * coefficient,
+                          self.m20 * coefficient, self.m21 * coefficient, self.m22 * coefficient,
+                          destination)
+    
+    def get_transpose(self, destination=None):
+        return write_mat3(self.m00, self.m10, self.m20,
+                          self.m01, self.m11, self.m21,
+                          self.m02, self.m12, self.m22,
+                          destination)
+    
+    def get_3x3_determinant(self):
+        return (
+                (self.m00 * self.m11 * self.m22) +
+                (self.m01 * self.m12 * self.m20) +
+                (self.m02 * self.m10 * self.m21) -
+                
+                (self.m20 * self.m11 * self.m02) -
+                (self.m21 * self.m12 * self.m00) -
+                (self.m22 * self.m10 * self.m01)
+               )
+    
+    def get_3x3_inverse(self, destination=None):
+        # This is the same as Matrix.get_3x3_inverse(), just with all the steps squashed together
+        det = self.get_3x3_determinant()
+
+        if det == 0:
+            return write_mat3(1, 0, 0,
+                              0, 1, 0,
+                              0, 0, 1,
+                              destination)
+        
+        reciprocal = 1 / det
+
+        # The cofactors, already transposed
+        return write_mat3((self.m11 * self.m22 - self.m12 * self.m21) * reciprocal,
+                          (0 - (self.m01 * self.m22 - self.m02 * self.m21)) * reciprocal,
+                          (self.m01 * self.m12 - self.m02 * self.m11) * reciprocal,
+
+                          (0 - (self.m10 * self.m22 - self.m12 * self.m20)) * reciprocal,
+                          (self.m00 * self.m22 - self.m02 * self.m20) * reciprocal,
+                          (0 - (self.m00 * self.m12 - self.m02 * self.m10)) * reciprocal,
+
+                          (self.m10 * self.m21 - self.m11 * self.m20) * reciprocal,
+                          (0 - (self.m00 * self.m21 - self.m01 * self.m20)) * reciprocal,
+                          (self.m00 * self.m11 - self.m01 * self.m10) * reciprocal,
+                          
+                          destination)
+    
+    def get_uniform_scale_squared(self):
+        # If this matrix is just a rotation (or reflection) scaled the same amount in every 
+        # direction, this gives you that amount squared. Otherwise it gives you None.
+
+        # That's the case when the collumbs are all at right angles to each other and the
+        # same length, which we can check with dot products.
+        scaleSquared = self.m00 * self.m00 + self.m10 * self.m10 + self.m20 * self.m20
+
+        if scaleSquared == 0:
+            return None
+        
+        tolerance = scaleSquared * 1e-9 # Rotations that have been applied loads of times drift a tiny bit
+
+        if (abs(self.m01 * self.m01 + self.m11 * self.m11 + self.m21 * self.m21 - scaleSquared) > tolerance or
+            abs(self.m02 * self.m02 + self.m12 * self.m12 + self.m22 * self.m22 - scaleSquared) > tolerance or
+            abs(self.m00 * self.m01 + self.m10 * self.m11 + self.m20 * self.m21) > tolerance or
+            abs(self.m00 * self.m02 + self.m10 * self.m12 + self.m20 * self.m22) > tolerance or
+            abs(self.m01 * self.m02 + self.m11 * self.m12 + self.m21 * self.m22) > tolerance):
+            return None
+        
+        return scaleSquared
+    
+    def get_quick_3x3_inverse(self, destination=None):
+        # For a rotation times a scale, the inverse is just the transpose divided by the scale 
+        # squared, which is a lot less work than the cofactor method. Anything else still goes 
+        # the long way round.
+        scaleSquared = self.get_uniform_scale_squared()
+
+        if scaleSquared is None:
+            return self.get_3x3_inverse(destination)
+        
+        return self.get_transpose(destination).iscale(1 / scaleSquared)
+    
+    def add(self, matrixToAdd, destination=None):
+        matrixToAdd = to_compact(matrixToAdd)
+
+        if matrixToAdd.__class__ is not Mat3:
+            return Matrix(self.get_contents()).add(matrixToAdd, destination)
+
+        return write_mat3(self.m00 + matrixToAdd.m00, self.m01 + matrixToAdd.m01, self.m02 + matrixToAdd.m02,
+                          self.m10 + matrixToAdd.m10, self.m11 + matrixToAdd.m11, self.m12 + matrixToAdd.m12,
+                          self.m20 + matrixToAdd.m20, self.m21 + matrixToAdd.m21, self.m22 + matrixToAdd.m22,
+                          destination)
+    
+    def subtract(self, matrixToSubtract, destination=None):
+        matrixToSubtract = to_compact(matrixToSubtract)
+
+        if matrixToSubtract.__class__ is not Mat3:
+            return Matrix(self.get_contents()).subtract(matrixToSubtract, destination)
+
+        return write_mat3(self.m00 - matrixToSubtract.m00, self.m01 - matrixToSubtract.m01, self.m02 - matrixToSubtract.m02,
+                          self.m10 - matrixToSubtract.m10, self.m11 - matrixToSubtract.m11, self.m12 - matrixToSubtract.m12,
+                          self.m20 - matrixToSubtract.m20, self.m21 - matrixToSubtract.m21, self.m22 - matrixToSubtract.m22,
+                          destination)
+    
+    def multiply(self, coefficientMatrix):
+        coefficientMatrix = to_compact(coefficientMatrix)
+
+        if coefficientMatrix.__class__ is not Mat3:
+            return Matrix(self.get_contents()).multiply(coefficientMatrix)
+
+        return Mat3(self.m00 * coefficientMatrix.m00, self.m01 * coefficientMatrix.m01, self.m02 * coefficientMatrix.m02,
+                    self.m10 * coefficientMatrix.m10, self.m11 * coefficientMatrix.m11, self.m12 * coefficientMatrix.m12,
+                    self.m20 * coefficientMatrix.m20, self.m21 * coefficientMatrix.m21, self.m22 * coefficientMatrix.m22)
+    
+    def apply(self, right, destination=None):
+        # Everything gets worked out before it's written, so it's fine for the destination 
+        # to be self or right
+        right = to_compact(right)
+
+        if right.__class__ is Vec3:
+            return write_vec3(self.m00 * right.x + self.m01 * right.y + self.m02 * right.z,
+                              self.m10 * right.x + self.m11 * right.y + self.m12 * right.z,
+                              self.m20 * right.x + self.m21 * right.y + self.m22 * right.z,
+                              destination)
+        
+        if right.__class__ is Mat3:
+            return write_mat3(self.m00 * right.m00 + self.m01 * right.m10 + self.m02 * right.m20,
+                              self.m00 * right.m01 + self.m01 * right.m11 + self.m02 * right.m21,
+                              self.m00 * right.m02 + self.m01 * right.m12 + self.m02 * right.m22,
+
+                              self.m10 * right.m00 + self.m11 * right.m10 + self.m12 * right.m20,
+                              self.m10 * right.m01 + self.m11 * right.m11 + self.m12 * right.m21,
+                              self.m10 * right.m02 + self.m11 * right.m12 + self.m12 * right.m22,
+
+                              self.m20 * right.m00 + self.m21 * right.m10 + self.m22 * right.m20,
+                              self.m20 * right.m01 + self.m21 * right.m11 + self.m22 * right.m21,
+                              self.m20 * right.m02 + self.m21 * right.m12 + self.m22 * right.m22,
+                              
+                              destination)
+        
+        return Matrix(self.get_contents()).apply(right, destination) # Any other shape goes the slow way
+    
+    def iadd(self, matrixToAdd):
+        return self.add(matrixToAdd, self)
+    
+    def isub(self, matrixToSubtract):
+        return self.subtract(matrixToSubtract, self)
+    
+    def iscale(self, coefficient:float):
+        return self.multiply_scalar(coefficient, self)
+    
+
+
+# Quaternions are another way of storing a rotation, using four numbers instead of nine. 
+# Sticking two rotations together is a lot less work than multiplying two matrices, and 
+# you can fix any rounding drift by just setting the magnitude back to 1, whereas a matrix
+# slowly stops being a proper rotation and starts squashing things.
+
+class Quaternion:
+    __slots__ = ("w", "x", "y", "z")
+
+    def __init__(self, w:float, x:float, y:float, z:float):
+        self.w = w # This is the "real" part, the rest are the i, j and k parts
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def get_contents(self):
+        return [self.w, self.x, self.y, self.z]
+
+    def multiply(self, right):
+        # The Hamilton product. Like matrices, this does right first and then self.
+        return Quaternion(self.w * right.w - self.x * right.x - self.y * right.y - self.z * right.z,
+                          self.w * right.x + self.x * right.w + self.y * right.z - self.z * right.y,
+                          self.w * right.y - self.x * right.z + self.y * right.w + self.z * right.x,
+                          self.w * right.z + self.x * right.y - self.y * right.x + self.z * right.w)
+    
+    def get_conjugate(self): # For a rotation, this is the same rotation backwards
+        return Quaternion(self.w, -self.x, -self.y, -self.z)
+    
+    def get_magnitude(self):
+        return math.sqrt(self.w ** 2 + self.x ** 2 + self.y ** 2 + self.z ** 2)
+    
+    def normalise(self): # Only magnitude 1 quaternions are rotations. This changes this one in place.
+        magnitude = self.get_magnitude()
+
+        if magnitude != 0:
+            self.w /= magnitude
+            self.x /= magnitude
+            self.y /= magnitude
+            self.z /= magnitude
+
+        return self
+    
+    def get_mat3(self, destination=None): # The rotation matrix that does the same thing
+        w, x, y, z = self.w, self.x, self.y, self.z
+
+        return write_mat3(1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+                          2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+                          2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y),
+                          destination)
+    
+
+
+def quaternion_from_euler_radians(x:float, y:float, z:float):
+    # Same order as Abstract.rotate_euler_radians(), so y, then x, then z
+    halfX = x / 2
+    halfY = y / 2
+    halfZ = z / 2
+
+    return Quaternion(math.cos(halfZ), 0, 0, math.sin(halfZ)).multiply(
+           Quaternion(math.cos(halfX), math.sin(halfX), 0, 0)).multiply(
+           Quaternion(math.cos(halfY), 0, math.sin(halfY), 0))
+
+def quaternion_from_mat3(matrix:Mat3):
+    # This only makes sense for proper rotation matrices (no scaling or reflecting). We 
+    # work it out from whichever bit of the matrix is biggest so we never divide by 
+    # something close to 0.
+    trace = matrix.m00 + matrix.m11 + matrix.m22
+
+    if trace > 0:
+        s = math.sqrt(trace + 1) * 2
+        return Quaternion(s / 4, 
+                          (matrix.m21 - matrix.m12) / s, 
+                          (matrix.m02 - matrix.m20) / s, 
+                          (matrix.m10 - matrix.m01) / s).normalise()
+    
+    if matrix.m00 > matrix.m11 and matrix.m00 > matrix.m22:
+        s = math.sqrt(1 + matrix.m00 - matrix.m11 - matrix.m22) * 2
+        return Quaternion((matrix.m21 - matrix.m12) / s, 
+                          s / 4, 
+                          (matrix.m01 + matrix.m10) / s, 
+                          (matrix.m02 + matrix.m20) / s).normalise()
+    
+    if matrix.m11 > matrix.m22:
+        s = math.sqrt(1 + matrix.m11 - matrix.m00 - matrix.m22) * 2
+        return Quaternion((matrix.m02 - matrix.m20) / s, 
+                          (matrix.m01 + matrix.m10) / s, 
+                          s / 4, 
+                          (matrix.m12 + matrix.m21) / s).normalise()
+    
+    s = math.sqrt(1 + matrix.m22 - matrix.m00 - matrix.m11) * 2
+    return Quaternion((matrix.m10 - matrix.m01) / s, 
+                      (matrix.m02 + matrix.m20) / s, 
+                      (matrix.m12 + matrix.m21) / s, 
+                      s / 4).normalise()
+
+
+
+def to_compact(matrix):
+    # Turns a 3x1 or 3x3 Matrix into a Vec3 or Mat3. Anything else (including things that
+    # are already compact) comes back as it is.
+    if matrix.__class__ is not Matrix:
+        return matrix
+    
+    contents = matrix.contents
+
+    if matrix.order == (3, 1):
+        return Vec3(contents[0][0], contents[1][0], contents[2][0])
+    
+    if matrix.order == (3, 3):
+        return Mat3(*contents[0], *contents[1], *contents[2])
+    
+    return matrix
+
 
 
 # Some usefull constants before we move on
@@ -340,11 +851,11 @@ class Matrix:
 I2 = Matrix([[1, 0], 
              [0, 1]])
 
-I3 = Matrix([[1, 0, 0], 
-             [0, 1, 0], 
-             [0, 0, 1]])
+I3 = Mat3(1, 0, 0, 
+          0, 1, 0, 
+          0, 0, 1)
 
 # Origin vector
-ORIGIN = Matrix([[0], 
-                 [0], 
-                 [0]])
\ No newline at end of file
+ORIGIN = Vec3(0, 
+              0, 
+              0)
\ No newline at end of file
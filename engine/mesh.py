@@ -1,10 +1,12 @@
 import math
+import numpy
 import pygame
 
 from engine.clamp import *
 from engine.matrix import *
 from engine.abstract import *
 from engine.image import *
+from engine.tiles import *
 
 
 
@@ -12,9 +14,16 @@ class Texture(): # This is here so I don't have to make a copy of a
                  # surface for every triangle it's mapped to
     def __init__(self, texturePath):
         self.surface = pygame.image.load(texturePath)
+
+        self.pixels = pygame.surfarray.array3d(self.surface) # The same pixels as a numpy array indexed [x, y] 
+                                                             # so array-backed images can look up loads at once
     
     def get_colour_at(self, index:tuple):
         return self.surface.get_at(index)
+    
+    def get_colours_at(self, xs, ys):
+        return self.pixels[numpy.clip(xs, 0, self.pixels.shape[0] - 1), 
+                           numpy.clip(ys, 0, self.pixels.shape[1] - 1)]
 
 
 
@@ -22,6 +31,36 @@ AMBIENTLIGHT = (10, 10, 10) # This is the colour absolute shadow is interpolated
 
 
 
+def cast_light(lights:list[Abstract], normal:Matrix, center:Matrix): # Works out what colour light a surface facing 
+                                                                     # along normal gets at the point center
+    casts = [AMBIENTLIGHT]
+
+    for light in lights:
+        dirAndDist = light.get_direction_and_distance(center)
+
+        if dirAndDist[1] > 0.1:
+            angleAmount = normal.get_dot_product(dirAndDist[0])
+            
+            interpolationAmount = (1 / ((dirAndDist[1] / light.brightness) ** 2)) * ((angleAmount + 1) / 2)
+
+            cast = interpolate_colour((0, 0, 0), light.colour, interpolationAmount)
+        else:
+            cast = (255, 255, 255)
+            
+        casts.append(cast)
+
+    return add_colours(casts)
+
+
+
+# These say how a packed triangle in a Mesh gets coloured in
+
+MATERIALFLAT = 0     # Like a Tri
+MATERIALGRADIENT = 1 # Like a GradientTri
+MATERIALTEXTURE = 2  # Like a TextureTri
+
+
+
 class Tri(Abstract): # This should be a child to an abstract which will serve as a wrapper for a group of polys.
     def __init__(self, 
                  vertices:list[list[float]], 
@@ -41,15 +80,21 @@ class Tri(Abstract): # This should be a child to an abstract which will serve as
         # But it makes it easier to apply transformation 
         # matrices to polygons so I'll just hate myself later 
 
-        self.vertices = Matrix(vertices).get_transpose()
+        self.vertices = to_compact(Matrix(vertices).get_transpose())
         self.albedo = albedo
         self.lit = lit
+
+        self.backfaceCulling = False # If this is on, the tri won't be drawn when you're looking at its back.
+                                     # The front is the side get_normal() points out of.
+
+        self.packedMesh = None  # If this tri came from Mesh.get_tris(), these point back at the 
+        self.packedIndex = None # triangle in the mesh's buffers it's a copy of
         
     def get_vertices(self):
         return self.vertices
     
     def set_vertices(self, vertices):
-        self.vertices = vertices
+        self.vertices = to_compact(vertices)
 
     def get_albedo(self):
         return self.albedo
@@ -57,15 +102,20 @@ class Tri(Abstract): # This should be a child to an abstract which will serve as
     def set_albedo(self, albedo:tuple):
         self.albedo = albedo
 
+        if self.packedMesh:
+            self.packedMesh.set_tri_albedo(self.packedIndex, albedo)
+
     def get_normal(self):
         vertex1 = self.vertices.get_collumb(0)
         vertex2 = self.vertices.get_collumb(1)
         vertex3 = self.vertices.get_collumb(2)
 
-        edge1 = vertex2.subtract(vertex1)
-        edge2 = vertex3.subtract(vertex1)
+        edge1 = vertex2.isub(vertex1) # The collumbs are new matrices, so we can reuse them
+        edge2 = vertex3.isub(vertex1)
+
+        normal = edge1.get_cross_product(edge2, edge1)
 
-        return self.objectiveDistortion.apply(edge1.get_cross_product(edge2)).set_magnitude(1)
+        return self.objectiveDistortion.apply(normal, normal).set_magnitude(1, normal)
     
 
     def get_light_cast(self, lights:list[Abstract], triObjectiveVertices:Matrix):
@@ -73,27 +123,9 @@ class Tri(Abstract): # This should be a child to an abstract which will serve as
         center = []
 
         for i in range(3):
-            center.append([(vertices[i][0] + vertices[i][1] + vertices[i][2]) / 3])
-
-        center = Matrix(center)
-
-        casts = [AMBIENTLIGHT]
-
-        for light in lights:
-            dirAndDist = light.get_direction_and_distance(center)
+            center.append((vertices[i][0] + vertices[i][1] + vertices[i][2]) / 3)
 
-            if dirAndDist[1] > 0.1:
-                angleAmount = self.get_normal().get_dot_product(dirAndDist[0])
-                
-                interpolationAmount = (1 / ((dirAndDist[1] / light.brightness) ** 2)) * ((angleAmount + 1) / 2)
-
-                cast = interpolate_colour((0, 0, 0), light.colour, interpolationAmount)
-            else:
-                cast = (255, 255, 255)
-                
-            casts.append(cast)
-
-        return add_colours(casts)
+        return cast_light(lights, self.get_normal(), Vec3(*center))
         
 
 
@@ -156,12 +188,239 @@ class Mesh(Abstract):
                  distortion:Matrix=None, 
                  tags:list[str]=None):
         super().__init__(location, distortion, tags)
+
+        # A mesh can keep all of its triangles packed into a few arrays instead of 
+        # having a Tri abstract for every single one. Then when the mesh moves, it's
+        # only the mesh that moves; the triangles are stored relative to it, so they 
+        # just come along for the ride without being touched.
+
+        # vertexBuffer holds every vertex once, relative to the mesh, and indexBuffer 
+        # says which three vertices each triangle is made of. Everything else has one 
+        # entry per triangle.
+
+        self.vertexBuffer = numpy.zeros((0, 3))
+        self.indexBuffer = numpy.zeros((0, 3), numpy.intp)
+
+        self.triNormals = numpy.zeros((0, 3))                 # Relative to the mesh and not normalised
+        self.triAlbedos = numpy.zeros((0, 3, 3))              # A colour for each corner
+        self.triUVs = numpy.zeros((0, 3, 2))                  # A texture coordinate for each corner
+        self.triMaterials = numpy.zeros(0, numpy.int8)        # One of the MATERIAL constants
+        self.triLit = numpy.zeros(0, bool)
+        self.triBackfaceCulling = numpy.zeros(0, bool)
+
+        self.triTextures = [] # These are normal lists since there's 
+        self.triTags = []     # no point putting them in arrays
+
+        # This is a sphere that all the packed triangles fit inside, so the camera can throw away
+        # the whole mesh in one go if the sphere's off the screen. It's stored relative to the
+        # mesh, and the objective version gets worked out again whenever the mesh is transformed.
+        self.boundingCenter = numpy.zeros(3)
+        self.boundingRadius = 0.0
+
+        self.objectiveBounds = None # (center, radius) in objective space, or None if it needs updating
+
+    def get_tri_count(self):
+        return len(self.indexBuffer)
+    
+    def update_bounds(self):
+        if not len(self.vertexBuffer):
+            self.boundingCenter = numpy.zeros(3)
+            self.boundingRadius = 0.0
+        else:
+            self.boundingCenter = (self.vertexBuffer.min(0) + self.vertexBuffer.max(0)) / 2
+            self.boundingRadius = float(numpy.sqrt(((self.vertexBuffer - self.boundingCenter) ** 2).sum(1).max()))
+
+        self.objectiveBounds = None
+
+    def get_objective_bounds(self):
+        if self.objectiveBounds is None:
+            distortion = numpy.array(self.objectiveDistortion.get_contents(), numpy.float64)
+            location = numpy.array(self.objectiveLocation.get_contents(), numpy.float64).flatten()
+
+            # The distortion could stretch the sphere into a squashed blob, so we use the
+            # most it stretches anything by (the matrix's 2-norm) to keep it a sphere that
+            # still fits round everything.
+            self.objectiveBounds = (distortion @ self.boundingCenter + location,
+                                    self.boundingRadius * float(numpy.linalg.norm(distortion, 2)))
+
+        return self.objectiveBounds
+    
+    def transform_changed(self): # The mesh moved, so the bounds need working out again
+        self.objectiveBounds = None
+
+    def get_objective_vertices(self): # The vertex buffer moved into objective space, one vertex per row
+        distortion = numpy.array(self.objectiveDistortion.get_contents(), numpy.float64)
+        location = numpy.array(self.objectiveLocation.get_contents(), numpy.float64)
+
+        return self.vertexBuffer @ distortion.T + location.T
+    
+    def pack(self):
+        # This takes all the tris directly under the mesh and moves them into the buffers.
+        tris = [child for child in self.children if isinstance(child, Tri)]
+
+        if not tris:
+            return
+        
+        inversion = numpy.array(self.get_distortion_inverse().get_contents(), numpy.float64)
+        location = numpy.array(self.objectiveLocation.get_contents(), numpy.float64)
+
+        corners = []
+        normals = []
+        albedos = []
+        uvs = []
+        materials = []
+
+        for tri in tris:
+            # Move the tri's vertices into objective space, and then back into the mesh's space
+            triDistortion = numpy.array(tri.objectiveDistortion.get_contents(), numpy.float64)
+            triLocation = numpy.array(tri.objectiveLocation.get_contents(), numpy.float64)
+            triVertices = numpy.array(tri.vertices.get_contents(), numpy.float64)
+
+            corners.append((inversion @ (triDistortion @ triVertices + triLocation - location)).T)
+
+            normals.append(numpy.array(tri.get_normal().get_contents(), numpy.float64).flatten())
+
+            if type(tri) == GradientTri:
+                albedos.append([tri.albedo1, tri.albedo2, tri.albedo3])
+                uvs.append([(0, 0)] * 3)
+                materials.append(MATERIALGRADIENT)
+                self.triTextures.append(None)
+
+            elif type(tri) == TextureTri:
+                albedos.append([(0, 0, 0)] * 3)
+                uvs.append([tri.uv1, tri.uv2, tri.uv3])
+                materials.append(MATERIALTEXTURE)
+                self.triTextures.append(tri.texture)
+
+            else:
+                albedos.append([tri.albedo] * 3)
+                uvs.append([(0, 0)] * 3)
+                materials.append(MATERIALFLAT)
+                self.triTextures.append(None)
+
+            self.triTags.append(list(tri.tags))
+            self.triLit = numpy.append(self.triLit, bool(tri.lit))
+            self.triBackfaceCulling = numpy.append(self.triBackfaceCulling, tri.backfaceCulling)
+
+        # Lots of tris share corners, so we only keep one copy of each vertex
+        oldVertexCount = len(self.vertexBuffer)
+
+        vertices, indexes = numpy.unique(numpy.concatenate([self.vertexBuffer] + corners), axis=0, return_inverse=True)
+        indexes = indexes.reshape(-1)
+
+        self.vertexBuffer = vertices
+        self.indexBuffer = numpy.concatenate([indexes[:oldVertexCount][self.indexBuffer],     # Where the old vertices ended up
+                                              indexes[oldVertexCount:].reshape(-1, 3)])      # and the new ones
+
+        # Normals are kept relative to the mesh too
+        self.triNormals = numpy.concatenate([self.triNormals, numpy.array(normals) @ inversion.T])
+        self.triAlbedos = numpy.concatenate([self.triAlbedos, numpy.array(albedos, numpy.float64)])
+        self.triUVs = numpy.concatenate([self.triUVs, numpy.array(uvs, numpy.float64)])
+        self.triMaterials = numpy.concatenate([self.triMaterials, numpy.array(materials, numpy.int8)])
+
+        self.update_bounds()
+
+        for tri in tris:
+            tri.kill_self_and_substracts()
+
+    def make_tri(self, index:int): # Makes a Tri abstract out of one of the packed triangles
+        vertices = self.vertexBuffer[self.indexBuffer[index]].tolist()
+        lit = bool(self.triLit[index])
+
+        if self.triMaterials[index] == MATERIALGRADIENT:
+            albedos = [tuple(albedo) for albedo in self.triAlbedos[index].tolist()]
+            tri = GradientTri(vertices, albedos[0], albedos[1], albedos[2], lit)
+
+        elif self.triMaterials[index] == MATERIALTEXTURE:
+            uvs = [tuple(uv) for uv in self.triUVs[index].tolist()]
+            tri = TextureTri(vertices, self.triTextures[index], uvs[0], uvs[1], uvs[2], lit)
+
+        else:
+            tri = Tri(vertices, tuple(self.triAlbedos[index][0].tolist()), lit)
+
+        tri.tags = list(self.triTags[index])
+        tri.backfaceCulling = bool(self.triBackfaceCulling[index])
+
+        return tri
+    
+    def get_tris(self):
+        # This is the compatibility view. You get a Tri for every packed triangle, sat 
+        # where it would be if it was still a child of the mesh, but they aren't actually 
+        # in the scene. Changing their albedo changes the mesh, anything else doesn't.
+
+        # If you need to properly mess with them, use unpack() and then pack() when you're done.
+        tris = []
+
+        for index in range(self.get_tri_count()):
+            tri = self.make_tri(index)
+
+            tri.objectiveLocation = self.objectiveLocation
+            tri.objectiveDistortion = self.objectiveDistortion
+
+            tri.packedMesh = self
+            tri.packedIndex = index
+
+            tris.append(tri)
+
+        return tris
+    
+    def unpack(self): # Turns the buffers back into child tris
+        for index in range(self.get_tri_count()):
+            self.add_child_relative(self.make_tri(index))
+
+        self.clear_buffers()
+
+    def clear_buffers(self):
+        self.vertexBuffer = numpy.zeros((0, 3))
+        self.indexBuffer = numpy.zeros((0, 3), numpy.intp)
+
+        self.triNormals = numpy.zeros((0, 3))
+        self.triAlbedos = numpy.zeros((0, 3, 3))
+        self.triUVs = numpy.zeros((0, 3, 2))
+        self.triMaterials = numpy.zeros(0, numpy.int8)
+        self.triLit = numpy.zeros(0, bool)
+        self.triBackfaceCulling = numpy.zeros(0, bool)
+
+        self.triTextures = []
+        self.triTags = []
+
+        self.update_bounds()
+
+    def set_backface_culling(self, backfaceCulling:bool):
+        # Turn this on for closed shapes, where you can never see the inside anyway. It
+        # roughly halves the number of tris that get drawn. Leave it off for anything 
+        # you need to see from both sides, like a Plane used as a wall.
+        self.triBackfaceCulling[:] = backfaceCulling
+
+        for tri in self.get_substracts_of_type(Tri, True):
+            tri.backfaceCulling = backfaceCulling
+
+    def get_tri_indexes_with_tag(self, tag:str):
+        return [index for index in range(len(self.triTags)) if tag in self.triTags[index]]
+    
+    def set_tri_albedo(self, index:int, albedo:tuple):
+        # Like Tri.set_albedo(), this only changes the colour flat tris are drawn with
+        self.triAlbedos[index] = albedo[:3]
+
+    def set_tri_texture(self, index:int, texture:Texture, uv1:tuple, uv2:tuple, uv3:tuple, lit:bool):
+        self.triMaterials[index] = MATERIALTEXTURE
+        self.triTextures[index] = texture
+        self.triUVs[index] = (uv1, uv2, uv3)
+        self.triLit[index] = lit
     
     def change_tris_to_gradient(self, colour1, colour2, colour3):
         for tri in self.get_substracts_of_type(Tri) + self.get_substracts_of_type(TextureTri):
             self.add_child_relative(GradientTri(tri.vertices.get_transpose().get_contents(), colour1, colour2, colour3, tri.lit, tri.tags))
             tri.kill_self_and_substracts()
             del tri
+
+        toChange = self.triMaterials != MATERIALGRADIENT
+
+        self.triAlbedos[toChange] = (colour1[:3], colour2[:3], colour3[:3])
+        self.triMaterials[toChange] = MATERIALGRADIENT
+
+        for index in numpy.nonzero(toChange)[0]:
+            self.triTextures[index] = None
     
     def change_tris_to_flat_colour(self, colour):
         for tri in self.get_substracts_of_type(GradientTri) + self.get_substracts_of_type(TextureTri):
@@ -169,6 +428,14 @@ class Mesh(Abstract):
             tri.kill_self_and_substracts()
             del tri
 
+        toChange = self.triMaterials != MATERIALFLAT
+
+        self.triAlbedos[toChange] = colour[:3]
+        self.triMaterials[toChange] = MATERIALFLAT
+
+        for index in numpy.nonzero(toChange)[0]:
+            self.triTextures[index] = None
+
 
 
 class Plane(Mesh):
@@ -203,25 +470,25 @@ class Plane(Mesh):
                 self.add_child_relative(Tri([[corner[0] + quadWidth, 0, corner[1] + quadHeight],
                                              [corner[0] + quadWidth, 0, corner[1]],
                                              [corner[0], 0, corner[1] + quadHeight]], self.colour, self.lit, ["PlaneTri"]))
+                
+        self.pack()
         
     def set_quad_resolution(self, quadResolution:tuple):
-        tris = self.get_children_with_tag("PlaneTri")
-        for tri in tris:
-            tri.kill_self()
+        self.clear_buffers()
         
         self.quadResolution = quadResolution
 
         self.generate_plane()
 
     def set_pattern_triangles(self, colour1:tuple, colour2:tuple):
-        tris = self.get_children_with_tag("PlaneTri")
+        tris = self.get_tri_indexes_with_tag("PlaneTri")
 
         for i in range(0, len(tris), 2):
-            tris[i].set_albedo(colour1)
-            tris[i+1].set_albedo(colour2)
+            self.set_tri_albedo(tris[i], colour1)
+            self.set_tri_albedo(tris[i+1], colour2)
 
     def set_pattern_gradient(self, left, right):
-        tris = self.get_children_with_tag("PlaneTri")
+        tris = self.get_tri_indexes_with_tag("PlaneTri")
 
         step = []
 
@@ -230,9 +497,9 @@ class Plane(Mesh):
 
         for i in range(self.quadResolution[1]):
             for j in range(self.quadResolution[0] * 2):
-                tris[i * self.quadResolution[0] * 2 + j].set_albedo((left[0] + j * step[0], 
-                                                                 left[1] + j * step[1], 
-                                                                 left[2] + j * step[2]))
+                self.set_tri_albedo(tris[i * self.quadResolution[0] * 2 + j], (left[0] + j * step[0], 
+                                                                               left[1] + j * step[1], 
+                                                                               left[2] + j * step[2]))
     
     def set_pattern_texture(self, texture:Texture):
         textureHeight = texture.surface.get_height() - 1
@@ -240,26 +507,19 @@ class Plane(Mesh):
         UVWidth = math.floor((texture.surface.get_width() - 1)/ self.quadResolution[0])
         UVHeight = math.floor((textureHeight - 1) / self.quadResolution[1]) 
 
-        tris = self.get_children_with_tag("PlaneTri")
+        tris = self.get_tri_indexes_with_tag("PlaneTri")
 
         for i in range(self.quadResolution[1]):
             for j in range(0, self.quadResolution[0] * 2, 2):
-                currentTri = tris[i * self.quadResolution[0] * 2 + j]
-
-                self.add_child_relative(TextureTri(currentTri.vertices.get_transpose().get_contents(), texture, 
-                                                   (i * UVWidth, textureHeight - (j/2) * UVHeight),
-                                                   (i * UVWidth, textureHeight - ((j/2)+1) * UVHeight),
-                                                   ((i+1) * UVWidth, textureHeight - (j/2) * UVHeight), True))
-                
-                currentTri = tris[i * self.quadResolution[0] * 2 + j + 1]
+                self.set_tri_texture(tris[i * self.quadResolution[0] * 2 + j], texture, 
+                                     (i * UVWidth, textureHeight - (j/2) * UVHeight),
+                                     (i * UVWidth, textureHeight - ((j/2)+1) * UVHeight),
+                                     ((i+1) * UVWidth, textureHeight - (j/2) * UVHeight), True)
 
-                self.add_child_relative(TextureTri(currentTri.vertices.get_transpose().get_contents(), texture, 
-                                                   ((i+1) * UVWidth, textureHeight - (j/2 + 1) * UVHeight),
-                                                   (i * UVWidth, textureHeight - ((j/2)+1) * UVHeight),
-                                                   ((i+1) * UVWidth, textureHeight - (j/2) * UVHeight), True))
-        
-        for tri in tris:
-            tri.kill_self_and_substracts()
+                self.set_tri_texture(tris[i * self.quadResolution[0] * 2 + j + 1], texture, 
+                                     ((i+1) * UVWidth, textureHeight - (j/2 + 1) * UVHeight),
+                                     (i * UVWidth, textureHeight - ((j/2)+1) * UVHeight),
+                                     ((i+1) * UVWidth, textureHeight - (j/2) * UVHeight), True)
 
 
 
@@ -280,13 +540,13 @@ class Cube(Mesh):
 
     def generate_cube(self):
         # Front
-        face1 = Matrix([[-0.5, -0.5, 0.5],
-                        [0.5, -0.5, 0.5],
-                        [-0.5, 0.5, 0.5]]).get_transpose()
+        face1 = Mat3(-0.5, -0.5, 0.5,
+                     0.5, -0.5, 0.5,
+                     -0.5, 0.5, 0.5).get_transpose()
         
-        face2 = Matrix([[0.5, 0.5, 0.5],
-                        [-0.5, 0.5, 0.5],
-                        [0.5, -0.5, 0.5]]).get_transpose()
+        face2 = Mat3(0.5, 0.5, 0.5,
+                     -0.5, 0.5, 0.5,
+                     0.5, -0.5, 0.5).get_transpose()
         
         rotation = I3
         
@@ -294,43 +554,41 @@ class Cube(Mesh):
             self.add_child_relative(Tri(rotation.apply(face1).get_transpose().get_contents(), self.colour, self.lit, ["CubeTri"]))
             self.add_child_relative(Tri(rotation.apply(face2).get_transpose().get_contents(), self.colour, self.lit, ["CubeTri"]))
 
-            rotation = rotation.apply(Matrix([[0, 0, 1],
-                                              [0, 1, 0],
-                                              [-1, 0, 0]]))
+            rotation = rotation.apply(Mat3(0, 0, 1,
+                                           0, 1, 0,
+                                           -1, 0, 0))
             
-        rotation = Matrix([[1, 0, 0],
-                           [0, 0, -1],
-                           [0, 1, 0]])
+        rotation = Mat3(1, 0, 0,
+                        0, 0, -1,
+                        0, 1, 0)
 
         for i in range(2):
             self.add_child_relative(Tri(rotation.apply(face1).get_transpose().get_contents(), self.colour, self.lit, ["CubeTri"]))
             self.add_child_relative(Tri(rotation.apply(face2).get_transpose().get_contents(), self.colour, self.lit, ["CubeTri"]))
 
-            rotation = rotation.apply(Matrix([[1, 0, 0],
-                                              [0, -1, 0],
-                                              [0, 0, -1]]))
+            rotation = rotation.apply(Mat3(1, 0, 0,
+                                           0, -1, 0,
+                                           0, 0, -1))
+            
+        self.pack()
+        self.set_backface_culling(True) # You can't see inside a cube
 
         
     def set_pattern_texture(self, texture:Texture):
         textureSize = texture.surface.get_size()
 
-        tris = self.get_children_with_tag("CubeTri")
+        tris = self.get_tri_indexes_with_tag("CubeTri")
 
         for i in range(6):
-            self.add_child_relative(TextureTri(tris[i * 2].get_vertices().get_transpose().get_contents(),
-                                               texture,
-                                               (0, 0), 
-                                               (textureSize[0] - 1, 0), 
-                                               (0, textureSize[1] - 1), True))
-            
-            self.add_child_relative(TextureTri(tris[i * 2 + 1].get_vertices().get_transpose().get_contents(),
-                                               texture,
-                                               (textureSize[0] - 1, textureSize[1] - 1), 
-                                               (textureSize[0] - 1, 0), 
-                                               (0, textureSize[1] - 1), True))
+            self.set_tri_texture(tris[i * 2], texture,
+                                 (0, 0), 
+                                 (textureSize[0] - 1, 0), 
+                                 (0, textureSize[1] - 1), True)
             
-        for tri in tris:
-            tri.kill_self_and_substracts()
+            self.set_tri_texture(tris[i * 2 + 1], texture,
+                                 (textureSize[0] - 1, textureSize[1] - 1), 
+                                 (textureSize[0] - 1, 0), 
+                                 (0, textureSize[1] - 1), True)
 
 
 
@@ -420,6 +678,9 @@ class Wavefront(Mesh):
                     else:
                         self.add_child_relative(Tri(v, self.colour, self.lit, ["MeshTri"]))
 
+        self.pack()
+        self.set_backface_culling(True) # Models are usually closed. If yours isn't, you can turn this off again
+
 
 
 class Light(Abstract):
@@ -434,10 +695,12 @@ class Light(Abstract):
         self.brightness = brightness if brightness else 1
         self.colour = colour if colour else (255, 255, 255)
 
+        self.direction = Vec3(0, 0, 0) # This gets reused by get_direction_and_distance(), so use it straight away
+
     def get_direction_and_distance(self, point):
-        direction = self.objectiveLocation.subtract(point)
+        direction = self.objectiveLocation.subtract(point, self.direction)
         distance = direction.get_magnitude()
-        direction = direction.set_magnitude(1)
+        direction.set_magnitude(1, direction)
 
         return (direction, distance)
     
@@ -455,17 +718,30 @@ class SunLight(Light):
         self.colour = colour if colour else (255, 255, 255)
 
     def get_direction_and_distance(self, point):
-        return (self.objectiveDistortion.apply(Matrix([[0],
-                                                       [1],
-                                                       [0]])), 1)
+        return (self.objectiveDistortion.apply(Vec3(0,
+                                                    1,
+                                                    0)), 1)
 
 displayWidth = displaySizeX * 2 - 1
 displayHeight = displaySizeY * 2 - 1
         
 class Camera(Abstract):
-    def __init__(self, location, distortion, fieldOfView:float):
+    def __init__(self, location, distortion, fieldOfView:float, rasterizer:str=None, workers:int=None, tileSize:int=None):
         super().__init__(location, distortion, ["Camera"])
 
+        self.rasterizer = rasterizer if rasterizer else "scanline" # This gets passed on to DISPLAY when we render.
+                                                                   # See Image.rasterizer for the options
+
+        self.workers = workers     # These are only used by the "tiled" rasterizer. If you leave them
+        self.tileSize = tileSize   # out you get one worker per core and 32x32 tiles
+
+        self.culledTris = 0 # How many tris were skipped for facing away in the last frame
+        self.culledMeshes = 0 # How many meshes were skipped for being completely off the screen in the last frame
+
+        # These get written over for every loose tri we project, so we don't have to make new ones each time
+        self.triLocationMatrix = Mat3(0, 0, 0, 0, 0, 0, 0, 0, 0)
+        self.triCameraVertices = Mat3(0, 0, 0, 0, 0, 0, 0, 0, 0)
+
         self.perspectiveConstant = math.tan((fieldOfView / 180) * math.pi / 2) / (DISPLAY.resolution[1] / 2)
         # This converts the field of view into radians, then finds the perspective
         # constant needed to get that field of view.
@@ -481,16 +757,11 @@ class Camera(Abstract):
 
         # Rearrange to make perspectiveConstant = tan(theta) / half the resolution
         
-    def project_tri(self, cameraLocationMatrix:Matrix, inversion:Matrix, tri:Tri, depthBuffer:Image, lights:list[Light]=[]):
-        triLocation = tri.objectiveLocation.get_contents()
-
-        triLocationMatrix = Matrix([[triLocation[0][0], triLocation[0][0], triLocation[0][0]],  # This is the tri's location
-                                    [triLocation[1][0], triLocation[1][0], triLocation[1][0]],  # repeated three times as collumbs
-                                    [triLocation[2][0], triLocation[2][0], triLocation[2][0]]]) # in a 3x3 matrix
-
-        triObjectiveVertices = tri.objectiveDistortion.apply(tri.get_vertices()).add(triLocationMatrix) # The tri's vertices in objective space
-        
-        triCameraVertices = inversion.apply(triObjectiveVertices.subtract(cameraLocationMatrix)).get_contents() # This is the tri's vertices
+    def project_vertices(self, cameraLocationMatrix:Matrix, inversion:Matrix, triObjectiveVertices:Matrix, backfaceCulling:bool=False):
+        # Takes a tri's vertices in objective space and works out where they go on the screen. 
+        # Gives you None if the tri is behind the camera or off the screen, or if it's facing
+        # away from us and backfaceCulling is on.
+        triCameraVertices = inversion.apply(triObjectiveVertices.subtract(cameraLocationMatrix, self.triCameraVertices), self.triCameraVertices).get_contents() # This is the tri's vertices
                                                                                                                 # relative to the camera
         # Finds the tri's position relative to the camera
         
@@ -513,60 +784,236 @@ class Camera(Abstract):
                 (0 <= vertex3[0] <= displayWidth and
                 0 <= vertex3[1] <= displayHeight)):
 
-                if tri.lit:
-                    lightCast = tri.get_light_cast(lights, triObjectiveVertices)
-                else:
-                    lightCast = None
-                
-                if type(tri) == GradientTri:
-                    if tri.lit:
-                        colour1 = overlay_colours(tri.albedo1, lightCast)
-                        colour2 = overlay_colours(tri.albedo2, lightCast)
-                        colour3 = overlay_colours(tri.albedo3, lightCast)
-                    else:
-                        colour1 = tri.albedo1
-                        colour2 = tri.albedo2
-                        colour3 = tri.albedo3
-
-                    DISPLAY.draw_triangle(vertex1, vertex2, vertex3, 
-                                          depthBuffer, triCameraVertices[2][0], triCameraVertices[2][1], triCameraVertices[2][2],
-                                          colour1, 
-                                          colour2, 
-                                          colour3)
-                    
-                elif type(tri) == TextureTri:
-                    DISPLAY.draw_triangle(vertex1, vertex2, vertex3,
-                                          depthBuffer, triCameraVertices[2][0], triCameraVertices[2][1], triCameraVertices[2][2],
-                                          texture=tri.texture,
-                                          uv1=tri.uv1, uv2=tri.uv2, uv3=tri.uv3,
-                                          lightCast = lightCast)
-
-                else:
-                    if tri.lit:
-                        colour = overlay_colours(tri.albedo, lightCast)
-                    else:
-                        colour = tri.albedo
+                if backfaceCulling and self.is_backface(triCameraVertices):
+                    self.culledTris += 1
+                    return None
+
+                return ((vertex1, vertex2, vertex3), triCameraVertices[2])
+            
+        return None
+    
+    def is_backface(self, triCameraVertices:list[list[float]]):
+        # The camera's at the origin in camera space, so the tri faces away from it if
+        # its normal points the same way as the line from the camera to any of its corners.
+        corner = Vec3(triCameraVertices[0][0], triCameraVertices[1][0], triCameraVertices[2][0])
 
-                    DISPLAY.draw_triangle(vertex1, vertex2, vertex3, 
-                                          depthBuffer, triCameraVertices[2][0], triCameraVertices[2][1], triCameraVertices[2][2],
-                                          colour)
+        edge1 = Vec3(triCameraVertices[0][1], triCameraVertices[1][1], triCameraVertices[2][1]).isub(corner)
+        edge2 = Vec3(triCameraVertices[0][2], triCameraVertices[1][2], triCameraVertices[2][2]).isub(corner)
+
+        return edge1.get_cross_product(edge2, edge1).get_dot_product(corner) > 0
+    
+    def draw_projected_tri(self, 
+                           vertices:tuple, 
+                           depths:list[float], 
+                           depthBuffer:Image, 
+                           material:int, 
+                           albedos:tuple, 
+                           lightCast:tuple=None, 
+                           texture:Texture=None, 
+                           uvs:tuple=None):
+        if material == MATERIALGRADIENT:
+            if lightCast:
+                colour1 = overlay_colours(albedos[0], lightCast)
+                colour2 = overlay_colours(albedos[1], lightCast)
+                colour3 = overlay_colours(albedos[2], lightCast)
+            else:
+                colour1 = albedos[0]
+                colour2 = albedos[1]
+                colour3 = albedos[2]
+
+            DISPLAY.draw_triangle(vertices[0], vertices[1], vertices[2], 
+                                  depthBuffer, depths[0], depths[1], depths[2],
+                                  colour1, 
+                                  colour2, 
+                                  colour3)
+            
+        elif material == MATERIALTEXTURE:
+            DISPLAY.draw_triangle(vertices[0], vertices[1], vertices[2],
+                                  depthBuffer, depths[0], depths[1], depths[2],
+                                  texture=texture,
+                                  uv1=uvs[0], uv2=uvs[1], uv3=uvs[2],
+                                  lightCast = lightCast)
+
+        else:
+            if lightCast:
+                colour = overlay_colours(albedos[0], lightCast)
+            else:
+                colour = albedos[0]
+
+            DISPLAY.draw_triangle(vertices[0], vertices[1], vertices[2], 
+                                  depthBuffer, depths[0], depths[1], depths[2],
+                                  colour)
+        
+    def project_tri(self, cameraLocationMatrix:Matrix, inversion:Matrix, tri:Tri, depthBuffer:Image, lights:list[Light]=[]):
+        triLocation = tri.objectiveLocation.get_contents()
+
+        triLocationMatrix = write_mat3(triLocation[0][0], triLocation[0][0], triLocation[0][0],  # This is the tri's location
+                                       triLocation[1][0], triLocation[1][0], triLocation[1][0],  # repeated three times as collumbs
+                                       triLocation[2][0], triLocation[2][0], triLocation[2][0],  # in a 3x3 matrix
+                                       self.triLocationMatrix)
+
+        triObjectiveVertices = tri.objectiveDistortion.apply(tri.get_vertices()).iadd(triLocationMatrix) # The tri's vertices in objective space
+        
+        projection = self.project_vertices(cameraLocationMatrix, inversion, triObjectiveVertices, tri.backfaceCulling)
+
+        if not projection:
+            return
+        
+        if tri.lit:
+            lightCast = tri.get_light_cast(lights, triObjectiveVertices)
+        else:
+            lightCast = None
+        
+        if type(tri) == GradientTri:
+            self.draw_projected_tri(projection[0], projection[1], depthBuffer, MATERIALGRADIENT,
+                                    (tri.albedo1, tri.albedo2, tri.albedo3), lightCast)
+            
+        elif type(tri) == TextureTri:
+            self.draw_projected_tri(projection[0], projection[1], depthBuffer, MATERIALTEXTURE,
+                                    None, lightCast, tri.texture, (tri.uv1, tri.uv2, tri.uv3))
+
+        else:
+            self.draw_projected_tri(projection[0], projection[1], depthBuffer, MATERIALFLAT,
+                                    (tri.albedo,), lightCast)
+            
+    def can_see_sphere(self, cameraLocation:numpy.ndarray, cameraInversion:numpy.ndarray, center:numpy.ndarray, radius:float):
+        # Checks a sphere against the view frustum, which is the pyramid of space the camera
+        # can see. If the sphere's completely outside any of its sides, we can't see it.
+        cameraCenter = cameraInversion @ (center - cameraLocation.flatten())
+        cameraRadius = radius * float(numpy.linalg.norm(cameraInversion, 2))
+
+        if cameraCenter[2] + cameraRadius <= 0.1: # Everything behind this gets culled anyway
+            return False
+        
+        # The sides of the pyramid go out by this much sideways for every unit forwards. 
+        # There's an extra pixel on each so rounding can never make us throw out something
+        # that would've been drawn.
+        slopeX = (displaySizeX + 1) * self.perspectiveConstant
+        slopeY = (displaySizeY + 1) * self.perspectiveConstant
+
+        # Distances from the center to each side, which are positive outside the frustum
+        if (abs(cameraCenter[0]) - slopeX * cameraCenter[2]) / math.sqrt(1 + slopeX ** 2) > cameraRadius:
+            return False
+        
+        if (abs(cameraCenter[1]) - slopeY * cameraCenter[2]) / math.sqrt(1 + slopeY ** 2) > cameraRadius:
+            return False
+        
+        return True
+    
+    def project_mesh(self, cameraLocation:numpy.ndarray, cameraInversion:numpy.ndarray, mesh:Mesh, depthBuffer:Image, lights:list[Light]=[]):
+        # The packed version of project_tri(). Instead of moving every tri into objective space
+        # and then into camera space one at a time, we squash the mesh's transform and the 
+        # camera's inverse transform into one matrix, and then push the whole vertex buffer
+        # through it at once. The perspective divide and screen mapping are done the same way.
+        if not mesh.get_tri_count():
+            return
+        
+        bounds = mesh.get_objective_bounds()
+
+        if not self.can_see_sphere(cameraLocation, cameraInversion, bounds[0], bounds[1]):
+            self.culledMeshes += 1
+            return
+        
+        distortion = numpy.array(mesh.objectiveDistortion.get_contents(), numpy.float64)
+        location = numpy.array(mesh.objectiveLocation.get_contents(), numpy.float64)
+
+        meshToCamera = cameraInversion @ distortion
+        offset = cameraInversion @ (location - cameraLocation)
+
+        cameraVertices = mesh.vertexBuffer @ meshToCamera.T + offset.T
+
+        depths = cameraVertices[:, 2]
+        inFront = depths > 0.1
+
+        scaledDepths = numpy.where(inFront, depths, 1) * self.perspectiveConstant # So we don't divide by zero for vertices we'll throw away
+
+        screenXs = numpy.floor(cameraVertices[:, 0] / scaledDepths + displaySizeX)
+        screenYs = numpy.floor(-cameraVertices[:, 1] / scaledDepths + displaySizeY)
+
+        onScreen = inFront & (0 <= screenXs) & (screenXs <= displayWidth) & (0 <= screenYs) & (screenYs <= displayHeight)
+
+        # Same tests as project_vertices(): every corner has to be in front of the camera,
+        # and at least one has to be on the screen
+        visible = inFront[mesh.indexBuffer].all(1) & onScreen[mesh.indexBuffer].any(1)
+
+        if mesh.triBackfaceCulling.any():
+            corners = cameraVertices[mesh.indexBuffer]
+            normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+            backfaces = visible & mesh.triBackfaceCulling & ((normals * corners[:, 0]).sum(1) > 0)
+
+            self.culledTris += int(backfaces.sum())
+            visible &= ~backfaces
+
+        visibleTris = numpy.nonzero(visible)[0]
+
+        if not len(visibleTris):
+            return
+        
+        screenVertices = list(zip(screenXs.astype(int).tolist(), screenYs.astype(int).tolist()))
+        depths = depths.tolist()
+        indexes = mesh.indexBuffer.tolist()
+
+        litTris = visibleTris[mesh.triLit[visibleTris]]
+
+        if len(litTris):
+            centers = (mesh.vertexBuffer[mesh.indexBuffer[litTris]].sum(1) / 3) @ distortion.T + location.T
+            normals = mesh.triNormals[litTris] @ distortion.T
+
+            lightCasts = {}
+
+            for i in range(len(litTris)):
+                normal = Vec3(*normals[i].tolist())
+
+                lightCasts[litTris[i]] = cast_light(lights, 
+                                                    normal.set_magnitude(1, normal), 
+                                                    Vec3(*centers[i].tolist()))
+
+        for index in visibleTris.tolist():
+            corners = indexes[index]
+
+            self.draw_projected_tri((screenVertices[corners[0]], screenVertices[corners[1]], screenVertices[corners[2]]),
+                                    (depths[corners[0]], depths[corners[1]], depths[corners[2]]), 
+                                    depthBuffer, mesh.triMaterials[index],
+                                    [tuple(albedo) for albedo in mesh.triAlbedos[index].tolist()], 
+                                    lightCasts[index] if mesh.triLit[index] else None,
+                                    mesh.triTextures[index], mesh.triUVs[index].tolist())
         
     def rasterize(self):
-        tris = ROOT.get_substracts_of_type(Tri) + ROOT.get_substracts_of_type(GradientTri) + ROOT.get_substracts_of_type(TextureTri)
+        tris = ROOT.get_substracts_of_type(Tri, True) # This includes GradientTris and TextureTris
+
+        meshes = ROOT.get_substracts_of_type(Mesh, True)
         
-        lights = ROOT.get_substracts_of_type(Light) + ROOT.get_substracts_of_type(SunLight)
+        lights = ROOT.get_substracts_of_type(Light, True)
 
-        inversion = self.objectiveDistortion.get_3x3_inverse()
+        inversion = self.get_distortion_inverse()
         location = self.objectiveLocation.get_contents()
-        locationMatrix = Matrix([[location[0][0], location[0][0], location[0][0]],
-                                 [location[1][0], location[1][0], location[1][0]],
-                                 [location[2][0], location[2][0], location[2][0]]])
+        locationMatrix = Mat3(location[0][0], location[0][0], location[0][0],
+                              location[1][0], location[1][0], location[1][0],
+                              location[2][0], location[2][0], location[2][0])
         
+        DISPLAY.rasterizer = self.rasterizer
+
+        if self.rasterizer == "tiled" and not DISPLAY.tileRenderer:
+            DISPLAY.tileRenderer = TileRenderer(DISPLAY, DEPTHBUFFER, self.workers, self.tileSize)
+
         DISPLAY.fill((255, 255, 255))
         DEPTHBUFFER.fill(1024.0)
+
+        self.culledTris = 0
+        self.culledMeshes = 0
         
         for tri in tris:
             self.project_tri(locationMatrix, inversion, tri, DEPTHBUFFER, lights)
+
+        cameraLocation = numpy.array(location, numpy.float64)
+        cameraInversion = numpy.array(inversion.get_contents(), numpy.float64)
+
+        for mesh in meshes:
+            self.project_mesh(cameraLocation, cameraInversion, mesh, DEPTHBUFFER, lights)
+
+        if self.rasterizer == "tiled":
+            DISPLAY.tileRenderer.flush()
         
         DISPLAY.render_image(WINDOW, (0, 0))
 
@@ -1,6 +1,10 @@
+import time
+import numpy
+
 from engine.clamp import *
 from engine.matrix import *
 from engine.abstract import *
+from engine.bvh import *
 
 GRAVFIELDSTRENGTH = 9.81 # The strength of the scene's gravitational field 
                          # measured in Newtons per kilogram (NKg^-1)
@@ -9,9 +13,25 @@ GRAVFIELDSTRENGTH = 9.81 # The strength of the scene's gravitational field
 
                          # It's named like a constant but you're free to change it if you want
 
-GRAVDIRECTION = Matrix([[0],  # This is the direction gravity points in as a vector. You probably won't need to
-                        [-1], # change this unless it's for a game mechanic
-                        [0]])
+GRAVDIRECTION = Vec3(0,  # This is the direction gravity points in as a vector. You probably won't need to
+                      -1, # change this unless it's for a game mechanic
+                      0)
+
+BROADPHASEMARGIN = 0.05 # How much bigger than a collider its box is in the broadphase. Colliders get
+                        # shoved about while collisions are being sorted out, so this stops anything
+                        # that gets shoved into something else from being missed
+
+SWEEPOVERLAP = 0.05 # When a fast sphere gets wound back to where it hit something, it's left overlapping by this
+                    # much of its radius, so the normal collision checks still see it and bounce it off
+
+SLEEPSPEED = 0.1 # Dynamic bodies moving slower than this on average (in units per second) count as still
+
+SLEEPSMOOTHING = 1 # Roughly how many seconds that average is taken over. Things in a pile tend to jiggle 
+                   # back and forth without getting anywhere, and averaging cancels that out
+
+SLEEPTIME = 0.5 # How many seconds a body has to stay still for before it falls asleep. Sleeping bodies
+                # don't fall, move or get checked against the things they're resting on, so piles of
+                # stuff that have settled down cost next to nothing
 
 
 
@@ -29,14 +49,33 @@ class SphereCollider(Abstract):
 
         self.intersectionMethods = {
             SphereCollider : self.intersect_sphere, 
-            PlaneCollider : self.intersect_plane
+            PlaneCollider : self.intersect_plane,
+            MeshCollider : self.intersect_mesh
         }
 
         self.collisionNormalMethods = {
             SphereCollider : self.get_collision_normal_sphere,
-            PlaneCollider : self.get_collision_normal_plane
+            PlaneCollider : self.get_collision_normal_plane,
+            MeshCollider : self.get_collision_normal_mesh
+        }
+
+        self.sweepMethods = {
+            SphereCollider : self.sweep_sphere,
+            PlaneCollider : self.sweep_plane,
+            MeshCollider : self.sweep_mesh
         }
 
+    def get_sweep(self):
+        # Gives back how far our body moved in its last step, but only if that's far enough that 
+        # we could have gone straight through something without ever overlapping it
+        if not self.body or self.body.lastStep is None or self.body.sleeping:
+            return None
+        
+        if self.body.lastStep.get_magnitude() <= self.radius:
+            return None
+        
+        return self.body.lastStep
+
     def intersect_sphere(self, sphere:Abstract, collide:bool=False):
         difference = sphere.objectiveLocation.subtract(self.objectiveLocation)
 
@@ -62,16 +101,17 @@ class SphereCollider(Abstract):
         return False
     
     def intersect_plane(self, plane:Abstract, collide:bool=False):
-        relativeToPlane = plane.objectiveDistortion.get_3x3_inverse().apply(self.objectiveLocation.subtract(plane.objectiveLocation)).get_contents()
+        relativeToPlane = self.objectiveLocation.subtract(plane.objectiveLocation)
+        relativeToPlane = plane.get_distortion_inverse().apply(relativeToPlane, relativeToPlane).get_contents()
 
         if (abs(relativeToPlane[0][0]) < plane.width / 2 and 
                 abs(relativeToPlane[1][0]) < self.radius and 
                 abs(relativeToPlane[2][0]) < plane.length / 2):
             
             if collide and self.body.dynamic:
-                difference = Matrix([[0], 
-                                     [self.radius - relativeToPlane[1][0]],
-                                     [0]]) 
+                difference = Vec3(0, 
+                                  self.radius - relativeToPlane[1][0],
+                                  0) 
                 
                 objectiveDifference = plane.body.objectiveDistortion.apply(difference)
                 
@@ -81,10 +121,13 @@ class SphereCollider(Abstract):
         
         return False
     
+    def intersect_mesh(self, mesh:Abstract, collide:bool=False):
+        return mesh.intersect_sphere(self, collide) # It's the same check from either side
+    
     def intersect(self, collider:Abstract, collide:bool=False):
         if self.intersectionMethods[type(collider)](collider, collide):
 
-            if collider.body not in self.body.intersections:
+            if CONTACTS.add(self, collider): # Only the first time this step
                 self.body.intersections.append(collider.body)
                 collider.body.intersections.append(self.body)
 
@@ -105,15 +148,138 @@ class SphereCollider(Abstract):
             return ORIGIN
         
     def get_collision_normal_plane(self, plane):
-        direction = plane.objectiveDistortion.apply(Matrix([[0],
-                                              [1],
-                                              [0]]))
+        direction = plane.objectiveDistortion.apply(Vec3(0,
+                                                         1,
+                                                         0))
         
         return direction.set_magnitude(1)
     
+    def get_collision_normal_mesh(self, mesh):
+        return mesh.get_collision_normal_sphere(self).multiply_scalar(-1)
+    
     def get_collision_normal(self, collider):
         return self.collisionNormalMethods[type(collider)](collider)
     
+    def get_bounds(self, padding:float=0, thickness:float=0):
+        # Gives back the box we fit in as ([minX, minY, minZ], [maxX, maxY, maxZ]). Spheres don't 
+        # need thickness, it's only there so everything can be asked the same way
+        location = self.objectiveLocation
+        halfSize = self.radius + padding
+
+        low = [location.x - halfSize, location.y - halfSize, location.z - halfSize]
+        high = [location.x + halfSize, location.y + halfSize, location.z + halfSize]
+
+        sweep = self.get_sweep()
+
+        if sweep: # If we're moving fast, the box has to cover everywhere we've been this step
+            for axis, distance in enumerate((sweep.x, sweep.y, sweep.z)):
+                if distance > 0:
+                    low[axis] -= distance
+                else:
+                    high[axis] -= distance
+
+        return (low, high)
+    
+    # This is continuous collision detection. Normally we only check whether things overlap 
+    # after they've moved, so something moving fast enough can end up on the other side of a thin 
+    # wall without ever touching it. Instead, we trace the path we took during the last step
+    # and work out when along it (from 0 to 1) we'd have first hit something.
+
+    def sweep_sphere(self, sphere:Abstract, start:Matrix, step:Matrix):
+        # The other sphere's treated as if it stayed where it is now, which is close enough
+        reach = self.radius + sphere.radius
+
+        offset = start.subtract(sphere.objectiveLocation)
+
+        if offset.get_magnitude() < reach or offset.add(step).get_magnitude() < reach:
+            return None # We started or finished overlapping, so the normal checks can deal with it
+        
+        # We want the t where |offset + t * step| = reach, which is a quadratic:
+        # (step . step)t^2 + 2(offset . step)t + (offset . offset) - reach^2 = 0
+        reach *= 1 - SWEEPOVERLAP
+
+        a = step.get_dot_product(step)
+        b = 2 * offset.get_dot_product(step)
+        c = offset.get_dot_product(offset) - reach ** 2
+
+        discriminant = b ** 2 - 4 * a * c
+
+        if discriminant < 0: # We never got close enough
+            return None
+        
+        t = (-b - math.sqrt(discriminant)) / (2 * a) # The smaller root is when we first touch
+
+        return t if 0 <= t <= 1 else None
+    
+    def sweep_plane(self, plane:Abstract, start:Matrix, step:Matrix):
+        # Do everything in the plane's space, where it's flat along x and z and the same checks
+        # as intersect_plane() apply
+        inverse = plane.get_distortion_inverse()
+
+        localStart = inverse.apply(start.subtract(plane.objectiveLocation))
+        localStep = inverse.apply(step)
+
+        startHeight = localStart.y
+        endHeight = startHeight + localStep.y
+
+        if abs(startHeight) < self.radius or abs(endHeight) < self.radius:
+            return None # We started or finished overlapping, so the normal checks can deal with it
+        
+        if (startHeight > 0) == (endHeight > 0):
+            return None # We never crossed it
+        
+        side = 1 if startHeight > 0 else -1
+
+        t = (side * self.radius * (1 - SWEEPOVERLAP) - startHeight) / localStep.y
+
+        # Then check that where we crossed is actually inside the rectangle
+        if (abs(localStart.x + t * localStep.x) < plane.width / 2 and 
+                abs(localStart.z + t * localStep.z) < plane.length / 2):
+            return t
+        
+        return None
+    
+    def sweep_mesh(self, mesh:Abstract, start:Matrix, step:Matrix):
+        # Instead of sweeping the whole sphere, we just trace the line our center took through
+        # the mesh's triangles. If it crossed one, we must have gone through the surface, so we
+        # get wound back to roughly a radius before that.
+        inverse = mesh.get_distortion_inverse()
+        location = mesh.objectiveLocation
+
+        localStart = apply_mat3(inverse, [start.x - location.x, start.y - location.y, start.z - location.z])
+        localStep = apply_mat3(inverse, [step.x, step.y, step.z])
+
+        hit = mesh.tree.raycast(localStart, localStep, 1) # Distances here are in lengths of step, so 1 is the whole step
+
+        if hit is None:
+            return None
+        
+        return max(hit[0] - self.radius * (1 - SWEEPOVERLAP) / step.get_magnitude(), 0)
+    
+    def sweep(self, colliders:list):
+        # Winds our body back to the first thing it hit along its last step (if it hit anything)
+        step = self.get_sweep()
+
+        if not step or self.body.passthrough:
+            return
+        
+        start = self.objectiveLocation.subtract(step)
+        earliest = 1
+
+        for collider in colliders:
+            if collider.body.passthrough: # TripVolumes don't stop anything
+                continue
+
+            t = self.sweepMethods[type(collider)](collider, start, step)
+
+            if t is not None and t < earliest:
+                earliest = t
+
+        if earliest < 1:
+            self.body.translate_objective(step.multiply_scalar(earliest - 1))
+
+            # Our velocity hasn't changed, so intersect() will bounce us off like normal
+    
 
     
 class PlaneCollider(Abstract):
@@ -131,27 +297,30 @@ class PlaneCollider(Abstract):
 
         self.intersectionMethods = {
             SphereCollider : self.intersect_sphere, 
-            PlaneCollider : self.intersect_plane
+            PlaneCollider : self.intersect_plane,
+            MeshCollider : self.intersect_mesh
         }
 
         self.collisionNormalMethods = {
             SphereCollider : self.get_collision_normal_sphere, 
-            PlaneCollider : self.get_collision_normal_plane
+            PlaneCollider : self.get_collision_normal_plane,
+            MeshCollider : self.get_collision_normal_mesh
         }
 
 
 
     def intersect_sphere(self, sphere:Abstract, collide:bool=False):
-        relativeToPlane = self.objectiveDistortion.get_3x3_inverse().apply(sphere.objectiveLocation.subtract(self.objectiveLocation)).get_contents()
+        relativeToPlane = sphere.objectiveLocation.subtract(self.objectiveLocation)
+        relativeToPlane = self.get_distortion_inverse().apply(relativeToPlane, relativeToPlane).get_contents()
 
         if (abs(relativeToPlane[0][0]) < self.width / 2 and 
                 abs(relativeToPlane[1][0]) < sphere.radius and 
                 abs(relativeToPlane[2][0]) < self.length / 2):
             
             if collide and sphere.body.dynamic:
-                difference = Matrix([[0], 
-                                     [sphere.radius - relativeToPlane[1][0]],
-                                     [0]]) 
+                difference = Vec3(0, 
+                                  sphere.radius - relativeToPlane[1][0],
+                                  0) 
                 objectiveDifference = self.body.objectiveDistortion.apply(difference)
                 
                 sphere.body.translate_objective(objectiveDifference) # Now the sphere is no longer intersecting the plane
@@ -163,11 +332,14 @@ class PlaneCollider(Abstract):
     def intersect_plane(self, plane:Abstract, collide:bool=False):
         return False
     
+    def intersect_mesh(self, mesh:Abstract, collide:bool=False):
+        return False
+    
     def intersect(self, collider:Abstract, collide:bool=False):
         #print(f"Collider: {collider}")
         if self.intersectionMethods[type(collider)](collider, collide):
 
-            if collider.body not in self.body.intersections:
+            if CONTACTS.add(self, collider): # Only the first time this step
                 self.body.intersections.append(collider.body)
                 collider.body.intersections.append(self.body)
 
@@ -179,17 +351,191 @@ class PlaneCollider(Abstract):
 
 
     def get_collision_normal_sphere(self, sphere):
-        direction = self.objectiveDistortion.apply(Matrix([[0],
-                                                            [1],
-                                                            [0]]))
+        direction = self.objectiveDistortion.apply(Vec3(0,
+                                                        1,
+                                                        0))
         
         return direction.set_magnitude(-1)
         
     def get_collision_normal_plane(self, plane):
         return ORIGIN
     
+    def get_collision_normal_mesh(self, mesh):
+        return ORIGIN
+    
     def get_collision_normal(self, collider):
         return self.collisionNormalMethods[type(collider)](collider)
+    
+    def get_bounds(self, padding:float=0, thickness:float=0):
+        # Planes are flat, but spheres count as touching them from up to a radius away (in the
+        # plane's own space), so thickness should be the biggest radius we could be tested against
+        location = self.objectiveLocation
+        distortion = self.objectiveDistortion
+
+        halfWidth = self.width / 2
+        halfLength = self.length / 2
+
+        # Each collumb of the distortion is where one of our axes ends up, so adding up how far
+        # each one reaches along x, y and z gives us the box our stretched out rectangle fits in
+        reachX = abs(distortion.m00) * halfWidth + abs(distortion.m01) * thickness + abs(distortion.m02) * halfLength + padding
+        reachY = abs(distortion.m10) * halfWidth + abs(distortion.m11) * thickness + abs(distortion.m12) * halfLength + padding
+        reachZ = abs(distortion.m20) * halfWidth + abs(distortion.m21) * thickness + abs(distortion.m22) * halfLength + padding
+
+        return ([location.x - reachX, location.y - reachY, location.z - reachZ],
+                [location.x + reachX, location.y + reachY, location.z + reachZ])
+
+
+
+class MeshCollider(Abstract):
+    # This takes its shape from the packed triangles of a Mesh (so a Wavefront works too), which
+    # means you can collide with the actual teapot instead of a load of spheres roughly where it is.
+
+    # The triangles get put into a TriangleTree (see bvh.py) once, in our own space, so finding
+    # the few triangles near a sphere only means looking down a couple of branches of it, 
+    # however many triangles there are. Only spheres can hit it for now.
+
+    # By default it copies the mesh's transform relative to the mesh's parent, so if the mesh is
+    # a child of the same body, they'll line up.
+    def __init__(self, mesh:Abstract, body:Abstract=None, location:Matrix=None, distortion:Matrix=None, tags:list[str]=None):
+        super().__init__(location if location else mesh.get_location_relative(), 
+                         distortion if distortion else mesh.get_distortion_relative(), 
+                         tags)
+
+        if not mesh.get_tri_count():
+            print(f"{mesh} hasn't got any packed triangles to collide with. Have you called pack() on it?")
+
+        self.tree = TriangleTree(mesh.vertexBuffer[mesh.indexBuffer])
+
+        if body:
+            self.body = body
+            body.set_collider(self)
+        else:
+            self.body = None
+
+        self.intersectionMethods = {
+            SphereCollider : self.intersect_sphere, 
+            PlaneCollider : self.intersect_plane,
+            MeshCollider : self.intersect_mesh
+        }
+
+        self.collisionNormalMethods = {
+            SphereCollider : self.get_collision_normal_sphere, 
+            PlaneCollider : self.get_collision_normal_plane,
+            MeshCollider : self.get_collision_normal_mesh
+        }
+
+
+
+    def get_closest_point(self, point:list, radius:float):
+        # Finds the closest point on any of our triangles to point, as long as it's within radius.
+        # Gives back (that point, how far away it is, the triangle's corners), or None.
+        return self.tree.get_closest_point(point, radius, self.objectiveLocation, self.objectiveDistortion, self.get_distortion_inverse())
+    
+    def get_push_direction(self, point:list, contact:tuple):
+        # Which way something at point should be pushed to get it off the triangle it's touching
+        closest, distance, corners = contact
+
+        if distance > 1e-9:
+            direction = subtract(point, closest)
+        else: # It's right on the surface, so the triangle's normal is the best we've got
+            a, b, c = corners
+            direction = cross(subtract(b, a), subtract(c, a))
+
+        return Vec3(*direction).set_magnitude(1)
+
+    def intersect_sphere(self, sphere:Abstract, collide:bool=False):
+        location = sphere.objectiveLocation
+        center = [location.x, location.y, location.z]
+
+        contact = self.get_closest_point(center, sphere.radius)
+
+        if contact is None:
+            return False
+        
+        if collide:
+            amountToShove = sphere.radius - contact[1]
+            shove = self.get_push_direction(center, contact).iscale(amountToShove)
+
+            if sphere.body.dynamic:
+                if self.body.dynamic:
+                    sphere.body.translate_objective(shove.multiply_scalar(0.5))
+                    self.body.translate_objective(shove.multiply_scalar(-0.5))
+
+                else:
+                    sphere.body.translate_objective(shove)
+
+            elif self.body.dynamic:
+                self.body.translate_objective(shove.iscale(-1))
+
+        return True
+    
+    def intersect_plane(self, plane:Abstract, collide:bool=False):
+        return False
+    
+    def intersect_mesh(self, mesh:Abstract, collide:bool=False):
+        return False
+    
+    def intersect(self, collider:Abstract, collide:bool=False):
+        if self.intersectionMethods[type(collider)](collider, collide):
+
+            if CONTACTS.add(self, collider): # Only the first time this step
+                self.body.intersections.append(collider.body)
+                collider.body.intersections.append(self.body)
+
+            return True
+        
+        else:
+            return False
+    
+
+
+    def get_collision_normal_sphere(self, sphere):
+        # By now the sphere's been shoved out to exactly a radius away, so we look a little
+        # further than that to find what it was touching
+        location = sphere.objectiveLocation
+        center = [location.x, location.y, location.z]
+
+        contact = self.get_closest_point(center, sphere.radius + BROADPHASEMARGIN)
+
+        if contact is None:
+            return Vec3(0, 0, 0) # Not ORIGIN, since whoever gets this might scale it in place
+
+        return self.get_push_direction(center, contact).iscale(-1)
+    
+    def get_collision_normal_plane(self, plane):
+        return ORIGIN
+    
+    def get_collision_normal_mesh(self, mesh):
+        return ORIGIN
+    
+    def get_collision_normal(self, collider):
+        return self.collisionNormalMethods[type(collider)](collider)
+    
+    def get_bounds(self, padding:float=0, thickness:float=0):
+        # The root of our tree is the box round all our triangles in our own space, so we stretch
+        # that the same way PlaneCollider does with its rectangle
+        location = self.objectiveLocation
+        distortion = self.objectiveDistortion
+
+        if self.tree.nodeLows:
+            localLow = self.tree.nodeLows[0]
+            localHigh = self.tree.nodeHighs[0]
+        else:
+            localLow = localHigh = [0, 0, 0]
+
+        middle = apply_mat3(distortion, [(localLow[axis] + localHigh[axis]) / 2 for axis in range(3)])
+        halfX, halfY, halfZ = [(localHigh[axis] - localLow[axis]) / 2 for axis in range(3)]
+
+        reachX = abs(distortion.m00) * halfX + abs(distortion.m01) * halfY + abs(distortion.m02) * halfZ + padding
+        reachY = abs(distortion.m10) * halfX + abs(distortion.m11) * halfY + abs(distortion.m12) * halfZ + padding
+        reachZ = abs(distortion.m20) * halfX + abs(distortion.m21) * halfY + abs(distortion.m22) * halfZ + padding
+
+        middleX = location.x + middle[0]
+        middleY = location.y + middle[1]
+        middleZ = location.z + middle[2]
+
+        return ([middleX - reachX, middleY - reachY, middleZ - reachZ],
+                [middleX + reachX, middleY + reachY, middleZ + reachZ])
 
 
 
@@ -214,8 +560,8 @@ class Body(Abstract):
         self.dynamic = dynamic if dynamic is not None else True
         self.passthrough = False
 
-        self.oldObjectiveLocation = self.objectiveLocation # We store this so we can figure out how fast something's
-                                                                # moved even when it's been translated through code
+        self.oldObjectiveLocation = self.objectiveLocation.copy() # We store this so we can figure out how fast something's
+                                                                  # moved even when it's been translated through code
 
         if collider:
             self.collider = collider
@@ -231,24 +577,85 @@ class Body(Abstract):
 
         self.intersections = []
 
+        self.sleeping = False
+        self.sleepTime = SLEEPTIME # Set this to None if we should never fall asleep
+        self.stillTime = 0 # How long we've been still for
+        self.averageVelocity = Vec3(0, 0, 0) # How fast we've actually been moving lately, see update_sleeping()
+        self.island = None # Everything we fell asleep touching (including us), which all wakes up together
+        self.sleepingBounds = None # Our broadphase box, which doesn't change while we're asleep
+
+        self.lastStep = None # How far we moved the last time our forces were applied
+
     def set_collider(self, collider:Abstract):
         self.collider = collider
         self.add_child_relative(collider)
 
     def add_force(self, force:Matrix):
+        if self.sleeping: # Something's pushing us, so it's time to get up
+            self.wake()
+
         self.forces.append(force)
 
+    def fall_asleep(self, island:list):
+        self.sleeping = True
+        self.island = island
+
+        self.velocity = Vec3(0, 0, 0)
+        self.averageVelocity = Vec3(0, 0, 0)
+        self.lastStep = None
+        self.clear_forces()
+
+    def wake(self):
+        # Wakes us up, along with everything we fell asleep touching. If you move or change the
+        # velocity of a sleeping body yourself, call this too or it'll just stay where it is.
+        if not self.sleeping:
+            return
+        
+        for body in self.island:
+            body.sleeping = False
+            body.stillTime = 0
+            body.island = None
+            body.sleepingBounds = None
+
+    def is_resting(self):
+        # Whether we can be left out of checks against sleeping bodies. Static bodies can't wake 
+        # anything up unless they're being moved about, but TripVolumes still need to know what's
+        # inside them.
+        if self.sleeping:
+            return True
+        
+        return not (self.dynamic or self.passthrough) and self.velocity.get_magnitude() < SLEEPSPEED
+
+    # These get called by process_bodies() when we start touching another body, for every step
+    # we carry on touching it, and when we stop. They don't do anything by default, but you can
+    # override them, or just set them on a body like this:
+
+    # body.contact_entered = lambda otherBody: print(f"Ouch, {otherBody.tags}")
+
+    def contact_entered(self, otherBody:Abstract):
+        pass
+
+    def contact_stayed(self, otherBody:Abstract):
+        pass
+
+    def contact_exited(self, otherBody:Abstract):
+        pass
+
     def clear_forces(self):
         self.forces.clear()
 
     def apply_forces(self, frameDelta:float):
+        if self.sleeping: # Anything that pushed us would have woken us up, so all that's left is gravity
+            self.clear_forces()
+            return
+        
         if self.dynamic:
             #print(f"Applying forces to {self.tags}")
             #print(f"{self.tags}'s velocity is {self.velocity}")
-            resultantForce = ORIGIN
+            resultantForce = Vec3(0, 0, 0) # Not ORIGIN, since we're adding to it in place
 
             for force in self.forces:
-                resultantForce = resultantForce.add(force)
+                resultantForce.iadd(force)
 
             # Process acceleration using F = ma
 
@@ -256,17 +663,18 @@ class Body(Abstract):
             #     m
 
             if frameDelta > 0:
-                acceleration = resultantForce.multiply_scalar(1 / self.mass)
+                acceleration = resultantForce.iscale(1 / self.mass)
 
                 # Process velocity using v = u + at
-                self.velocity = self.velocity.add(acceleration.multiply_scalar(frameDelta))
+                self.velocity = self.velocity.add(acceleration.iscale(frameDelta))
 
-                # Translate according to velocity
-                self.translate_objective(self.velocity.multiply_scalar(frameDelta))
+                # Translate according to velocity (we're done with acceleration now, so that gets reused)
+                self.lastStep = self.velocity.multiply_scalar(frameDelta, acceleration)
+                self.translate_objective(self.lastStep)
         else:
             # If it's kinematic, we can just say it's velocity is its change in position since the last frame over the frame delta
-            self.velocity = self.objectiveLocation.subtract(self.oldObjectiveLocation).multiply_scalar(1 / frameDelta)
-            self.oldObjectiveLocation = self.objectiveLocation
+            self.velocity = self.objectiveLocation.subtract(self.oldObjectiveLocation).iscale(1 / frameDelta)
+            self.objectiveLocation.copy(self.oldObjectiveLocation)
 
         self.clear_forces()
 
@@ -285,28 +693,371 @@ class TripVolume(Body):
 
 
 
-def process_bodies(frameDelta):
-    bodies = ROOT.get_substracts_of_type(Body) + ROOT.get_substracts_of_type(TripVolume)
+class ContactCache():
+    # This remembers which pairs of colliders were touching last step, so we can tell bodies
+    # when they start and stop touching things instead of them having to work it out themselves.
+    # Pairs are stored as tuples in sets, so checking if we've seen one is quick no matter how many 
+    # contacts there are.
+    def __init__(self):
+        self.previousContacts = set()
+        self.contacts = set()
+
+    def get_key(self, collider:Abstract, otherCollider:Abstract):
+        # A touching B is the same contact as B touching A
+        if id(collider) < id(otherCollider):
+            return (collider, otherCollider)
+        
+        return (otherCollider, collider)
+    
+    def add(self, collider:Abstract, otherCollider:Abstract):
+        # Gives back True if this is the first time the pair's been added this step
+        key = self.get_key(collider, otherCollider)
+
+        if key in self.contacts:
+            return False
+        
+        self.contacts.add(key)
+        return True
+    
+    def is_touching(self, collider:Abstract, otherCollider:Abstract):
+        return self.get_key(collider, otherCollider) in self.contacts
+    
+    def begin_step(self, bodies:list):
+        self.previousContacts = self.contacts
+        self.contacts = set()
+
+        bodies = set(bodies) # Anything not in here has been taken out of the scene
+
+        # Pairs involving sleeping bodies that don't get checked are still touching, so they carry over.
+        # If one of them's gone, the pair gets dropped, and end_step() tells the other one it's stopped touching.
+        for collider, otherCollider in self.previousContacts:
+            body = collider.body
+            otherBody = otherCollider.body
+
+            if body not in bodies or otherBody not in bodies:
+                continue
+
+            if (body.sleeping and otherBody.is_resting()) or (otherBody.sleeping and body.is_resting()):
+                self.contacts.add((collider, otherCollider))
+
+                body.intersections.append(otherBody)
+                otherBody.intersections.append(body)
+
+    def end_step(self):
+        for collider, otherCollider in self.contacts:
+            if (collider, otherCollider) in self.previousContacts:
+                collider.body.contact_stayed(otherCollider.body)
+                otherCollider.body.contact_stayed(collider.body)
+            else:
+                collider.body.contact_entered(otherCollider.body)
+                otherCollider.body.contact_entered(collider.body)
+
+        for collider, otherCollider in self.previousContacts - self.contacts:
+            collider.body.contact_exited(otherCollider.body)
+            otherCollider.body.contact_exited(collider.body)
+
+CONTACTS = ContactCache()
+
+
+
+class PhysicsStats():
+    # process_bodies() adds up how much work it's done in here, so you can see where the time's
+    # going without having to reach for a profiler. It keeps adding up until you reset() it.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.pairTests = 0 # How many pairs actually got checked with intersect()
+
+        self.phaseTimes = {"broadphase" : 0, # Seconds spent in each part of process_bodies()
+                           "collisions" : 0,
+                           "integration" : 0,
+                           "sweeping" : 0,
+                           "contacts" : 0,
+                           "sleeping" : 0}
+        
+    def add_time(self, phase:str, startTime:float):
+        # Adds on the time since startTime, and gives back the time now so the next phase can start from it
+        now = time.perf_counter()
+        self.phaseTimes[phase] += now - startTime
+
+        return now
+
+STATS = PhysicsStats()
+
 
-    bodiesToCheck = []
+
+class PhysicsWorld():
+    # This keeps the mass, velocity, force and location of every dynamic body in numpy arrays
+    # (one row per body), so moving them all along is a handful of array operations instead of
+    # a load of Matrix maths per body. Pass one into process_bodies() to use it.
+
+    # Velocities and forces get poked at from all over the place (collisions, game code etc.),
+    # so the bodies themselves are still where their state lives. The arrays get filled from 
+    # them at the start of each step, and the results get written back once at the end.
+    def __init__(self):
+        self.bodies = []
+
+        self.masses = numpy.zeros(0)
+        self.velocities = numpy.zeros((0, 3))
+        self.forces = numpy.zeros((0, 3))
+        self.locations = numpy.zeros((0, 3))
+        self.gravities = numpy.zeros((0, 3))
+
+    def resize(self, count:int):
+        # The arrays only get made again when the number of bodies changes
+        if len(self.masses) == count:
+            return
+        
+        self.masses = numpy.zeros(count)
+        self.velocities = numpy.zeros((count, 3))
+        self.forces = numpy.zeros((count, 3))
+        self.locations = numpy.zeros((count, 3))
+        self.gravities = numpy.zeros((count, 3))
+
+    def gather(self, bodies:list):
+        self.bodies = [body for body in bodies if body.dynamic and not body.sleeping]
+        self.resize(len(self.bodies))
+
+        masses = []
+        velocities = []
+        forces = []
+        locations = []
+        gravities = []
+
+        for body in self.bodies:
+            velocity = to_compact(body.velocity) # Game code likes to set these to plain Matrices
+            location = body.objectiveLocation
+
+            forceX = forceY = forceZ = 0
+
+            for force in body.forces:
+                force = to_compact(force)
+
+                forceX += force.x
+                forceY += force.y
+                forceZ += force.z
+
+            masses.append(body.mass)
+            velocities += (velocity.x, velocity.y, velocity.z)
+            forces += (forceX, forceY, forceZ)
+            locations += (location.x, location.y, location.z)
+
+            if body.collider: # Bodies without colliders don't get gravity, same as in process_bodies()
+                gravity = to_compact(body.gravityDirection)
+                gravities += (gravity.x, gravity.y, gravity.z)
+            else:
+                gravities += (0, 0, 0)
+
+        self.masses[:] = masses
+        self.velocities.flat[:] = velocities
+        self.forces.flat[:] = forces
+        self.locations.flat[:] = locations
+        self.gravities.flat[:] = gravities
+
+        # Gravity directions don't have to be normalised, so we do that here for all of them at once
+        lengths = numpy.sqrt((self.gravities ** 2).sum(axis=1))
+        lengths[lengths == 0] = 1
+
+        self.gravities *= (GRAVFIELDSTRENGTH / lengths)[:, numpy.newaxis]
+
+    def integrate(self, frameDelta:float):
+        # This is the same as Body.apply_forces(), just for every body at once. Gravity's added 
+        # as an acceleration rather than a force, since that saves multiplying and dividing by mass.
+        accelerations = self.forces / self.masses[:, numpy.newaxis] + self.gravities
+
+        self.velocities += accelerations * frameDelta
+
+        steps = self.velocities * frameDelta
+        self.locations += steps
+
+        return steps
+
+    def write_back(self, steps:numpy.ndarray):
+        # tolist() is much quicker than reading numpy rows one number at a time
+        for body, velocity, step in zip(self.bodies, self.velocities.tolist(), steps.tolist()):
+            body.velocity = Vec3(*velocity) # A new one, since other bodies might be sharing the old one (like ORIGIN)
+
+            body.lastStep = Vec3(*step) # Bodies keep this for continuous collision detection
+            body.translate_objective(body.lastStep) # This takes the body's children along with it
+
+            body.clear_forces()
+
+    def step(self, bodies:list, frameDelta:float):
+        self.gather(bodies)
+
+        if self.bodies:
+            self.write_back(self.integrate(frameDelta))
+
+
+
+def find_candidate_pairs(bodies:list):
+    # This is the broadphase. Checking every body against every other body gets slow really 
+    # quickly (100 balls is nearly 5000 checks), so first we find out which ones are even close
+    # enough to be touching, and only do the proper checks on those.
+
+    # It uses sweep and prune: every collider gets a box, the boxes get sorted by where they 
+    # start along one axis, and then we sweep along that axis keeping a list of the boxes we're
+    # currently inside. Only boxes that overlap on that axis can possibly be touching, so we 
+    # only need to compare against that list.
+
+    # This gives back a list of indices for each body, sorted, of the bodies it might be touching.
+    thickness = 0
 
     for body in bodies:
-        body.intersections = []
+        if isinstance(body.collider, SphereCollider):
+            thickness = max(thickness, body.collider.radius)
+
+    bounds = {}
+
+    for i, body in enumerate(bodies):
+        if body.sleeping:
+            if body.sleepingBounds is None:
+                body.sleepingBounds = body.collider.get_bounds(BROADPHASEMARGIN, thickness)
+
+            bounds[i] = body.sleepingBounds
+
+        elif body.collider:
+            bounds[i] = body.collider.get_bounds(BROADPHASEMARGIN, thickness)
+
+    # Sweep along whichever axis things are most spread out on, since fewer boxes overlap there
+    spreads = []
+
+    for axis in range(3):
+        centers = [low[axis] + high[axis] for low, high in bounds.values()]
+        spreads.append(max(centers) - min(centers) if centers else 0)
+
+    axis = spreads.index(max(spreads))
+    axis2, axis3 = [otherAxis for otherAxis in range(3) if otherAxis != axis]
+
+    candidates = [set() for i in range(len(bodies))]
+
+    # Sleeping bodies can't wake each other up, so they get their own list and never get compared
+    activeAwake = []
+    activeSleeping = []
+
+    for i in sorted(bounds, key=lambda i: bounds[i][0][axis]):
+        low, high = bounds[i]
+
+        # Anything that ends before we start can't touch us or anything after us
+        activeAwake = [j for j in activeAwake if bounds[j][1][axis] >= low[axis]]
+        activeSleeping = [j for j in activeSleeping if bounds[j][1][axis] >= low[axis]]
 
-        bodiesToCheck.append(body) # I had to do this otherwise they'd just be the same list
+        sleeping = bodies[i].sleeping
+
+        for j in activeAwake if sleeping else activeAwake + activeSleeping:
+            otherLow, otherHigh = bounds[j]
+
+            # We already know they overlap on the sweep axis, so just check the other two
+            if (low[axis2] <= otherHigh[axis2] and otherLow[axis2] <= high[axis2] and
+                    low[axis3] <= otherHigh[axis3] and otherLow[axis3] <= high[axis3]):
+                candidates[i].add(j)
+                candidates[j].add(i)
+
+        if sleeping:
+            activeSleeping.append(i)
+        else:
+            activeAwake.append(i)
+
+    return [sorted(found) for found in candidates]
+
+
+
+def find_island(islands:dict, body:Body):
+    # Follows the chain of bodies in islands until it gets to the one in charge of the island,
+    # and shortens the chain as it goes so it's quicker next time
+    while islands[body] is not body:
+        islands[body] = islands[islands[body]]
+        body = islands[body]
+
+    return body
+
+def update_sleeping(bodies:list, frameDelta:float, candidates:list):
+    # Works out which dynamic bodies have been still for long enough to fall asleep.
+
+    # Bodies that are touching (or nearly touching) each other are grouped into islands, and a 
+    # whole island only falls asleep once everything in it is still. Otherwise a ball resting on 
+    # a sleeping ball would keep waking it up.
+    awakeBodies = [body for body in bodies if body.dynamic and body.collider and not body.sleeping]
+
+    smoothing = min(1, frameDelta / SLEEPSMOOTHING)
+
+    for body in awakeBodies:
+        # We go by how far it's actually moved rather than its velocity, since something resting
+        # on the floor still gets a bit of velocity from gravity every step, it just gets shoved back
+        step = body.objectiveLocation.subtract(body.oldObjectiveLocation)
+        body.objectiveLocation.copy(body.oldObjectiveLocation) # Dynamic bodies don't use this otherwise
+
+        # That gets averaged out over the last second or so, since a ball in a stack can get 
+        # shoved up and down a little every step forever, even though it's not going anywhere
+        body.averageVelocity.iscale(1 - smoothing).iadd(step.iscale(smoothing / frameDelta))
+
+        if body.averageVelocity.get_magnitude() < SLEEPSPEED:
+            body.stillTime += frameDelta
+        else:
+            body.stillTime = 0
+
+    islands = {body : body for body in awakeBodies}
+
+    # Things in a pile keep jiggling in and out of touching each other, so anything close enough
+    # to be a broadphase candidate counts too. Otherwise the pile keeps splitting into little
+    # islands that fall asleep and then get woken straight back up by their neighbours.
+    for i, body in enumerate(bodies):
+        if body not in islands or body.passthrough:
+            continue
+
+        for otherBody in body.intersections + [bodies[j] for j in candidates[i]]:
+            if otherBody in islands and not otherBody.passthrough:
+                islands[find_island(islands, body)] = find_island(islands, otherBody)
+
+    groups = {}
+
+    for body in awakeBodies:
+        groups.setdefault(find_island(islands, body), []).append(body)
+
+    for island in groups.values():
+        if all(body.sleepTime is not None and body.stillTime >= body.sleepTime for body in island):
+            for body in island:
+                body.fall_asleep(island)
+
+
+
+def process_bodies(frameDelta, world:PhysicsWorld=None):
+    bodies = ROOT.get_substracts_of_type(Body, True) # TripVolumes are Bodies too
+
+    for body in bodies:
+        body.intersections = []
 
     if frameDelta > 0:
-        for i in range(len(bodies)):
-            body = bodiesToCheck.pop(0)
+        phaseStart = time.perf_counter()
+        pairTests = 0
+
+        CONTACTS.begin_step(bodies)
+
+        candidates = find_candidate_pairs(bodies)
+
+        phaseStart = STATS.add_time("broadphase", phaseStart)
+
+        for i, body in enumerate(bodies):
                 
             if body.collider:
 
                 if body.dynamic:
-                    body.add_force(body.gravityDirection.set_magnitude(GRAVFIELDSTRENGTH * body.mass))
+                    if not (world or body.sleeping): # The world does gravity itself
+                        body.add_force(body.gravityDirection.set_magnitude(GRAVFIELDSTRENGTH * body.mass))
+
+                    for j in candidates[i]:
+                        if j <= i: # Dynamic bodies only check the bodies after them, otherwise pairs would get done twice
+                            continue
 
-                    for otherBody in bodiesToCheck:
+                        otherBody = bodies[j]
+
+                        if body.sleeping and otherBody.is_resting(): # Neither of these can wake the other up
+                            continue
 
                         collisionStatus = not (body.passthrough or otherBody.passthrough)
+                        pairTests += 1
 
                         if body.collider.intersect(otherBody.collider, collisionStatus) and collisionStatus:
 
@@ -375,14 +1126,14 @@ def process_bodies(frameDelta):
 
                                 bodyImpulse = collisionNormal.multiply_scalar((m1 * v1) - (m1 * u1))
 
-                                body.add_force(bodyImpulse.multiply_scalar(1 / frameDelta))
+                                body.add_force(bodyImpulse.iscale(1 / frameDelta))
 
                                 # Calculate impulse on the other body
                                 otherMomentum = (m1 * u1) + (m2 * u2) - (m1 * v1)
 
                                 otherImpulse = collisionNormal.multiply_scalar(otherMomentum - (m2 * u2))
 
-                                otherBody.add_force(otherImpulse.multiply_scalar(1 / frameDelta))
+                                otherBody.add_force(otherImpulse.iscale(1 / frameDelta))
 
                             else:
                                 # Here, we already know the other body's velocity, which simplifiys our calculations a bit.
@@ -404,7 +1155,7 @@ def process_bodies(frameDelta):
 
                                 bodyImpulse = collisionNormal.multiply_scalar(bodyMomentum - (m1 * u1))
 
-                                body.add_force(bodyImpulse.multiply_scalar(1 / frameDelta))
+                                body.add_force(bodyImpulse.iscale(1 / frameDelta))
 
                             # Now we've sorted out exchange of momentum, we need to apply friction.
 
@@ -418,20 +1169,25 @@ def process_bodies(frameDelta):
                             limitingFriction = (body.roughness + otherBody.roughness) / 2
                             
                             # This is the direction opposing the body's movement parallel to the collision surface
-                            bodyOpposingForce = body.velocity.subtract(collisionNormal.multiply_scalar(u1)).multiply_scalar(-limitingFriction * m1)
+                            bodyOpposingForce = body.velocity.subtract(collisionNormal.multiply_scalar(u1)).iscale(-limitingFriction * m1)
 
                             body.add_force(bodyOpposingForce)
                             
-                            otherBodyOpposingForce = otherBody.velocity.subtract(collisionNormal.multiply_scalar(u2)).multiply_scalar(-limitingFriction * m2)
+                            otherBodyOpposingForce = otherBody.velocity.subtract(collisionNormal.multiply_scalar(u2)).iscale(-limitingFriction * m2)
 
                             otherBody.add_force(otherBodyOpposingForce)
 
 
                             
                 else:
-                    for otherBody in bodies:
+                    for j in candidates[i]:
+                        otherBody = bodies[j]
+
+                        if otherBody.sleeping and body.is_resting():
+                            continue
 
                         collisionStatus = not(body.passthrough or otherBody.passthrough)
+                        pairTests += 1
 
                         if body.collider.intersect(otherBody.collider, collisionStatus) and collisionStatus:
 
@@ -465,7 +1221,7 @@ def process_bodies(frameDelta):
 
                                 otherImpulse = collisionNormal.multiply_scalar(otherMomentum - (m2 * u2))
 
-                                otherBody.add_force(otherImpulse.multiply_scalar(1 / frameDelta))
+                                otherBody.add_force(otherImpulse.iscale(1 / frameDelta))
 
                         
                             # Now we've sorted out exchange of momentum, we need to apply friction.
@@ -480,17 +1236,127 @@ def process_bodies(frameDelta):
                             friction = (body.roughness + otherBody.roughness) / 2
                             
                             # This is the direction opposing the body's movement parallel to the collision surface
-                            bodyOpposingForce = body.velocity.subtract(collisionNormal.multiply_scalar(u1)).multiply_scalar(-friction * m1)
+                            bodyOpposingForce = body.velocity.subtract(collisionNormal.multiply_scalar(u1)).iscale(-friction * m1)
 
                             # As you can see, this isn't an accurate simulation of friction. But it's close enough!
                             body.add_force(bodyOpposingForce)
                             
-                            otherBodyOpposingForce = otherBody.velocity.subtract(collisionNormal.multiply_scalar(u2)).multiply_scalar(-friction * m2)
+                            otherBodyOpposingForce = otherBody.velocity.subtract(collisionNormal.multiply_scalar(u2)).iscale(-friction * m2)
 
                             otherBody.add_force(otherBodyOpposingForce)
                 
             else:
                 print(f"{body.tags} doesn't have a collider!")
                     
-        for body in bodies:
-            body.apply_forces(frameDelta)
\ No newline at end of file
+        phaseStart = STATS.add_time("collisions", phaseStart)
+
+        if world:
+            world.step(bodies, frameDelta)
+
+            for body in bodies:
+                if not body.dynamic:
+                    body.apply_forces(frameDelta)
+        else:
+            for body in bodies:
+                body.apply_forces(frameDelta)
+
+        phaseStart = STATS.add_time("integration", phaseStart)
+
+        # Anything that moved fast enough to go straight through something gets wound back to
+        # where it first hit it. This happens straight away so it never gets drawn on the wrong
+        # side, and then the normal checks bounce it off next step.
+        sweepingBodies = [i for i, body in enumerate(bodies) 
+                          if isinstance(body.collider, SphereCollider) and body.collider.get_sweep()]
+
+        if sweepingBodies:
+            candidates = find_candidate_pairs(bodies) # Everything's moved since the last time
+
+            for i in sweepingBodies:
+                bodies[i].collider.sweep([bodies[j].collider for j in candidates[i]])
+
+        phaseStart = STATS.add_time("sweeping", phaseStart)
+
+        CONTACTS.end_step()
+
+        phaseStart = STATS.add_time("contacts", phaseStart)
+
+        update_sleeping(bodies, frameDelta, candidates)
+
+        STATS.add_time("sleeping", phaseStart)
+
+        STATS.steps += 1
+        STATS.pairTests += pairTests
+
+
+
+class PhysicsScheduler():
+    # Running physics once (or twice) per frame means how far things move each step, and how 
+    # much the physics costs, depends on your framerate. This runs process_bodies() at a fixed
+    # rate instead, by saving up frame time and spending it a tick at a time.
+
+    # If physics falls so far behind that it'd need more than maxSteps ticks to catch up, the
+    # rest of the time just gets thrown away. Otherwise a slow frame means more ticks, which
+    # makes the next frame slower, which means even more ticks... (the spiral of death)
+    def __init__(self, tickRate:float=None, maxSteps:int=None, world:PhysicsWorld=None):
+        self.tickDelta = 1 / tickRate if tickRate else 1 / 120
+        self.maxSteps = maxSteps if maxSteps else 8
+        self.world = world
+
+        self.accumulator = 0 # How much time we've saved up that hasn't been simulated yet
+        self.interpolation = 0 # How far we are between the last two ticks, from 0 to 1
+        self.droppedTime = 0 # How much time we've had to throw away in total
+
+        self.previousLocations = {} # Where each dynamic body was before the last tick
+        self.blendedLocations = {}
+
+    def update(self, frameDelta:float):
+        # Call this once a frame. It gives back how many ticks it ran
+        self.accumulator += frameDelta
+
+        ticks = 0
+
+        while self.accumulator >= self.tickDelta and ticks < self.maxSteps:
+            self.previousLocations = {body : body.objectiveLocation.copy() 
+                                      for body in ROOT.get_substracts_of_type(Body, True) if body.dynamic}
+
+            process_bodies(self.tickDelta, self.world)
+
+            self.accumulator -= self.tickDelta
+            ticks += 1
+
+        if self.accumulator >= self.tickDelta:
+            self.droppedTime += self.accumulator - self.accumulator % self.tickDelta
+            self.accumulator %= self.tickDelta
+
+        self.interpolation = self.accumulator / self.tickDelta
+
+        return ticks
+    
+    def get_interpolated_location(self, body:Body):
+        # Where the body would be right now if physics ran continuously. It's always a bit behind 
+        # the real simulation, but it moves smoothly even when the framerate and tick rate don't line up
+        previous = self.previousLocations.get(body)
+
+        if previous is None:
+            return body.objectiveLocation.copy()
+        
+        return previous.add(body.objectiveLocation.subtract(previous).iscale(self.interpolation))
+    
+    def blend_bodies(self):
+        # Moves every dynamic body to its interpolated location, so call this just before rendering,
+        # and then unblend_bodies() straight after so physics carries on from the real locations
+        bodies = [body for body in ROOT.get_substracts_of_type(Body, True) # Some of the bodies in previousLocations 
+                  if body in self.previousLocations]                        # might have been killed since
+
+        # Bodies can be inside other bodies, so everything has to be saved before anything moves
+        self.blendedLocations = {body : body.objectiveLocation.copy() for body in bodies}
+        interpolatedLocations = [self.get_interpolated_location(body) for body in bodies]
+
+        for body, location in zip(bodies, interpolatedLocations):
+            body.set_location_objective(location)
+
+    def unblend_bodies(self):
+        for body, location in self.blendedLocations.items():
+            body.set_location_objective(location)
+
+        self.blendedLocations = {}
\ No newline at end of file
@@ -0,0 +1,319 @@
+import atexit
+import multiprocessing
+import queue
+import signal
+import time
+import numpy
+
+from engine.matrix import *
+from engine.abstract import *
+from engine.physics import *
+from engine.tiles import * # For the same shared memory helpers the tile workers use
+
+# This runs physics in its own process, at its own tick rate, so a slow frame doesn't slow
+# physics down and a slow physics tick doesn't slow the frame down. They get a core each.
+
+# The worker has its own copy of the scene, and only it moves the dynamic bodies. Every tick it
+# writes where they are and how fast they're going into a snapshot in shared memory, and once a
+# frame sync() copies the latest snapshot onto the bodies in our scene.
+
+# Things still work the other way round too. Static bodies that you move yourself (like the
+# player's) get sent over every frame, and if you move a dynamic body, change its velocity or
+# add a force to it, sync() notices and passes it on.
+
+# Beware! The worker gets its copy of the scene by being forked from this process, which Windows
+# can't do. There, physics just runs here on a PhysicsScheduler instead. Bodies
+# added after the worker starts won't be in its copy either, so set your scene up first.
+
+
+
+def apply_physics_commands(bodies:list, commands):
+    # Does whatever the main process has asked for since last tick, and gives back how many there were
+    handled = 0
+
+    while True:
+        try:
+            command = commands.get_nowait()
+        except queue.Empty:
+            return handled
+
+        kind, index, values = command
+        body = bodies[index]
+
+        if kind == "force":
+            body.add_force(Vec3(*values))
+
+        elif kind == "place":
+            body.set_location_objective(Vec3(*values[:3]))
+            body.velocity = Vec3(*values[3:])
+
+            if body.sleeping:
+                body.wake()
+
+        handled += 1
+
+def run_physics_worker(bodies:list, tickRate:float, useWorld:bool, arrayInfos:tuple, lock, commands, stop):
+    # Same as the tile workers, SDL will have hijacked SIGTERM in the process we were forked from
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    states, transforms, contacts, header = [attach_shared_array(*info) for info in arrayInfos]
+
+    for body in bodies:
+        for hook in ("contact_entered", "contact_stayed", "contact_exited"):
+            body.__dict__.pop(hook, None) # The main process calls these itself, so they'd only go off twice
+
+    world = PhysicsWorld() if useWorld else None
+
+    dynamicIndexes = [index for index, body in enumerate(bodies) if body.dynamic]
+    staticIndexes = [index for index, body in enumerate(bodies) if not body.dynamic]
+    indexes = {body : index for index, body in enumerate(bodies)}
+
+    localStates = numpy.zeros(states.shape)
+    localTransforms = numpy.zeros(transforms.shape)
+    lastTransforms = numpy.full(transforms.shape, numpy.nan) # nan never equals anything, so they all get set the first time
+
+    handled = 0
+
+    tickDelta = 1 / tickRate
+    nextTick = time.perf_counter()
+
+    while not stop.is_set():
+        handled += apply_physics_commands(bodies, commands)
+
+        with lock:
+            localTransforms[:] = transforms
+
+        for index in staticIndexes:
+            if not numpy.array_equal(localTransforms[index], lastTransforms[index]):
+                body = bodies[index]
+                row = localTransforms[index]
+
+                body.set_location_objective(Vec3(*row[:3]))
+                body.set_distortion_objective(Mat3(*row[3:]))
+
+                lastTransforms[index] = row
+
+        process_bodies(tickDelta, world)
+
+        for index in dynamicIndexes:
+            body = bodies[index]
+            location = body.objectiveLocation
+            velocity = to_compact(body.velocity)
+
+            localStates[index] = (location.x, location.y, location.z, velocity.x, velocity.y, velocity.z)
+
+        pairs = [(indexes[collider.body], indexes[otherCollider.body]) for collider, otherCollider in CONTACTS.contacts
+                 if collider.body in indexes and otherCollider.body in indexes]
+
+        if len(pairs) > len(contacts):
+            print(f"The physics worker found {len(pairs)} contacts but only has room for {len(contacts)}, so some will be missed")
+            pairs = pairs[:len(contacts)]
+
+        with lock:
+            states[:] = localStates
+
+            if pairs:
+                contacts[:len(pairs)] = pairs
+
+            header[0] += 1 # Ticks
+            header[1] = handled
+            header[2] = len(pairs)
+
+        # Sleep until the next tick's due. If we've fallen more than a tick behind, we don't try
+        # to catch up, we just carry on from now
+        nextTick += tickDelta
+        wait = nextTick - time.perf_counter()
+
+        if wait > 0:
+            stop.wait(wait)
+        elif wait < -tickDelta:
+            nextTick = time.perf_counter()
+
+
+
+class PhysicsWorker():
+    def __init__(self, tickRate:float=None, world:bool=False, maxContacts:int=None):
+        self.tickRate = tickRate if tickRate else 120
+
+        self.bodies = ROOT.get_substracts_of_type(Body, True)
+
+        count = len(self.bodies)
+
+        self.blocks = []
+        self.process = None
+        self.scheduler = None
+
+        if "fork" not in multiprocessing.get_all_start_methods():
+            print("This platform can't fork processes, so physics will run on the main thread instead")
+            self.scheduler = PhysicsScheduler(self.tickRate, None, PhysicsWorld() if world else None)
+            return
+
+        # What we got from the worker (or sent it) last, so we can tell when something's been changed here
+        self.knownStates = numpy.zeros((count, 6))
+        self.placedAt = [0] * count # How many commands had been sent when each body was last moved here
+
+        self.sentCommands = 0
+        self.lastTick = 0
+
+        self.touching = set() # Pairs of body indexes that were touching at the last sync
+
+        for index, body in enumerate(self.bodies):
+            self.knownStates[index] = self.get_state(body)
+
+        self.states, statesInfo = self.share_array(self.knownStates)                                # Location and velocity of each body
+        self.transforms, transformsInfo = self.share_array(numpy.zeros((count, 12)))                 # Location and distortion of each static body
+        self.contacts, contactsInfo = self.share_array(numpy.zeros((maxContacts if maxContacts else count * 8 + 8, 2), numpy.int64))
+        self.header, headerInfo = self.share_array(numpy.zeros(3, numpy.int64))                      # Ticks, commands handled, contacts
+
+        context = multiprocessing.get_context("fork")
+
+        self.lock = context.Lock()
+        self.commands = context.Queue()
+        self.stop = context.Event()
+
+        self.send_transforms()
+
+        self.process = context.Process(target=run_physics_worker,
+                                       args=(self.bodies, self.tickRate, world,
+                                             (statesInfo, transformsInfo, contactsInfo, headerInfo),
+                                             self.lock, self.commands, self.stop),
+                                       daemon=True)
+        self.process.start()
+
+        atexit.register(self.close)
+
+    def share_array(self, array:numpy.ndarray):
+        return create_shared_array(array, self.blocks)
+
+    def get_state(self, body:Body):
+        location = body.objectiveLocation
+        velocity = to_compact(body.velocity)
+
+        return (location.x, location.y, location.z, velocity.x, velocity.y, velocity.z)
+
+    def send_command(self, kind:str, index:int, values:tuple):
+        self.commands.put((kind, index, values))
+        self.sentCommands += 1
+
+    def send_transforms(self):
+        rows = []
+
+        for body in self.bodies:
+            if body.dynamic:
+                rows.append((0,) * 12)
+            else:
+                location = body.objectiveLocation
+                d = body.objectiveDistortion
+
+                rows.append((location.x, location.y, location.z,
+                             d.m00, d.m01, d.m02, d.m10, d.m11, d.m12, d.m20, d.m21, d.m22))
+
+        rows = numpy.array(rows).reshape(-1, 12)
+
+        with self.lock:
+            self.transforms[:] = rows
+
+    def send_changes(self):
+        # Passes on anything that's been done to the dynamic bodies here since the last sync
+        for index, body in enumerate(self.bodies):
+            if not body.dynamic:
+                continue
+
+            state = self.get_state(body)
+
+            if not numpy.array_equal(state, self.knownStates[index]):
+                self.send_command("place", index, state)
+                self.knownStates[index] = state
+                self.placedAt[index] = self.sentCommands
+
+            if body.forces:
+                total = Vec3(0, 0, 0)
+
+                for force in body.forces:
+                    total.iadd(to_compact(force))
+
+                self.send_command("force", index, (total.x, total.y, total.z))
+                body.forces = []
+
+    def receive_snapshot(self):
+        with self.lock:
+            ticks, handled, contactCount = self.header.tolist()
+            states = self.states.tolist() # Plain floats rather than numpy ones
+            pairs = self.contacts[:contactCount].tolist()
+
+        if ticks == self.lastTick:
+            return 0 # Nothing new
+
+        for index, body in enumerate(self.bodies):
+            if not body.dynamic or handled < self.placedAt[index]: # The worker hasn't seen our last change yet
+                continue
+
+            state = states[index]
+
+            if numpy.array_equal(state, self.knownStates[index]):
+                continue
+
+            if not numpy.array_equal(state[:3], self.knownStates[index][:3]):
+                body.set_location_objective(Vec3(*state[:3]))
+
+            body.velocity = Vec3(*state[3:])
+            self.knownStates[index] = state
+
+        self.update_contacts({tuple(pair) for pair in pairs})
+
+        ticksRun = ticks - self.lastTick
+        self.lastTick = ticks
+
+        return ticksRun
+
+    def update_contacts(self, touching:set):
+        # Fills in intersections and calls the contact hooks, the same as process_bodies() would
+        for body in self.bodies:
+            body.intersections = []
+
+        for index, otherIndex in touching:
+            body = self.bodies[index]
+            otherBody = self.bodies[otherIndex]
+
+            body.intersections.append(otherBody)
+            otherBody.intersections.append(body)
+
+            if (index, otherIndex) in self.touching:
+                body.contact_stayed(otherBody)
+                otherBody.contact_stayed(body)
+            else:
+                body.contact_entered(otherBody)
+                otherBody.contact_entered(body)
+
+        for index, otherIndex in self.touching - touching:
+            self.bodies[index].contact_exited(self.bodies[otherIndex])
+            self.bodies[otherIndex].contact_exited(self.bodies[index])
+
+        self.touching = touching
+
+    def sync(self, frameDelta:float):
+        # Call this once a frame. It gives back how many physics ticks have happened since last time
+        if self.scheduler:
+            return self.scheduler.update(frameDelta)
+        
+        if not self.process: # We've been closed
+            return 0
+
+        self.send_changes()
+        self.send_transforms()
+
+        return self.receive_snapshot()
+
+    def close(self):
+        if not self.process:
+            return
+
+        self.stop.set()
+        self.process.join(1)
+
+        if self.process.is_alive():
+            self.process.terminate()
+
+        self.process = None
+
+        free_shared_blocks(self.blocks)
@@ -0,0 +1,303 @@
+from engine.matrix import *
+from engine.abstract import *
+from engine.mesh import *
+from engine.physics import *
+from engine.bvh import *
+
+# This lets you ask questions about the scene, like "what's under the crosshair?", "can this
+# enemy see the player?" or "what's within 3 units of me?", straight away, without needing a
+# TripVolume or waiting for process_bodies() to get round to it.
+
+# A SceneQuery builds a BVH (see bvh.py) over every SphereCollider, PlaneCollider and
+# MeshCollider under an abstract, and optionally every Mesh as well. Meshes get their own BVH of
+# their triangles in their own space, which only gets built once, so they can move and spin
+# about for free. MeshColliders already have one of those, so we just borrow theirs.
+
+
+
+class QueryHit():
+    def __init__(self, abstract:Abstract, distance:float, point:Matrix, normal:Matrix, triIndex:int=None):
+        self.abstract = abstract # The collider or mesh that got hit
+        self.body = abstract.body if isinstance(abstract, (SphereCollider, PlaneCollider, MeshCollider)) else None
+
+        self.distance = distance
+        self.point = point
+        self.normal = normal # This always faces back towards where the ray came from
+
+        self.triIndex = triIndex # Which of the mesh's packed triangles got hit, if it was a mesh
+
+
+
+class SceneQuery():
+    def __init__(self, root:Abstract=None, includeMeshes:bool=False, includeTripVolumes:bool=False):
+        self.root = root if root else ROOT
+        self.includeMeshes = includeMeshes
+        self.includeTripVolumes = includeTripVolumes # These aren't solid, so they're left out unless you ask
+
+        self.items = []
+        self.tree = None
+
+        self.triangleTrees = {} # Mesh : (how many triangles it had, TriangleTree)
+
+        self.rebuild()
+
+    def gather(self):
+        items = (self.root.get_substracts_of_type(SphereCollider) + 
+                 self.root.get_substracts_of_type(PlaneCollider) + 
+                 self.root.get_substracts_of_type(MeshCollider))
+
+        if not self.includeTripVolumes:
+            items = [item for item in items if not (item.body and item.body.passthrough)]
+
+        if self.includeMeshes:
+            items += [mesh for mesh in self.root.get_substracts_of_type(Mesh, True) if mesh.get_tri_count()]
+
+        return items
+
+    def get_item_bounds(self, item:Abstract):
+        if isinstance(item, Mesh):
+            center, radius = item.get_objective_bounds()
+
+            return ([center[axis] - radius for axis in range(3)],
+                    [center[axis] + radius for axis in range(3)])
+
+        return item.get_bounds()
+
+    def get_triangle_tree(self, mesh:Mesh):
+        if isinstance(mesh, MeshCollider):
+            return mesh.tree
+
+        count, tree = self.triangleTrees.get(mesh, (None, None))
+
+        if count != mesh.get_tri_count(): # It's new, or it's been packed again since
+            tree = TriangleTree(mesh.vertexBuffer[mesh.indexBuffer])
+            self.triangleTrees[mesh] = (mesh.get_tri_count(), tree)
+
+        return tree
+
+    def rebuild(self):
+        # Builds the whole tree again from scratch. You only need to call this yourself if you've
+        # changed the size of a collider; refit() notices things being added and removed.
+        self.items = self.gather()
+
+        lows = []
+        highs = []
+
+        for item in self.items:
+            low, high = self.get_item_bounds(item)
+
+            lows.append(low)
+            highs.append(high)
+
+        self.tree = BVH(lows, highs, 1)
+
+    def refit(self):
+        # Call this once things have moved, before querying. Only the boxes that actually changed
+        # (and the ones above them) get updated.
+        items = self.gather()
+
+        if len(items) != len(self.items) or any(item is not oldItem for item, oldItem in zip(items, self.items)):
+            self.rebuild()
+            return
+
+        changed = []
+
+        for index, item in enumerate(self.items):
+            low, high = self.get_item_bounds(item)
+
+            if low != self.tree.lows[index] or high != self.tree.highs[index]:
+                self.tree.lows[index] = low
+                self.tree.highs[index] = high
+
+                changed.append(index)
+
+        self.tree.refit(changed)
+
+    def is_ignored(self, item:Abstract, ignore:list):
+        return ignore and (item in ignore or getattr(item, "body", None) in ignore)
+
+
+
+    def hit_sphere(self, sphere:SphereCollider, origin, direction, maxDistance):
+        location = sphere.objectiveLocation
+        center = [location.x, location.y, location.z]
+
+        distance = ray_hits_sphere(origin, direction, center, sphere.radius, maxDistance)
+
+        if distance is None:
+            return None
+
+        point = [origin[axis] + direction[axis] * distance for axis in range(3)]
+        normal = subtract(point, center)
+
+        if distance == 0: # We started inside it
+            normal = [-component for component in direction]
+
+        return (distance, point, normal, None)
+
+    def hit_plane(self, plane:PlaneCollider, origin, direction, maxDistance):
+        # Move the ray into the plane's space, where the plane is flat along x and z. The
+        # distortion's linear, so distances along the ray stay the same.
+        inverse = plane.get_distortion_inverse()
+        location = plane.objectiveLocation
+
+        localOrigin = apply_mat3(inverse, [origin[0] - location.x, origin[1] - location.y, origin[2] - location.z])
+        localDirection = apply_mat3(inverse, direction)
+
+        if localDirection[1] == 0:
+            return None
+
+        distance = -localOrigin[1] / localDirection[1]
+
+        if not 0 <= distance <= maxDistance:
+            return None
+
+        if (abs(localOrigin[0] + localDirection[0] * distance) > plane.width / 2 or
+                abs(localOrigin[2] + localDirection[2] * distance) > plane.length / 2):
+            return None
+
+        distortion = plane.objectiveDistortion
+        normal = [distortion.m01, distortion.m11, distortion.m21] # Where the plane's y axis points
+
+        point = [origin[axis] + direction[axis] * distance for axis in range(3)]
+
+        return (distance, point, normal, None)
+
+    def hit_mesh(self, mesh:Mesh, origin, direction, maxDistance):
+        inverse = mesh.get_distortion_inverse()
+        location = mesh.objectiveLocation
+
+        localOrigin = apply_mat3(inverse, [origin[0] - location.x, origin[1] - location.y, origin[2] - location.z])
+        localDirection = apply_mat3(inverse, direction)
+
+        hit = self.get_triangle_tree(mesh).raycast(localOrigin, localDirection, maxDistance)
+
+        if hit is None:
+            return None
+
+        distance, triIndex = hit
+
+        a, b, c = self.get_objective_triangle(mesh, triIndex)
+
+        point = [origin[axis] + direction[axis] * distance for axis in range(3)]
+
+        return (distance, point, cross(subtract(b, a), subtract(c, a)), triIndex)
+
+    def get_objective_triangle(self, mesh:Mesh, triIndex:int):
+        distortion = mesh.objectiveDistortion
+        location = mesh.objectiveLocation
+
+        corners = []
+
+        for corner in self.get_triangle_tree(mesh).corners[triIndex]:
+            x, y, z = apply_mat3(distortion, corner)
+            corners.append([x + location.x, y + location.y, z + location.z])
+
+        return corners
+
+    def hit_item(self, item:Abstract, origin, direction, maxDistance):
+        if isinstance(item, SphereCollider):
+            return self.hit_sphere(item, origin, direction, maxDistance)
+
+        if isinstance(item, PlaneCollider):
+            return self.hit_plane(item, origin, direction, maxDistance)
+
+        return self.hit_mesh(item, origin, direction, maxDistance)
+
+    def make_hit(self, item:Abstract, distance, point, normal, triIndex, direction):
+        normal = Vec3(*normal).set_magnitude(1)
+
+        if normal.get_dot_product(Vec3(*direction)) > 0: # Make it face back along the ray
+            normal.iscale(-1)
+
+        return QueryHit(item, distance, Vec3(*point), normal, triIndex)
+
+    def raycast(self, origin:Matrix, direction:Matrix, maxDistance:float=None, ignore:list=None, findAll:bool=False):
+        # Gives back a QueryHit for the closest thing along the ray, or None if it doesn't hit
+        # anything within maxDistance. If findAll is True, you get a list of everything it goes
+        # through instead, closest first.
+
+        # ignore can be a list of colliders, meshes or bodies to see straight through, which is
+        # handy for not hitting whoever's doing the looking.
+        origin = to_compact(origin)
+        direction = to_compact(direction).set_magnitude(1)
+
+        origin = [origin.x, origin.y, origin.z]
+        direction = [direction.x, direction.y, direction.z]
+
+        maxDistance = maxDistance if maxDistance is not None else math.inf
+
+        def hit_index(index, maxDistance):
+            item = self.items[index]
+
+            if self.is_ignored(item, ignore):
+                return None
+
+            hit = self.hit_item(item, origin, direction, maxDistance)
+
+            return None if hit is None else hit + (item,)
+
+        result = self.tree.query_ray(origin, direction, maxDistance, hit_index, findAll)
+
+        if findAll:
+            return [self.make_hit(hit[4], *hit[:4], direction) for hit in result]
+
+        if result is None:
+            return None
+
+        return self.make_hit(result[4], *result[:4], direction)
+
+    def can_see(self, start:Matrix, end:Matrix, ignore:list=None):
+        # Line of sight: whether there's nothing in the way between two points
+        start = to_compact(start)
+        offset = to_compact(end).subtract(start)
+
+        distance = offset.get_magnitude()
+
+        if distance == 0:
+            return True
+
+        return self.raycast(start, offset, distance, ignore) is None
+
+
+
+    def sphere_touches_mesh(self, mesh:Mesh, center, radius):
+        return self.get_triangle_tree(mesh).get_closest_point(center, radius, 
+                                                               mesh.objectiveLocation, 
+                                                               mesh.objectiveDistortion, 
+                                                               mesh.get_distortion_inverse()) is not None
+
+    def overlap_sphere(self, center:Matrix, radius:float, ignore:list=None):
+        # Gives back everything within radius of center. Planes use the same rules as they do in
+        # physics, so this finds the same things a SphereCollider there would.
+        center = to_compact(center)
+        point = [center.x, center.y, center.z]
+
+        low = [component - radius for component in point]
+        high = [component + radius for component in point]
+
+        found = []
+
+        for index in self.tree.query_box(low, high):
+            item = self.items[index]
+
+            if self.is_ignored(item, ignore):
+                continue
+
+            if isinstance(item, SphereCollider):
+                if item.objectiveLocation.subtract(center).get_magnitude() < item.radius + radius:
+                    found.append(item)
+
+            elif isinstance(item, PlaneCollider):
+                relativeToPlane = apply_mat3(item.get_distortion_inverse(),
+                                             subtract(point, [item.objectiveLocation.x, item.objectiveLocation.y, item.objectiveLocation.z]))
+
+                if (abs(relativeToPlane[0]) < item.width / 2 and
+                        abs(relativeToPlane[1]) < radius and
+                        abs(relativeToPlane[2]) < item.length / 2):
+                    found.append(item)
+
+            elif self.sphere_touches_mesh(item, point, radius):
+                found.append(item)
+
+        return found
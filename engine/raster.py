@@ -0,0 +1,118 @@
+import numpy
+
+# These are the array versions of the drawing functions in image.py. They only
+# need numpy (no pygame), so they can be imported by worker processes without
+# opening a new window for every one of them.
+
+
+
+def overlay_colour_array(colours:numpy.ndarray, colour2:tuple):
+    # Same maths as overlay_colours() in image.py, but colour2 is the same for
+    # every pixel so we only have to pick the formula once per channel.
+    result = numpy.empty(colours.shape, numpy.float32)
+
+    for i in range(3):
+        channel1 = colours[..., i] / 255
+        channel2 = colour2[i] / 255
+
+        if channel2 >= 0.5:
+            result[..., i] = 1 - 2 * (1 - channel1) * (1 - channel2)
+        else:
+            result[..., i] = 2 * channel1 * channel2
+
+    return result * 255
+
+
+
+def rasterize_triangle(colourBuffer:numpy.ndarray,
+                       depthBuffer:numpy.ndarray,
+                       vertices:tuple,
+                       depths:tuple,
+                       colours:tuple=None,
+                       uvs:tuple=None,
+                       texturePixels:numpy.ndarray=None,
+                       lightCast:tuple=None,
+                       clip:tuple=None):
+    # This is the half-space (or edge function) way of filling a triangle.
+
+    # Instead of splitting the triangle into two flat-based halves and walking down
+    # them a line at a time, we take the box the triangle fits in and ask every pixel
+    # in it "which side of each edge are you on?" all at once. If a pixel's on the
+    # inside of all three edges, it's in the triangle.
+
+    # The nice bonus is that the three edge values, divided by the area of the whole
+    # triangle, are the pixel's barycentric coordinates; how much of each vertex the
+    # pixel is made of. We can use those to blend depths, colours and UVs directly.
+
+    # colours should be three colours (pass the same one three times for a flat tri),
+    # or None if you're passing uvs and texturePixels instead.
+
+    # clip is an optional (left, top, right, bottom) box, where right and bottom
+    # aren't included. Anything outside it won't be touched.
+
+    (x1, y1), (x2, y2), (x3, y3) = vertices
+
+    left, top, right, bottom = clip if clip else (0, 0, colourBuffer.shape[1], colourBuffer.shape[0])
+
+    minX = max(min(x1, x2, x3), left)
+    maxX = min(max(x1, x2, x3), right - 1)
+    minY = max(min(y1, y2, y3), top)
+    maxY = min(max(y1, y2, y3), bottom - 1)
+
+    if minX > maxX or minY > maxY:
+        return
+
+    area = (x2 - x1) * (y3 - y1) - (y2 - y1) * (x3 - x1)
+
+    if area == 0: # It's just a line so there's nothing to fill
+        return
+
+    xs = numpy.arange(minX, maxX + 1, dtype=numpy.float64)
+    ys = numpy.arange(minY, maxY + 1, dtype=numpy.float64)[:, numpy.newaxis]
+
+    # Each weight is the edge function of the edge *opposite* its vertex
+    weight1 = ((x3 - x2) * (ys - y2) - (y3 - y2) * (xs - x2)) / area
+    weight2 = ((x1 - x3) * (ys - y3) - (y1 - y3) * (xs - x3)) / area
+    weight3 = ((x2 - x1) * (ys - y1) - (y2 - y1) * (xs - x1)) / area
+
+    # Dividing by the area flips the signs for anticlockwise triangles, so this
+    # works whichever way round the vertices are.
+    inside = (weight1 >= 0) & (weight2 >= 0) & (weight3 >= 0)
+
+    if not inside.any():
+        return
+
+    depth = weight1 * depths[0] + weight2 * depths[1] + weight3 * depths[2]
+
+    depthRegion = depthBuffer[minY:maxY + 1, minX:maxX + 1]
+    colourRegion = colourBuffer[minY:maxY + 1, minX:maxX + 1]
+
+    visible = inside & (depth <= depthRegion)
+
+    weight1 = weight1[visible]
+    weight2 = weight2[visible]
+    weight3 = weight3[visible]
+
+    if colours and colours[0] == colours[1] == colours[2]:
+        colourRegion[visible] = colours[0][:3]
+
+    elif colours:
+        blended = (numpy.outer(weight1, colours[0][:3]) +
+                   numpy.outer(weight2, colours[1][:3]) +
+                   numpy.outer(weight3, colours[2][:3]))
+
+        colourRegion[visible] = numpy.clip(numpy.floor(blended), 0, 255)
+
+    else:
+        us = numpy.floor(weight1 * uvs[0][0] + weight2 * uvs[1][0] + weight3 * uvs[2][0]).astype(numpy.intp)
+        vs = numpy.floor(weight1 * uvs[0][1] + weight2 * uvs[1][1] + weight3 * uvs[2][1]).astype(numpy.intp)
+
+        texels = texturePixels[numpy.clip(us, 0, texturePixels.shape[0] - 1),
+                               numpy.clip(vs, 0, texturePixels.shape[1] - 1)]
+
+        if lightCast:
+            colourRegion[visible] = overlay_colour_array(texels, lightCast)
+        else:
+            colourRegion[visible] = texels
+
+    depthRegion[visible] = depth[visible]
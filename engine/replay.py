@@ -0,0 +1,267 @@
+import json
+import random
+import time
+import zlib
+import numpy
+
+from engine.matrix import *
+from engine.abstract import *
+from engine.physics import *
+
+# This is for saving the whole physics world and putting it back exactly how it was, which is
+# handy for rolling back, and for replays. A replay remembers how long each frame took and which
+# keys were down, so playing it back does exactly what happened the first time, glitches and all.
+
+# Snapshots are a flat buffer of 64 bit floats (as bytes), laid out like this:
+
+#   [how many bodies, how many contacts, how many intersections]
+#   then SNAPSHOTROWSIZE numbers for each body (see take_snapshot())
+#   then two body indexes for each contact, and then for each intersection, both sorted
+
+# Bodies are stored by their position in ROOT.get_substracts_of_type(Body, True), so a snapshot
+# can only go back into the same scene it came from.
+
+# Beware! Replays only come out the same if physics runs at a fixed rate on this thread, so they
+# work with a PhysicsScheduler, but not with a PhysicsWorker.
+
+
+
+SNAPSHOTROWSIZE = 26
+
+
+
+def take_snapshot(bodies:list=None):
+    bodies = bodies if bodies is not None else ROOT.get_substracts_of_type(Body, True)
+    indexes = {body : index for index, body in enumerate(bodies)}
+
+    rows = []
+    intersections = []
+
+    for index, body in enumerate(bodies):
+        location = body.objectiveLocation
+        colliderLocation = body.collider.objectiveLocation if body.collider else location
+        velocity = to_compact(body.velocity)
+        oldLocation = body.oldObjectiveLocation
+        lastStep = body.lastStep if body.lastStep is not None else ORIGIN
+        averageVelocity = body.averageVelocity
+
+        # Forces get added up in the same order apply_forces() does it, so the total comes out the same
+        force = Vec3(0, 0, 0)
+
+        for each in body.forces:
+            force.iadd(to_compact(each))
+
+        island = indexes.get(body.island[0], -1) if body.island else -1
+
+        rows += (location.x, location.y, location.z,
+                 colliderLocation.x, colliderLocation.y, colliderLocation.z,
+                 velocity.x, velocity.y, velocity.z,
+                 oldLocation.x, oldLocation.y, oldLocation.z,
+                 force.x, force.y, force.z,
+                 lastStep.x, lastStep.y, lastStep.z,
+                 averageVelocity.x, averageVelocity.y, averageVelocity.z,
+                 len(body.forces), body.lastStep is not None, body.sleeping, body.stillTime, island)
+
+        for otherBody in body.intersections:
+            if otherBody in indexes:
+                intersections.append((index, indexes[otherBody]))
+
+    contacts = []
+
+    for collider, otherCollider in CONTACTS.contacts:
+        if collider.body in indexes and otherCollider.body in indexes:
+            contacts.append(tuple(sorted((indexes[collider.body], indexes[otherCollider.body]))))
+
+    # Contacts come out of a set, in an order that depends on where things happen to be in memory,
+    # so these get sorted. Otherwise the same world could give two different snapshots.
+    contacts.sort()
+    intersections.sort()
+
+    header = [len(bodies), len(contacts), len(intersections)]
+    pairs = [index for pair in contacts + intersections for index in pair]
+
+    return numpy.array(header + rows + pairs, numpy.float64).tobytes()
+
+def restore_snapshot(snapshot:bytes, bodies:list=None):
+    # Puts every body back how it was when the snapshot was taken. Gives back False if the
+    # snapshot doesn't fit this scene.
+    bodies = bodies if bodies is not None else ROOT.get_substracts_of_type(Body, True)
+
+    values = numpy.frombuffer(snapshot, numpy.float64).tolist()
+
+    bodyCount, contactCount, intersectionCount = [int(value) for value in values[:3]]
+
+    if bodyCount != len(bodies):
+        print(f"This snapshot has {bodyCount} bodies but the scene has {len(bodies)}, so it can't be restored")
+        return False
+
+    start = 3
+    islands = {}
+
+    for body in bodies:
+        (x, y, z,
+         colliderX, colliderY, colliderZ,
+         velocityX, velocityY, velocityZ,
+         oldX, oldY, oldZ,
+         forceX, forceY, forceZ,
+         stepX, stepY, stepZ,
+         averageX, averageY, averageZ,
+         forceCount, hasLastStep, sleeping, stillTime, island) = values[start:start + SNAPSHOTROWSIZE]
+
+        start += SNAPSHOTROWSIZE
+
+        body.set_location_objective(Vec3(x, y, z))
+
+        # Moving the body moves the collider by the same amount, which can be off by a rounding
+        # error, so it gets put exactly where it was too. In lazy mode it'll work itself out
+        # from the body's location the same way it did the first time anyway.
+        if body.collider and not body.collider.transformDirty:
+            body.collider.objectiveLocation = Vec3(colliderX, colliderY, colliderZ)
+
+        body.velocity = Vec3(velocityX, velocityY, velocityZ)
+        body.oldObjectiveLocation = Vec3(oldX, oldY, oldZ)
+        body.forces = [Vec3(forceX, forceY, forceZ)] if forceCount else []
+        body.lastStep = Vec3(stepX, stepY, stepZ) if hasLastStep else None
+        body.averageVelocity = Vec3(averageX, averageY, averageZ)
+
+        body.sleeping = bool(sleeping)
+        body.stillTime = stillTime
+        body.island = None
+        body.sleepingBounds = None
+        body.intersections = []
+
+        if island >= 0:
+            islands.setdefault(int(island), []).append(body)
+
+    for island in islands.values():
+        for body in island:
+            body.island = island
+
+    CONTACTS.contacts = set()
+    CONTACTS.previousContacts = set()
+
+    for i in range(contactCount):
+        body = bodies[int(values[start])]
+        otherBody = bodies[int(values[start + 1])]
+
+        CONTACTS.contacts.add(CONTACTS.get_key(body.collider, otherBody.collider))
+        start += 2
+
+    for i in range(intersectionCount):
+        bodies[int(values[start])].intersections.append(bodies[int(values[start + 1])])
+        start += 2
+
+    return True
+
+
+
+class ReplayKeys():
+    # This stands in for pygame.key.get_pressed() while a replay's playing
+    def __init__(self, pressedKeys:list):
+        self.pressedKeys = set(pressedKeys)
+
+    def __getitem__(self, key:int):
+        return key in self.pressedKeys
+
+
+
+class Replay():
+    # Call frame() once a frame, straight after getting the keys, and use the frame delta and
+    # keys it gives back instead of your own. While recording they're just passed through, and
+    # while playing they're swapped for the recorded ones.
+
+    # Only the keys in watchedKeys get recorded, so list every key your game checks.
+    def __init__(self, watchedKeys:list=None, scheduler:PhysicsScheduler=None):
+        self.watchedKeys = watchedKeys if watchedKeys else []
+        self.scheduler = scheduler # If there is one, how much time it had saved up gets recorded too
+
+        self.seed = None
+        self.snapshot = None
+        self.accumulator = 0
+
+        self.frames = [] # (frame delta, pressed keys, checksum of the physics world at the start of the frame)
+
+        self.recording = False
+        self.playing = False
+
+        self.frameIndex = 0
+        self.divergedAt = None # The first frame where playing back didn't match the recording
+
+    def start_recording(self, seed:int=None):
+        # random gets seeded so anything random in your game comes out the same when it's played back
+        self.seed = seed if seed is not None else time.time_ns()
+        random.seed(self.seed)
+
+        self.snapshot = take_snapshot()
+        self.accumulator = self.scheduler.accumulator if self.scheduler else 0
+
+        self.frames = []
+
+        self.recording = True
+        self.playing = False
+
+    def start_playing(self):
+        if self.snapshot is None:
+            print("There's nothing recorded to play back")
+            return
+
+        random.seed(self.seed)
+
+        restore_snapshot(self.snapshot)
+
+        if self.scheduler:
+            self.scheduler.accumulator = self.accumulator
+
+        self.frameIndex = 0
+        self.divergedAt = None
+
+        self.recording = False
+        self.playing = True
+
+    def stop(self):
+        self.recording = False
+        self.playing = False
+
+    def frame(self, frameDelta:float, keys):
+        if not (self.recording or self.playing):
+            return frameDelta, keys
+
+        checksum = zlib.crc32(take_snapshot())
+
+        if self.recording:
+            self.frames.append((frameDelta, [key for key in self.watchedKeys if keys[key]], checksum))
+
+            return frameDelta, keys
+
+        if self.frameIndex >= len(self.frames):
+            print("The replay's finished")
+            self.playing = False
+
+            return frameDelta, keys
+
+        frameDelta, pressedKeys, recordedChecksum = self.frames[self.frameIndex]
+
+        if checksum != recordedChecksum and self.divergedAt is None:
+            print(f"The replay's gone differently to the recording on frame {self.frameIndex}")
+            self.divergedAt = self.frameIndex
+
+        self.frameIndex += 1
+
+        return frameDelta, ReplayKeys(pressedKeys)
+
+    def save(self, path:str):
+        # JSON writes floats out with enough digits that they come back exactly the same
+        with open(path, "w") as file:
+            json.dump({"seed" : self.seed,
+                       "snapshot" : self.snapshot.hex() if self.snapshot is not None else None,
+                       "accumulator" : self.accumulator,
+                       "frames" : self.frames}, file)
+
+    def load(self, path:str):
+        with open(path, "r") as file:
+            saved = json.load(file)
+
+        self.seed = saved["seed"]
+        self.snapshot = bytes.fromhex(saved["snapshot"]) if saved["snapshot"] is not None else None
+        self.accumulator = saved["accumulator"]
+        self.frames = [tuple(frame) for frame in saved["frames"]]
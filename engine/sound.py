@@ -59,7 +59,7 @@ class Listener(Abstract):
     def listen(self):
         sounds = ROOT.get_substracts_of_type(SoundEffect)
 
-        inversion = self.objectiveDistortion.get_3x3_inverse()
+        inversion = self.get_distortion_inverse()
 
         for sound in sounds:
             if sound.channel:
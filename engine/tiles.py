@@ -0,0 +1,203 @@
+import atexit
+import multiprocessing
+import os
+import signal
+import numpy
+
+from multiprocessing import shared_memory
+
+from engine.raster import *
+
+# This is the multi-core version of the half-space rasterizer.
+
+# The screen gets chopped up into square tiles, and every projected triangle is
+# put in the "bin" of each tile its bounding box touches. Then a pool of worker
+# processes fills the tiles in parallel, writing straight into a colour buffer
+# and depth buffer that live in shared memory, so nothing has to be copied back.
+
+# Each pixel only belongs to one tile, and each tile draws its triangles in the
+# same order they were submitted, so the result is exactly what you'd get from
+# drawing everything on one core with rasterize_triangle().
+
+# Beware! On Windows and macOS, Python starts worker processes by re-running your
+# main script, so your game loop needs to be inside an if __name__ == "__main__":
+# block if you want to use this there.
+
+
+
+# These only get filled in inside the worker processes
+
+workerColourBuffer = None
+workerDepthBuffer = None
+workerBlocks = {}
+workerTextures = {}
+
+
+
+def attach_shared_array(name:str, shape:tuple, dtype:str):
+    block = shared_memory.SharedMemory(name=name)
+    workerBlocks[name] = block # If the block gets garbage collected the array goes with it
+
+    return numpy.ndarray(shape, numpy.dtype(dtype), block.buf)
+
+def create_shared_array(array:numpy.ndarray, blocks:list):
+    # Copies array into a new block of shared memory, which gets added to blocks so it can be
+    # freed later. Gives back the shared copy, and what a worker needs to attach_shared_array() it.
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+
+    sharedArray = numpy.ndarray(array.shape, array.dtype, block.buf)
+    sharedArray[...] = array
+
+    return sharedArray, (block.name, array.shape, array.dtype.str)
+
+def free_shared_blocks(blocks:list):
+    # Only do this once nothing's using the arrays in them any more
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+    blocks.clear()
+
+def start_worker(colourInfo:tuple, depthInfo:tuple):
+    global workerColourBuffer, workerDepthBuffer
+
+    # Workers get forked from a process where SDL has already hijacked SIGTERM to make
+    # quit events, which would stop the pool from ever being able to kill them
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    workerColourBuffer = attach_shared_array(*colourInfo)
+    workerDepthBuffer = attach_shared_array(*depthInfo)
+
+def render_tiles(jobs:list):
+    for clip, triangles in jobs:
+        for vertices, depths, colours, uvs, textureInfo, lightCast in triangles:
+            texturePixels = None
+
+            if textureInfo:
+                if textureInfo[0] not in workerTextures:
+                    workerTextures[textureInfo[0]] = attach_shared_array(*textureInfo)
+
+                texturePixels = workerTextures[textureInfo[0]]
+
+            rasterize_triangle(workerColourBuffer, workerDepthBuffer,
+                               vertices, depths, colours, uvs, texturePixels, lightCast, clip)
+
+
+
+class TileRenderer():
+    def __init__(self, colourImage, depthImage, workers:int=None, tileSize:int=None):
+        self.workers = workers if workers else os.cpu_count()
+        self.tileSize = tileSize if tileSize else 32
+
+        self.colourImage = colourImage
+        self.depthImage = depthImage
+
+        self.blocks = []
+        self.sharedTextures = {}
+
+        # Move both images into shared memory. The images keep working exactly the same
+        # (fill(), render_image() etc.), their contents just live somewhere the workers can see.
+        colourInfo = self.share_image(colourImage)
+        depthInfo = self.share_image(depthImage)
+
+        self.pool = multiprocessing.Pool(self.workers, start_worker, (colourInfo, depthInfo))
+
+        self.queue = []
+
+        atexit.register(self.close)
+
+    def share_array(self, array:numpy.ndarray):
+        return create_shared_array(array, self.blocks)
+
+    def share_image(self, image):
+        image.contents, info = self.share_array(image.contents)
+
+        return info
+
+    def share_texture(self, texturePixels:numpy.ndarray):
+        # Textures get copied into shared memory the first time they're drawn, and
+        # then the workers just get told where to find them
+        key = id(texturePixels)
+
+        if key not in self.sharedTextures:
+            self.sharedTextures[key] = (texturePixels, self.share_array(texturePixels)[1]) # Keep hold of the original so its id stays unique
+
+        return self.sharedTextures[key][1]
+
+    def queue_triangle(self,
+                       vertices:tuple,
+                       depths:tuple,
+                       colours:tuple=None,
+                       uvs:tuple=None,
+                       texturePixels:numpy.ndarray=None,
+                       lightCast:tuple=None):
+        # Same arguments as rasterize_triangle(), minus the buffers
+        textureInfo = self.share_texture(texturePixels) if texturePixels is not None else None
+
+        self.queue.append((vertices, depths, colours, uvs, textureInfo, lightCast))
+
+    def bin_triangles(self):
+        resolution = (self.colourImage.contents.shape[1], self.colourImage.contents.shape[0])
+
+        tilesAcross = -(-resolution[0] // self.tileSize) # This is ceiling division
+        tilesDown = -(-resolution[1] // self.tileSize)
+
+        bins = [[] for i in range(tilesAcross * tilesDown)]
+
+        for triangle in self.queue:
+            xs = (triangle[0][0][0], triangle[0][1][0], triangle[0][2][0])
+            ys = (triangle[0][0][1], triangle[0][1][1], triangle[0][2][1])
+
+            left = max(min(xs), 0) // self.tileSize
+            right = min(max(xs), resolution[0] - 1) // self.tileSize
+            top = max(min(ys), 0) // self.tileSize
+            bottom = min(max(ys), resolution[1] - 1) // self.tileSize
+
+            for tileY in range(top, bottom + 1):
+                for tileX in range(left, right + 1):
+                    bins[tileY * tilesAcross + tileX].append(triangle)
+
+        jobs = []
+
+        for tileY in range(tilesDown):
+            for tileX in range(tilesAcross):
+                triangles = bins[tileY * tilesAcross + tileX]
+
+                if triangles:
+                    clip = (tileX * self.tileSize,
+                            tileY * self.tileSize,
+                            min((tileX + 1) * self.tileSize, resolution[0]),
+                            min((tileY + 1) * self.tileSize, resolution[1]))
+
+                    jobs.append((clip, triangles))
+
+        return jobs
+
+    def flush(self):
+        # Draws everything that's been queued since the last flush, and waits for it to finish
+        if not self.queue:
+            return
+
+        jobs = self.bin_triangles()
+        self.queue = []
+
+        # Deal the tiles out like cards so every worker gets a mix of busy and empty bits of the screen
+        hands = [jobs[i::self.workers] for i in range(self.workers)]
+
+        self.pool.map(render_tiles, [hand for hand in hands if hand])
+
+    def close(self):
+        if not self.blocks:
+            return
+
+        self.pool.close()
+        self.pool.join()
+
+        # Give the images their own memory back before we free the shared blocks
+        self.colourImage.contents = self.colourImage.contents.copy()
+        self.depthImage.contents = self.depthImage.contents.copy()
+
+        free_shared_blocks(self.blocks)
+
+        self.sharedTextures = {}
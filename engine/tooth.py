@@ -17,4 +17,13 @@ from engine.mesh import *
 from engine.sound import *
 
 # And here's our physics engine
-from engine.physics import *
\ No newline at end of file
+from engine.physics import *
+
+# This lets us ask what's where without waiting for physics
+from engine.query import *
+
+# This lets physics run on its own core
+from engine.physicsworker import *
+
+# This lets us rewind physics and replay what happened
+from engine.replay import *
\ No newline at end of file
@@ -0,0 +1,219 @@
+from engine.physics import *
+import argparse
+import json
+import math
+import platform
+import random
+import time
+
+# This measures how fast process_bodies() is, without a window, a camera or anything else
+# getting in the way. It builds a few different kinds of scene at a few different sizes, runs
+# each one for a fixed number of ticks, and tells you how many ticks a second it managed, how
+# many pairs of colliders it had to check each tick and where the time went.
+
+# Run it like this:
+
+#   python physicsBenchmark.py
+#   python physicsBenchmark.py --counts 10 100 1000 --scenes box pile --world
+#   python physicsBenchmark.py --output new.json --compare old.json
+
+# The results get saved as JSON, so you can compare them with another build's using --compare.
+
+# Every scene is made the same way each time (the random numbers are seeded with its size), so
+# if the numbers change, it's the engine that changed and not the scene.
+
+
+
+SCENES = ["box", "pile", "tripvolumes"]
+COUNTS = [10, 100, 1000] # How many bodies go in each scene. You're free to change these
+TICKS = 240 # How many ticks each scene gets run for
+TICKDELTA = 1 / 120
+
+BALLRADIUS = 0.25
+
+SLOWERTHRESHOLD = 0.1 # With --compare, anything this much slower (as a fraction) than before gets pointed out
+
+
+
+def make_box(holder:Abstract, side:float, height:float):
+    # A floor and four walls facing inwards. Each wall's distortion turns its y axis (the way
+    # it faces) to point into the box.
+    walls = [(Vec3(0, 0, 0), Mat3(1, 0, 0, 0, 1, 0, 0, 0, 1), side, side),
+             (Vec3(-side / 2, height / 2, 0), Mat3(0, 1, 0, -1, 0, 0, 0, 0, 1), height, side),
+             (Vec3(side / 2, height / 2, 0), Mat3(0, -1, 0, 1, 0, 0, 0, 0, 1), height, side),
+             (Vec3(0, height / 2, -side / 2), Mat3(1, 0, 0, 0, 0, -1, 0, 1, 0), side, height),
+             (Vec3(0, height / 2, side / 2), Mat3(1, 0, 0, 0, 0, 1, 0, -1, 0), side, height)]
+
+    for location, distortion, width, length in walls:
+        wall = Body(1, 0.5, 1, False, location, distortion)
+        PlaneCollider(width, length, wall)
+
+        holder.add_child_relative(wall)
+
+def make_ball(holder:Abstract, location:Matrix, velocity:Matrix=None):
+    ball = Body(1, 0.5, 5, True, location)
+    SphereCollider(BALLRADIUS, ball)
+
+    if velocity:
+        ball.velocity = velocity
+
+    holder.add_child_relative(ball)
+
+    return ball
+
+def build_box_scene(holder:Abstract, count:int, rng:random.Random):
+    # Balls thrown about at random in a box, which grows with the number of balls so it's
+    # always about as crowded
+    side = max(3, 1.2 * count ** (1 / 3))
+
+    make_box(holder, side, side * 2)
+
+    for i in range(count):
+        make_ball(holder,
+                  Vec3(rng.uniform(-side / 2, side / 2) * 0.9, rng.uniform(0.5, side), rng.uniform(-side / 2, side / 2) * 0.9),
+                  Vec3(rng.uniform(-2, 2), rng.uniform(-2, 2), rng.uniform(-2, 2)))
+
+def build_pile_scene(holder:Abstract, count:int, rng:random.Random):
+    # Columns of balls stacked straight on top of each other, so most of the work is resting
+    # contact rather than things flying about. The columns soon topple over, and the pile falls
+    # asleep once it's settled (about 6 seconds in for 50 balls, 20 for 100).
+    height = 5
+    columns = math.ceil(count / height)
+    across = math.ceil(math.sqrt(columns))
+    spacing = BALLRADIUS * 2.4
+
+    side = across * spacing + 1
+
+    make_box(holder, side, height)
+
+    for i in range(count):
+        column = i // height
+        row, collumb = divmod(column, across)
+
+        make_ball(holder, Vec3((collumb - across / 2 + 0.5) * spacing + rng.uniform(-0.01, 0.01),
+                               BALLRADIUS + (i % height) * BALLRADIUS * 2,
+                               (row - across / 2 + 0.5) * spacing + rng.uniform(-0.01, 0.01)))
+
+def build_tripvolume_scene(holder:Abstract, count:int, rng:random.Random):
+    # Half of the bodies are TripVolumes in a grid, and the other half are balls falling through them
+    volumes = count // 2
+    across = max(1, math.ceil(volumes ** (1 / 3)))
+    spacing = 1.5
+
+    side = across * spacing + 1
+
+    make_box(holder, side, across * spacing * 2)
+
+    for i in range(volumes):
+        x, rest = divmod(i, across * across)
+        y, z = divmod(rest, across)
+
+        volume = TripVolume(Vec3((x - across / 2 + 0.5) * spacing, 1 + y * spacing, (z - across / 2 + 0.5) * spacing))
+        SphereCollider(0.5, volume)
+
+        holder.add_child_relative(volume)
+
+    for i in range(count - volumes):
+        make_ball(holder,
+                  Vec3(rng.uniform(-side / 2, side / 2) * 0.9, rng.uniform(1, across * spacing * 1.5), rng.uniform(-side / 2, side / 2) * 0.9),
+                  Vec3(rng.uniform(-1, 1), 0, rng.uniform(-1, 1)))
+
+SCENEBUILDERS = {
+    "box" : build_box_scene,
+    "pile" : build_pile_scene,
+    "tripvolumes" : build_tripvolume_scene
+}
+
+
+
+def run_benchmark(scene:str, count:int, ticks:int, useWorld:bool):
+    holder = Abstract()
+    ROOT.add_child_relative(holder)
+
+    SCENEBUILDERS[scene](holder, count, random.Random(count))
+
+    bodies = holder.get_substracts_of_type(Body, True)
+    world = PhysicsWorld() if useWorld else None
+
+    STATS.reset()
+
+    startTime = time.perf_counter()
+
+    for i in range(ticks):
+        process_bodies(TICKDELTA, world)
+
+    seconds = time.perf_counter() - startTime
+
+    result = {
+        "scene" : scene,
+        "count" : count,
+        "bodies" : len(bodies),
+        "ticks" : ticks,
+        "seconds" : seconds,
+        "ticksPerSecond" : ticks / seconds,
+        "pairTestsPerTick" : STATS.pairTests / ticks,
+        "msPerTick" : {phase : phaseTime / ticks * 1000 for phase, phaseTime in STATS.phaseTimes.items()},
+        "sleepingAtEnd" : sum(body.sleeping for body in bodies)
+    }
+
+    # Everything else process_bodies() does, like finding the bodies in the first place
+    result["msPerTick"]["other"] = seconds / ticks * 1000 - sum(result["msPerTick"].values())
+
+    # Clear the scene away so it doesn't get in the way of the next one
+    holder.kill_self_and_substracts()
+
+    CONTACTS.contacts = set()
+    CONTACTS.previousContacts = set()
+
+    return result
+
+def print_result(result:dict, previous:dict=None):
+    phases = "  ".join(f"{phase} {phaseTime:7.3f}" for phase, phaseTime in result["msPerTick"].items())
+
+    line = (f"{result['scene']:>12} {result['count']:>6}  "
+            f"{result['ticksPerSecond']:9.1f} ticks/s  {result['pairTestsPerTick']:9.1f} pairs/tick  ms/tick: {phases}")
+
+    if previous:
+        change = result["ticksPerSecond"] / previous["ticksPerSecond"] - 1
+        line += f"  ({change:+.1%} vs before{', SLOWER' if change < -SLOWERTHRESHOLD else ''})"
+
+    print(line)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks process_bodies() on scenes of different sizes")
+
+    parser.add_argument("--scenes", nargs="+", choices=SCENES, default=SCENES)
+    parser.add_argument("--counts", nargs="+", type=int, default=COUNTS)
+    parser.add_argument("--ticks", type=int, default=TICKS)
+    parser.add_argument("--world", action="store_true", help="Integrate with a PhysicsWorld")
+    parser.add_argument("--output", default="physicsBenchmark.json", help="Where to save the results")
+    parser.add_argument("--compare", help="Results from an earlier run to compare against")
+
+    arguments = parser.parse_args()
+
+    previousResults = {}
+
+    if arguments.compare:
+        with open(arguments.compare, "r") as file:
+            for result in json.load(file)["results"]:
+                previousResults[(result["scene"], result["count"])] = result
+
+    results = []
+
+    for scene in arguments.scenes:
+        for count in arguments.counts:
+            result = run_benchmark(scene, count, arguments.ticks, arguments.world)
+            results.append(result)
+
+            print_result(result, previousResults.get((scene, count)))
+
+    with open(arguments.output, "w") as file:
+        json.dump({"python" : platform.python_version(),
+                   "machine" : platform.machine(),
+                   "world" : arguments.world,
+                   "tickDelta" : TICKDELTA,
+                   "results" : results}, file, indent=4)
+
+    print(f"Saved results to {arguments.output}")
@@ -79,6 +79,8 @@ teapot = Wavefront("lowPolyUtahTeapot.obj",
 
 environment.add_child_relative(teapot)
 
+teapot.use_quaternion_orientation() # It spins every frame, so this keeps it from slowly getting squashed
+
 leftWall = Body(1, 0.8, 5, False, Matrix([[-2],
                                           [1],
                                           [0]]), Matrix([[0, 1, 0],
@@ -158,6 +160,7 @@ lightCarousel = Abstract(Matrix([[5],
                                  [0]]))
 
 environment.add_child_relative(lightCarousel)
+lightCarousel.use_quaternion_orientation()
 
 lights = []
 
@@ -191,6 +194,11 @@ passthroughTestCollider = SphereCollider(3, passthroughTest)
 
 environment.add_child_relative(passthroughTest)
 
+# Rather than checking passthroughTest.intersections every frame, we can just be told when things 
+# go in and out of it
+passthroughTest.contact_entered = lambda body: print(f"{body.tags} went into the passthrough test")
+passthroughTest.contact_exited = lambda body: print(f"{body.tags} came out of the passthrough test")
+
 
 
 # ---------------- PER FRAME PROCESS FUNCTIONS ----------------
@@ -311,6 +319,28 @@ def analyse_framerate(frameDelta:float):
 
 frameDelta = 0
 
+PHYSICSWORKER = False # Set this to True to run physics in its own process, on its own core
+
+if PHYSICSWORKER:
+    physicsWorker = PhysicsWorker(120)
+
+# Physics runs at 120 ticks a second no matter what the framerate is, and if it falls behind it'll
+# only do up to 8 ticks a frame to catch up
+physicsScheduler = PhysicsScheduler(120, 8)
+
+REPLAYFILE = None # Set this to a file name like "replay.json" to record everything you do into it,
+PLAYREPLAY = False # and then set this to True to watch it happen again exactly the same
+
+replay = Replay([pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d, pygame.K_SPACE, pygame.K_LSHIFT, 
+                 pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_b], physicsScheduler)
+
+if REPLAYFILE and not PHYSICSWORKER:
+    if PLAYREPLAY:
+        replay.load(REPLAYFILE)
+        replay.start_playing()
+    else:
+        replay.start_recording()
+
 running = True
 
 while running:
@@ -324,21 +354,29 @@ while running:
 
     keys = pygame.key.get_pressed()
 
+    frameDelta, keys = replay.frame(frameDelta, keys) # This does nothing unless we're recording or playing
+
     process_player(frameDelta, keys)
     process_teapot(frameDelta, keys)
     process_lights(frameDelta)
     process_balls()
 
-    print(f"\n\n\n\n\n\n\nIntersecting with: {passthroughTest.intersections}")
+    if PHYSICSWORKER:
+        physicsWorker.sync(frameDelta) # This moves everything to wherever the worker's got it to
+        process_sensors()
 
-    physicsDelta = frameDelta / 2
-    for i in range(2):
-        process_bodies(physicsDelta)
-        
-    process_sensors()
+    else:
+        physicsScheduler.update(frameDelta)
+
+        physicsScheduler.blend_bodies() # This draws everything where it'd be in between physics ticks
+        process_sensors()
+        physicsScheduler.unblend_bodies()
         
     frameDelta = time.time() - startTime
     
     analyse_framerate(frameDelta)
 
-    pygame.display.flip()
\ No newline at end of file
+    pygame.display.flip()
+
+if replay.recording:
+    replay.save(REPLAYFILE)